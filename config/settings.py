@@ -39,6 +39,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 USER_APPS = [
@@ -54,6 +55,8 @@ THIRD_PARTY_APPS = [
 INSTALLED_APPS = DJANGO_APPS + USER_APPS + THIRD_PARTY_APPS
 
 MIDDLEWARE = [
+    # first, so that its total time covers the other middleware
+    'trading_platform.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'trading_platform.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -94,6 +98,31 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': os.getenv('POSTGRES_PORT'),
+        # Connections are kept open between requests and checked before reuse. Under ASGI every request runs
+        # in a thread of its own, so set POSTGRES_CONN_MAX_AGE=0 there and pool with PgBouncer instead.
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Read replicas, as comma-separated host:port. In tests they mirror the default database.
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT'], 'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['trading_platform.replicas.ReplicaRouter']
+
+# Seconds a client reads from the primary after a write, longer than the replication lag
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', '5'))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'trading-platform'),
     }
 }
 
@@ -138,9 +167,40 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Rest Framework settings
 REST_FRAMEWORK = {
+    # Sessions first: without credentials the API answers 403, as before tokens were added
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'user.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'trading_platform.pagination.OptInPagination',
+    # Token buckets per client and endpoint, see trading_platform.throttling
+    'DEFAULT_THROTTLE_CLASSES': [
+        'trading_platform.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'api': os.getenv('API_THROTTLE_RATE', '1200/min'),
+        'bulk': os.getenv('API_THROTTLE_BULK_RATE', '60/min'),
+        'export': os.getenv('API_THROTTLE_EXPORT_RATE', '10/min'),
+    },
 }
 
+# Lifetime of the API tokens, and how long a process caches the user of a token
+API_TOKEN_MAX_AGE = int(os.getenv('API_TOKEN_MAX_AGE', str(30 * 24 * 3600)))
+API_TOKEN_USER_CACHE_TTL = int(os.getenv('API_TOKEN_USER_CACHE_TTL', '60'))
+
 AUTH_USER_MODEL = 'user.User'
+
+# Server-Timing headers on the responses, and the request histograms served at /metrics (see trading_platform.metrics):
+# with several worker processes, a directory where every process writes its histograms every few seconds,
+# and the bearer token of the Prometheus scraper (superusers may read /metrics with their session)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Render the network node list and detail from values() rows instead of model instances
+NETWORK_NODE_VALUES_READ = os.getenv('NETWORK_NODE_VALUES_READ', 'False') == 'True'
@@ -21,6 +21,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from trading_platform.views import metrics
+
 schema_view = get_schema_view(
     openapi.Info(
         title="App Trading Platform secret API Documentation",
@@ -41,4 +43,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
     path('platform/', include('trading_platform.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
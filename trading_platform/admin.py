@@ -1,7 +1,11 @@
 from django.contrib import admin
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 
-from trading_platform.models import NetworkNode, Product
+from trading_platform.jobs import ClearDebtJob, enqueue
+from trading_platform.models import Job, NetworkNode, Product
 
 
 """
@@ -13,24 +17,87 @@ from django.utils.html import format_html
 from trading_platform.models import NetworkNode, Product
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the number of rows of an unfiltered changelist from the planner's estimate
+    (NetworkNodeManager.estimated_count()) once it is above estimate_above, instead of running COUNT(*).
+    """
+
+    estimate_above = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = queryset.model.objects.db_manager(queryset.db).estimated_count()
+            if estimate > self.estimate_above:
+                return estimate
+        return super().count
+
+
+class CityListFilter(admin.SimpleListFilter):
+    """
+    Filter by city. The cities are read with NetworkNodeManager.distinct_cities() and cached for cache_timeout seconds.
+    """
+
+    title = 'Город'
+    parameter_name = 'city'
+    cache_key = 'admin:networknode:cities'
+    cache_timeout = 600
+
+    def lookups(self, request, model_admin):
+        cities = cache.get_or_set(self.cache_key, NetworkNode.objects.distinct_cities, self.cache_timeout)
+        return [(city, city) for city in cities]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(city=self.value())
+        return queryset
+
+
 @admin.register(NetworkNode)
 class NetworkNodeAdmin(admin.ModelAdmin):
     """
     Django Admin Model for NetworkNode
+
+    The changelist joins the supplier, takes its row count from the planner's estimate on large tables and
+    reads the city filter from the cache. Suppliers and products are chosen with autocomplete widgets,
+    so the change form does not load every node and product.
     """
     list_display = (
         'id', 'name', 'level', 'email', 'city', 'street', 'house_number', 'node_type', 'supplier_link', 'debt',
         'created_at',
         'object_link')
-    list_filter = ('city',)
+    list_filter = (CityListFilter,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    search_fields = ('search_document',)
+    autocomplete_fields = ('supplier', 'products')
     actions = ['clear_debt']
 
+    def get_readonly_fields(self, request, obj=None):
+        """
+        The debt of an existing node only changes through the debt ledger (DebtMovement).
+        """
+        if obj is not None:
+            return ('debt',)
+        return ()
+
+    def get_queryset(self, request):
+        """
+        Returns the nodes with their suppliers, without the search columns of the suppliers.
+        """
+        return super().get_queryset(request).select_related('supplier').defer(
+            *(f'supplier__{name}' for name in NetworkNode.objects.SEARCH_FIELDS)
+        )
+
     def supplier_link(self, obj):
         """
         Returns a link to the Supplier of the given NetworkNode
         """
         if obj.supplier:
-            url = f"/platform/network-node/{obj.supplier.pk}"
+            url = f"/platform/network-node/{obj.supplier_id}"
             return format_html('<a href="{}">{}</a>', url, obj.supplier.name)
         return '-'
 
@@ -50,10 +117,45 @@ class NetworkNodeAdmin(admin.ModelAdmin):
     @admin.action(description='Очистить задолженность перед поставщиком')
     def clear_debt(self, request, queryset):
         """
-        Clears the debt of the selected NetworkNodes and displays a message
+        Queues a job that clears the debt of the selected NetworkNodes in chunks, and displays a message
+        """
+        job = enqueue('clear_debt', ClearDebtJob.selection(queryset), user=request.user)
+        self.message_user(request, f"Задача №{job.pk} по очистке задолженности поставлена в очередь.")
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    """
+    Django Admin Model for Product, searchable for the products autocomplete of NetworkNodeAdmin
+    """
+    search_fields = ('name', 'model')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Django Admin Model for Job, read-only: the jobs are created by admin actions and run by run_workers
+    """
+    list_display = ('id', 'kind', 'status', 'progress', 'created_by', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('created_by',)
+    fields = readonly_fields = (
+        'kind', 'status', 'progress', 'params', 'state', 'error', 'worker', 'created_by', 'created_at', 'started_at',
+        'heartbeat_at', 'finished_at'
+    )
+
+    def progress(self, obj):
+        """
+        Returns the progress of the given Job, e.g. '500 / 2000 (25%)'
         """
-        queryset.update(debt=0)
-        self.message_user(request, "Задолженность очищена у выбранных объектов.")
+        if not obj.total:
+            return str(obj.done)
+        return f'{obj.done} / {obj.total} ({obj.done * 100 // obj.total}%)'
+
+    progress.short_description = 'Прогресс'
 
+    def has_add_permission(self, request):
+        return False
 
-admin.site.register(Product)
+    def has_change_permission(self, request, obj=None):
+        return False
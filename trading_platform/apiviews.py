@@ -1,29 +1,199 @@
-from rest_framework import viewsets
+from django.conf import settings
+from django.db import DataError, transaction
+from django.db.models import DecimalField, ExpressionWrapper, Prefetch, Sum
+from django.http import Http404
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
 
-from trading_platform.models import Product, NetworkNode
-from trading_platform.permissions import IsActive
-from trading_platform.serializers import ProductSerializer, NetworkNodeSerializer
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, CacheResponseMixin, bump_after_sql_write, get_counters, subtree
+from trading_platform.export import ExportMixin
+from trading_platform.filters import NetworkNodeFilterBackend, NetworkNodeSearchBackend
+from trading_platform.metrics import ServerTimingMixin
+from trading_platform.models import DebtMovement, Product, NetworkNode, NetworkStats, NetworkStatsRefresh
+from trading_platform.permissions import IsActive, IsSuperuser
+from trading_platform.serializers import ProductSerializer, NetworkNodeSerializer, NetworkNodeRowSerializer, \
+    NetworkNodeBulkSerializer, NetworkNodeMoveSerializer, NetworkNodeSupplierSerializer, NetworkNodeValuesSerializer, \
+    NetworkStatsSerializer, ProductUpsertSerializer, DebtAsOfSerializer, DebtMovementSerializer
+from trading_platform.throttling import get_throttle_counters
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class SparseFieldsetMixin:
     """
-    API endpoint that allows products to be viewed or edited.
+    Parses the 'fields' and 'expand' query parameters of the list and retrieve actions, and passes them
+    to the serializer.
+
+    'fields' is a comma-separated list of the fields to return and 'expand' of the expandable_fields to add
+    as nested objects. Without either the full representation is returned. With any of them the response is
+    sparse: only the listed fields, all but the opt_in_fields if 'fields' is not given, plus the expanded ones.
+    """
+
+    sparse_actions = ('list', 'retrieve')
+    expandable_fields = ()
+    opt_in_fields = ()
+
+    def _sparse_fields(self, request):
+        """
+        Returns the (fields, expand) requested, or (None, ()) for the full representation.
+        """
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if not fields and not expand:
+            return None, ()
+        readable = [name for name, field in self.serializer_class().fields.items() if not field.write_only]
+        expand = [name.strip() for name in (expand or '').split(',') if name.strip()]
+        unknown = [name for name in expand if name not in self.expandable_fields]
+        if unknown:
+            raise ValidationError({'expand': f"Unknown relations: {', '.join(unknown)}"})
+        if fields:
+            fields = [name.strip() for name in fields.split(',') if name.strip()]
+            unknown = [name for name in fields if name not in readable]
+            if unknown:
+                raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        else:
+            fields = [name for name in readable if name not in self.opt_in_fields]
+        return [name for name in readable if name in fields or name in expand], expand
+
+    @property
+    def sparse_fields(self):
+        """
+        The (fields, expand) of the current request, see _sparse_fields().
+        """
+        if self.action not in self.sparse_actions:
+            return None, ()
+        if not hasattr(self, '_sparse_fields_cache'):
+            self._sparse_fields_cache = self._sparse_fields(self.request)
+        return self._sparse_fields_cache
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.sparse_fields
+        if fields is not None:
+            kwargs.update(fields=fields, expand=expand)
+        return super().get_serializer(*args, **kwargs)
+
+
+class ProductViewSet(ServerTimingMixin, CacheResponseMixin, ExportMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    """
+    API endpoint that allows products to be viewed or edited, exported with 'export', and resolved
+    in bulk with 'bulk-upsert'. 'nodes' lists the network nodes that carry a product.
+    List and retrieve responses are cached until a product changes, and return only the products columns
+    listed in 'fields', if given. Every product has the numbers of nodes and factories that carry it,
+    'node_count' and 'factory_count', which are stored with it and so cost no join.
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsActive]
+    cache_actions = ('list', 'retrieve', 'nodes')
+    export_fields = ProductSerializer.Meta.fields
+    export_filename = 'products'
+    bulk_max_items = 10000
+    node_fields = [name for name in NetworkNodeSerializer.Meta.fields if name not in ('products', 'product_ids')]
 
+    def get_cache_versions(self):
+        if self.action == 'nodes':
+            return [NODES, PRODUCTS]
+        return [PRODUCTS]
 
-class NetworkNodeViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        """
+        Returns the queryset for the current action, limited to the serialized columns for reads.
+        """
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            fields, expand = self.sparse_fields
+            queryset = queryset.only(*(fields or ProductSerializer.Meta.fields))
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='bulk-upsert')
+    def bulk_upsert(self, request):
+        """
+        Resolves a list of products to their ids, creating the missing ones, in one statement per 5000 items.
+        A product matches an item with the same name and model, compared case-insensitively and without
+        surrounding spaces. Returns the id of every item, and whether it was created, in the order of the input.
+        """
+        serializer = ProductUpsertSerializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            products = Product.objects.upsert(serializer.validated_data)
+            if any(created for pk, created in products):
+                bump_after_sql_write(PRODUCTS)
+        return Response([{'id': pk, 'created': created} for pk, created in products])
+
+    @action(detail=True, methods=['get'], filter_backends=[NetworkNodeFilterBackend])
+    def nodes(self, request, pk=None):
+        """
+        Returns the network nodes that carry the product, without their products, filtered and paginated
+        like the node list, e.g. 'city=Moscow'. The nodes are found through the index of the links on product_id.
+        """
+        product = get_object_or_404(Product.objects.only('id'), pk=pk)
+        serializer = NetworkNodeValuesSerializer(fields=self.node_fields)
+        rows = serializer.get_values(self.filter_queryset(NetworkNode.objects.filter(products=product)))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(rows.iterator()))
+
+    def export_rows(self, queryset):
+        fields = ProductSerializer().fields
+        rows = queryset.order_by('id').values_list(*self.export_fields).iterator(chunk_size=self.export_chunk_size)
+        for row in rows:
+            yield {
+                name: fields[name].to_representation(value) if value is not None else None
+                for name, value in zip(self.export_fields, row)
+            }
+
+
+class NetworkNodeTreeMixin:
+    """
+    Parses the query parameters of the tree and ancestors actions.
+    """
+
+    def _tree_fields(self, request):
+        """
+        Returns the node fields requested with the 'fields' query parameter, all tree fields by default.
+        'id' and 'supplier' are always returned.
+        """
+        fields = request.query_params.get('fields')
+        if not fields:
+            return NetworkNode.objects.TREE_FIELDS
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in NetworkNode.objects.TREE_FIELDS]
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        return ['id', 'supplier'] + [name for name in fields if name not in ('id', 'supplier')]
+
+    def _tree_depth(self, request):
+        """
+        Returns the depth limit requested with the 'depth' query parameter, None by default.
+        """
+        depth = request.query_params.get('depth')
+        if depth is None:
+            return None
+        if not depth.isdigit():
+            raise ValidationError({'depth': 'Depth must be a non-negative integer'})
+        return int(depth)
+
+    def _tree_node_id(self, pk):
+        try:
+            return int(pk)
+        except ValueError:
+            raise Http404
+
+
+class NetworkNodeViewSet(ServerTimingMixin, CacheResponseMixin, ExportMixin, NetworkNodeTreeMixin, SparseFieldsetMixin,
+                         viewsets.ModelViewSet):
     """
         API endpoint that allows network nodes to be viewed or edited.
 
         Methods
         -------
         list:
-            Returns a list of all network nodes.
+            Returns a list of all network nodes. The fields are selected with 'fields' and 'expand',
+            e.g. 'fields=id,name,debt' or 'expand=products,supplier', see SparseFieldsetMixin.
         retrieve:
-            Returns the details of a specific network node.
+            Returns the details of a specific network node, with the same 'fields' and 'expand'.
         create:
             Creates a new network node.
         update:
@@ -32,6 +202,18 @@ class NetworkNodeViewSet(viewsets.ModelViewSet):
             Partially updates an existing network node.
         destroy:
             Deletes an existing network node.
+        tree:
+            Returns the node with its whole downstream subtree, nested under 'children'.
+        ancestors:
+            Returns the upstream chain from the factory down to the node, nested under 'children'.
+        bulk:
+            Creates (POST) or partially updates (PATCH) a list of network nodes.
+        move:
+            Moves the node with its whole downstream subtree under another supplier and recomputes their levels.
+        export:
+            Streams the network nodes with their products as NDJSON or CSV.
+        debt:
+            Returns the debt of the node as of the time given with 'at', or its current debt.
 
         Permissions
         -----------
@@ -41,12 +223,298 @@ class NetworkNodeViewSet(viewsets.ModelViewSet):
         Attributes
         -----------
         queryset:
-            The queryset of all network nodes.
+            The queryset of all network nodes. For list and retrieve it is extended by get_queryset()
+            with the supplier join and the products prefetch, so the query count does not depend on
+            the number of nodes returned.
         serializer_class:
             The serializer class used for validating and deserializing input and output data.
         permission_classes:
             A list of permission classes that determine the user's access rights.
+        filter_backends:
+            Filters the list and the export by country, city, node_type, level, supplier, debt_min and debt_max,
+            and searches them with 'search', ranked by relevance.
+        bulk_max_items:
+            The maximum number of nodes accepted by one bulk request.
+        values_read:
+            If True, list and retrieve are read with values() and rendered by NetworkNodeValuesSerializer,
+            which produces the same JSON without model instances. Writes always use serializer_class.
+        cache_actions:
+            The actions whose responses are cached, see get_cache_versions() for when they are invalidated.
+        expandable_fields:
+            The relations 'expand' accepts: 'products' adds the products, 'supplier' replaces the supplier id
+            with the supplier. The products are left out of sparse responses unless they are asked for.
     """
     queryset = NetworkNode.objects.all()
     serializer_class = NetworkNodeSerializer
     permission_classes = [IsActive]
+    filter_backends = [NetworkNodeFilterBackend, NetworkNodeSearchBackend]
+    bulk_max_items = 10000
+    expandable_fields = ('products', 'supplier')
+    opt_in_fields = ('products',)
+    cache_actions = ('list', 'retrieve', 'tree', 'ancestors')
+    export_fields = (
+        'id', 'name', 'email', 'country', 'city', 'street', 'house_number', 'node_type', 'supplier', 'supplier_name',
+        'products', 'debt', 'created_at', 'level'
+    )
+    export_filename = 'network-nodes'
+
+    @property
+    def values_read(self):
+        """
+        True if list and retrieve are rendered by NetworkNodeValuesSerializer (NETWORK_NODE_VALUES_READ setting).
+        """
+        return settings.NETWORK_NODE_VALUES_READ
+
+    def get_queryset(self):
+        """
+        Returns the queryset for the current action.
+
+        For reads the supplier is joined for 'supplier_name' and the products are fetched in one extra query
+        with only the columns ProductSerializer renders. A sparse read only loads the columns of the requested
+        fields, joins the supplier only for 'supplier_name' or 'expand=supplier', and fetches the products
+        only if they are requested.
+        """
+        queryset = super().get_queryset()
+        if self.action == 'bulk' or self.action in ('list', 'retrieve') and not self.values_read:
+            fields, expand = self.sparse_fields
+            if fields is None:
+                fields = [name for name in NetworkNodeSerializer.Meta.fields if name != 'product_ids']
+            columns = [name for name in fields if name not in ('supplier_name', 'products')]
+            if 'supplier_name' in fields:
+                columns += ['supplier', 'supplier__name']
+            if 'supplier' in expand:
+                columns += ['supplier', *(f'supplier__{name}' for name in NetworkNodeSupplierSerializer.Meta.fields)]
+            if 'supplier_name' in fields or 'supplier' in expand:
+                queryset = queryset.select_related('supplier')
+            # 'created_at' is read by the keyset pagination
+            queryset = queryset.only('id', 'created_at', *dict.fromkeys(columns))
+            if 'products' in fields:
+                queryset = queryset.prefetch_related(
+                    Prefetch('products', queryset=Product.objects.only(*ProductSerializer.nested_fields).order_by('id'))
+                )
+        return queryset
+
+    def get_values_serializer(self):
+        fields, expand = self.sparse_fields
+        return NetworkNodeValuesSerializer(fields=fields, expand=expand)
+
+    def list(self, request, *args, **kwargs):
+        if not self.values_read:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_values_serializer()
+        rows = serializer.get_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(rows.iterator()))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.values_read:
+            return super().retrieve(request, *args, **kwargs)
+        serializer = self.get_values_serializer()
+        rows = serializer.get_values(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(serializer.to_representation([row])[0])
+
+    def get_cache_versions(self):
+        """
+        A node and its tree are cached per subtree, so a write invalidates only the subtrees that contain
+        the node. Lists and upstream chains depend on all nodes.
+        """
+        if self.action in ('tree', 'retrieve'):
+            # the versions are bumped by integer id, so '05' must be cached under the version of node 5
+            versions = [SUBTREES, subtree(self._tree_node_id(self.kwargs['pk']))]
+            return versions if self.action == 'tree' else versions + [PRODUCTS]
+        return [NODES, PRODUCTS]
+
+    def export_rows(self, queryset):
+        """
+        Yields the nodes in the shape of NetworkNodeSerializer.
+        The products are fetched with one query per chunk of nodes.
+        """
+        serializer = NetworkNodeValuesSerializer(chunk_size=self.export_chunk_size)
+        rows = serializer.get_values(queryset.order_by('id')).iterator(chunk_size=self.export_chunk_size)
+        yield from serializer.iter_representation(rows)
+
+    @action(detail=True, methods=['get'])
+    def tree(self, request, pk=None):
+        """
+        Returns the node and its downstream subtree in a single query.
+        """
+        fields = self._tree_fields(request)
+        rows = NetworkNode.objects.subtree_rows(self._tree_node_id(pk), depth=self._tree_depth(request), fields=fields)
+        if not rows:
+            raise Http404
+        return Response(NetworkNodeRowSerializer(fields=fields).tree_representation(rows))
+
+    @action(detail=True, methods=['get'])
+    def ancestors(self, request, pk=None):
+        """
+        Returns the upstream chain of the node up to the factory in a single query.
+        """
+        fields = self._tree_fields(request)
+        rows = NetworkNode.objects.ancestor_rows(self._tree_node_id(pk), fields=fields)
+        if not rows:
+            raise Http404
+        return Response(NetworkNodeRowSerializer(fields=fields).chain_representation(rows))
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """
+        Moves the node and its downstream subtree under the supplier given in the body, in one transaction.
+        The levels of all moved nodes are recomputed with a single UPDATE.
+        """
+        with transaction.atomic():
+            serializer = NetworkNodeMoveSerializer(self.get_object(), data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post', 'patch'])
+    def bulk(self, request):
+        """
+        Creates or partially updates a list of nodes in one transaction and returns them in the order of the input.
+        Invalid input is answered with a list of errors, one per item.
+        """
+        partial = request.method == 'PATCH'
+        serializer = NetworkNodeBulkSerializer(data=request.data, many=True, partial=partial,
+                                               max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        nodes = serializer.save()
+
+        ids = [node.pk for node in nodes]
+        saved = self.get_queryset().in_bulk(ids)
+        data = NetworkNodeSerializer([saved[pk] for pk in ids], many=True).data
+        return Response(data, status=status.HTTP_200_OK if partial else status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def debt(self, request, pk=None):
+        """
+        Returns the debt of the node as of 'at', from its last debt snapshot and the movements since,
+        or its current debt without 'at'.
+        """
+        params = DebtAsOfSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        node = get_object_or_404(NetworkNode.objects.only('id', 'debt'), pk=pk)
+        at = params.validated_data.get('at')
+        debt = node.debt if at is None else DebtMovement.objects.balance_as_of(node.pk, at)
+        return Response({'node': node.pk, 'at': at, 'debt': NetworkNodeSerializer().fields['debt'].to_representation(debt)})
+
+
+class DebtMovementViewSet(ServerTimingMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+        API endpoint of the append-only debt ledger of the network nodes.
+
+        Methods
+        -------
+        list:
+            Returns the movements, of the node given with 'node' if any, in the order they were posted.
+        bulk:
+            Posts a list of movements in one transaction and returns the new debts of their nodes.
+
+        Attributes
+        -----------
+        bulk_max_items:
+            The maximum number of movements accepted by one bulk request.
+    """
+    queryset = DebtMovement.objects.all()
+    serializer_class = DebtMovementSerializer
+    permission_classes = [IsActive]
+    bulk_max_items = 10000
+
+    def get_queryset(self):
+        queryset = super().get_queryset().order_by('created_at', 'id')
+        node = self.request.query_params.get('node')
+        if node is not None:
+            if not node.isdigit():
+                raise ValidationError({'node': f'Invalid value: {node}'})
+            queryset = queryset.filter(node_id=int(node))
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Appends the movements to the ledger and applies them to the debts of their nodes, see
+        DebtMovementManager.post_movements(). Returns the new debt of every node, ordered by node id.
+        """
+        serializer = DebtMovementSerializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        try:
+            with transaction.atomic():
+                debts = DebtMovement.objects.post_movements(
+                    [DebtMovement(**item) for item in serializer.validated_data]
+                )
+                bump_after_sql_write(NODES, SUBTREES)
+        except DataError:
+            raise ValidationError('The movements would take the debt of a node out of its range.')
+        debt_field = NetworkNodeSerializer().fields['debt']
+        return Response({
+            'posted': len(serializer.validated_data),
+            'debts': [{'node': pk, 'debt': debt_field.to_representation(debt)} for pk, debt in sorted(debts.items())],
+        }, status=status.HTTP_201_CREATED)
+
+
+class NetworkStatsViewSet(ServerTimingMixin, viewsets.ViewSet):
+    """
+        API endpoint with the node counts and debt of the network, grouped by city, node type, level and month.
+
+        The figures are read from the NetworkStats materialized view, so they are as fresh as its last refresh,
+        which is returned as 'refreshed_at'.
+
+        Methods
+        -------
+        list:
+            Returns the node count, total and average debt per group. The groups are set with the 'group_by'
+            query parameter, a comma-separated list of city, node_type, level and month.
+            Without it the totals of the whole network are returned.
+        refresh:
+            Refreshes the materialized view. Superusers only.
+        cache:
+            Returns the hit, miss and not_modified counters of the cached API responses. Superusers only.
+        throttle:
+            Returns the allowed and throttled requests per throttle scope. Superusers only.
+    """
+    permission_classes = [IsActive]
+
+    def get_permissions(self):
+        if self.action in ('refresh', 'cache', 'throttle'):
+            return [IsSuperuser()]
+        return super().get_permissions()
+
+    def list(self, request):
+        group_by = [name.strip() for name in request.query_params.get('group_by', '').split(',') if name.strip()]
+        unknown = [name for name in group_by if name not in NetworkStatsSerializer.DIMENSIONS]
+        if unknown:
+            raise ValidationError({'group_by': f"Unknown dimensions: {', '.join(unknown)}"})
+
+        # 'average_debt' goes first, the other two aggregates replace the view columns of the same name
+        aggregates = {
+            'average_debt': ExpressionWrapper(
+                Sum('total_debt') / Sum('node_count'), output_field=DecimalField(max_digits=20, decimal_places=2)
+            ),
+            'node_count': Sum('node_count'),
+            'total_debt': Sum('total_debt'),
+        }
+        if group_by:
+            stats = NetworkStats.objects.values(*group_by).annotate(**aggregates).order_by(*group_by)
+        else:
+            stats = [NetworkStats.objects.aggregate(**aggregates)]
+        refresh = NetworkStatsRefresh.objects.filter(pk=1).first()
+        return Response({
+            'refreshed_at': refresh.refreshed_at if refresh else None,
+            'group_by': group_by,
+            'results': NetworkStatsSerializer(stats, many=True, group_by=group_by).data,
+        })
+
+    @action(detail=False, methods=['post'])
+    def refresh(self, request):
+        return Response({'refreshed_at': NetworkStats.refresh()})
+
+    @action(detail=False, methods=['get'])
+    def cache(self, request):
+        return Response(get_counters(['product', 'networknode']))
+
+    @action(detail=False, methods=['get'])
+    def throttle(self, request):
+        return Response(get_throttle_counters())
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TradingPlatformConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trading_platform'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from trading_platform import signals  # noqa: F401
+        from trading_platform.metrics import install_query_recorder
+
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,198 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from trading_platform.apiviews import NetworkNodeTreeMixin, NetworkNodeViewSet, SparseFieldsetMixin
+from trading_platform.filters import NetworkNodeFilterBackend, NetworkNodeSearchBackend
+from trading_platform.metrics import set_view, timed
+from trading_platform.models import NetworkNode, Product
+from trading_platform.pagination import OptInPagination
+from trading_platform.permissions import IsActive
+from trading_platform.serializers import NetworkNodeRowSerializer, NetworkNodeSerializer, NetworkNodeValuesSerializer, \
+    ProductSerializer
+from user.authentication import SignedTokenAuthentication
+
+
+class AsyncReadView(View):
+    """
+    Base of the async read-only views, served next to the viewsets under /platform/async/.
+
+    Under ASGI Django runs a sync view in a thread for the whole request, while these views run on the event loop
+    and only use a thread while a query runs, so one worker keeps many requests in flight with few busy threads.
+    Every query goes through the async ORM (aget, aiterator, acount), and the permissions are checked against
+    the user of the token or of request.auser(), without a query from the event loop.
+
+    The responses have the same JSON as the list and retrieve actions of the viewsets, with the same filters,
+    pagination and errors. The user is authenticated by a Bearer token or the session, and the responses
+    are not cached.
+
+    The view runs the method named by the 'action' argument of as_view() for GET requests. The requests are
+    throttled like those of the viewset of the same basename, in the same buckets, and timed like them
+    by ServerTimingMiddleware.
+    """
+
+    http_method_names = ['get', 'options']
+    action = None
+    basename = None
+    permission_classes = [IsActive]
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    filter_backends = []
+    pagination_class = OptInPagination
+    renderer = JSONRenderer()
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request)
+        headers = {}
+        set_view(f'async:{self.basename}', self.action)
+        try:
+            with timed('auth'):
+                request.user = await self.authenticate(request)
+            with timed('permission'):
+                self.check_permissions(request)
+            with timed('throttle'):
+                await self.check_throttles(request)
+            with timed('serialize'):
+                data = await getattr(self, self.action)(request, *args, **kwargs)
+            status_code = 200
+        except (exceptions.APIException, Http404) as exc:
+            if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                # like DRF with session authentication, which sends no WWW-Authenticate header
+                exc.status_code = 403
+            response = exception_handler(exc, {'view': self, 'request': request})
+            data, status_code = response.data, response.status_code
+            # e.g. Retry-After of a throttled request
+            headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type='application/json',
+                            headers=headers)
+
+    async def authenticate(self, request):
+        """
+        Returns the user of the Bearer token of the request, or else of the session.
+        """
+        result = await SignedTokenAuthentication().aauthenticate(request)
+        if result is not None:
+            return result[0]
+        return await request._request.auser()
+
+    def check_permissions(self, request):
+        for permission in self.permission_classes:
+            permission = permission()
+            if not permission.has_permission(request, self):
+                if not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+    async def check_throttles(self, request):
+        """
+        Raises Throttled if a throttle refuses the request, with the longest wait of the throttles.
+        """
+        waits = []
+        for throttle in self.throttle_classes:
+            throttle = throttle()
+            if hasattr(throttle, 'aallow_request'):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = throttle.allow_request(request, self)
+            if not allowed:
+                waits.append(throttle.wait())
+        if waits:
+            raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+    async def filter_queryset(self, request, queryset):
+        for backend in self.filter_backends:
+            queryset = await backend().afilter_queryset(request, queryset, self)
+        return queryset
+
+    async def paginate_queryset(self, request, queryset):
+        """
+        Returns the requested page, or None if the client did not ask for one. The paginator is kept
+        in self.paginator for the links of the paginated response.
+        """
+        self.paginator = self.pagination_class()
+        return await self.paginator.apaginate_queryset(queryset, request, self)
+
+
+class AsyncProductView(SparseFieldsetMixin, AsyncReadView):
+    """
+    Async list and retrieve of products, see ProductViewSet.
+    """
+
+    basename = 'product'
+    serializer_class = ProductSerializer
+
+    def get_queryset(self, fields):
+        return Product.objects.only(*(fields or ProductSerializer.Meta.fields))
+
+    async def list(self, request):
+        fields, expand = self._sparse_fields(request)
+        queryset = self.get_queryset(fields)
+        page = await self.paginate_queryset(request, queryset)
+        if page is not None:
+            return self.paginator.get_paginated_response(ProductSerializer(page, many=True, fields=fields).data).data
+        return ProductSerializer([product async for product in queryset.aiterator()], many=True, fields=fields).data
+
+    async def retrieve(self, request, pk):
+        fields, expand = self._sparse_fields(request)
+        try:
+            product = await self.get_queryset(fields).aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404
+        return ProductSerializer(product, fields=fields).data
+
+
+class AsyncNetworkNodeView(NetworkNodeTreeMixin, SparseFieldsetMixin, AsyncReadView):
+    """
+    Async list, retrieve, tree and ancestors of network nodes, see NetworkNodeViewSet.
+
+    The nodes are read with values() and rendered by NetworkNodeValuesSerializer, as with NETWORK_NODE_VALUES_READ.
+    The tree queries are raw SQL, which the async ORM does not cover, so they run in a thread
+    the same way the async ORM runs its own queries.
+    """
+
+    basename = 'networknode'
+    serializer_class = NetworkNodeSerializer
+    filter_backends = [NetworkNodeFilterBackend, NetworkNodeSearchBackend]
+    expandable_fields = NetworkNodeViewSet.expandable_fields
+    opt_in_fields = NetworkNodeViewSet.opt_in_fields
+
+    def get_values_serializer(self, request):
+        fields, expand = self._sparse_fields(request)
+        return NetworkNodeValuesSerializer(fields=fields, expand=expand)
+
+    async def list(self, request):
+        serializer = self.get_values_serializer(request)
+        rows = await self.filter_queryset(request, serializer.get_values(NetworkNode.objects.all()))
+        page = await self.paginate_queryset(request, rows)
+        if page is not None:
+            return self.paginator.get_paginated_response(await serializer.ato_representation(page)).data
+        return [data async for data in serializer.aiter_representation(rows.aiterator(serializer.chunk_size))]
+
+    async def retrieve(self, request, pk):
+        serializer = self.get_values_serializer(request)
+        rows = await self.filter_queryset(request, serializer.get_values(NetworkNode.objects.all()))
+        try:
+            row = await rows.aget(pk=pk)
+        except NetworkNode.DoesNotExist:
+            raise Http404
+        return (await serializer.ato_representation([row]))[0]
+
+    async def tree(self, request, pk):
+        fields = self._tree_fields(request)
+        rows = await sync_to_async(NetworkNode.objects.subtree_rows)(
+            self._tree_node_id(pk), depth=self._tree_depth(request), fields=fields
+        )
+        if not rows:
+            raise Http404
+        return NetworkNodeRowSerializer(fields=fields).tree_representation(rows)
+
+    async def ancestors(self, request, pk):
+        fields = self._tree_fields(request)
+        rows = await sync_to_async(NetworkNode.objects.ancestor_rows)(self._tree_node_id(pk), fields=fields)
+        if not rows:
+            raise Http404
+        return NetworkNodeRowSerializer(fields=fields).chain_representation(rows)
@@ -0,0 +1,153 @@
+import hashlib
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from trading_platform.replicas import reads_may_lag
+
+# Version names: all products, all nodes, and all node subtrees at once (see subtree() for a single one)
+PRODUCTS = 'products'
+NODES = 'nodes'
+SUBTREES = 'subtrees'
+
+
+def _version_key(name):
+    return f'api:version:{name}'
+
+
+def subtree(node_id):
+    """
+    Returns the version name of the subtree under the node.
+    """
+    return f'subtree:{node_id}'
+
+
+def get_versions(names):
+    """
+    Returns the current versions of the names, in the same order.
+
+    A version is the time of the last write in nanoseconds. A missing version (never bumped, or evicted)
+    starts at the current time, so it never matches a key cached under an older one.
+    """
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            now = time.time_ns()
+            cache.add(key, now, None)
+            # a backend that keeps nothing (DummyCache) returns the default
+            versions[key] = cache.get(key, now)
+    return [versions[key] for key in keys]
+
+
+def _bump(names):
+    now = time.time_ns()
+    cache.set_many({_version_key(name): now for name in names}, None)
+
+
+def bump_versions(*names, using='default'):
+    """
+    Invalidates the responses cached under the versions.
+
+    The versions are bumped at once, and again when the current transaction commits, so a response cached
+    from the old rows while the transaction was still open is not kept either.
+    """
+    _bump(names)
+    transaction.on_commit(lambda: _bump(names), using=using)
+
+
+def bump_after_sql_write(*names, using='default'):
+    """
+    Invalidates the responses cached under the versions after a write the model signals do not see.
+
+    trading_platform.signals bumps the versions on save() and delete(), but raw SQL, bulk_create(),
+    bulk_update() and QuerySet.update() send no signals, so the code that writes with them calls this instead.
+    """
+    bump_versions(*names, using=using)
+
+
+def count(basename, event):
+    """
+    Increments the hit, miss or not_modified counter of the cached responses of a viewset.
+    """
+    key = f'api:stats:{basename}:{event}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the first count, or the counter was evicted
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_counters(basenames, events=('hits', 'misses', 'not_modified')):
+    """
+    Returns the counters of the viewsets as {basename: {event: value}}.
+    """
+    keys = {f'api:stats:{basename}:{event}': (basename, event) for basename in basenames for event in events}
+    values = cache.get_many(keys)
+    counters = {basename: dict.fromkeys(events, 0) for basename in basenames}
+    for key, (basename, event) in keys.items():
+        counters[basename][event] = values.get(key, 0)
+    return counters
+
+
+class CacheResponseMixin:
+    """
+    Caches the data of successful GET responses of a viewset and answers conditional GETs.
+
+    The cache key holds the full path with the query string and the versions returned by
+    get_cache_versions() for the action. Writes bump the versions (see trading_platform.signals), so stale
+    entries are never read again and simply expire. The ETag is the hash of the key and Last-Modified
+    the time of the newest version, so If-None-Match and If-Modified-Since are answered with 304
+    from the versions alone, before the database or the cached entry is read.
+
+    The GET requests of cache_actions are cached, for cache_timeout seconds, after the permission checks.
+    """
+
+    cache_actions = ('list', 'retrieve')
+    cache_timeout = 300
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method == 'GET' and self.action in self.cache_actions:
+            self.get = partial(self.cached_response, self.get)
+
+    def get_cache_versions(self):
+        """
+        Returns the names of the versions the response of the current action depends on.
+        """
+        raise NotImplementedError('`get_cache_versions()` must be implemented.')
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        names = self.get_cache_versions()
+        versions = get_versions(names)
+        key = ':'.join([request.get_full_path(), *names, *map(str, versions)])
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        last_modified = max(versions) // 10 ** 9
+
+        cache_key = f'api:response:{self.basename}:{etag[1:-1]}'
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            count(self.basename, 'not_modified')
+        elif (data := cache.get(cache_key)) is not None:
+            count(self.basename, 'hits')
+            response = Response(data)
+        else:
+            count(self.basename, 'misses')
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if reads_may_lag(max(versions)):
+                # a replica may not have the last write yet, so the response is neither cached nor validated
+                return response
+            cache.set(cache_key, response.data, self.cache_timeout)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
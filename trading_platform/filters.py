@@ -0,0 +1,180 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, FloatField, Q, Value
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from trading_platform.models import NetworkNode
+
+
+class NetworkNodeFilterBackend(BaseFilterBackend):
+    """
+    Filters network nodes by country, city, node_type, level, supplier and a debt range (debt_min, debt_max).
+
+    The filters are served by the composite B-tree indexes of NetworkNode (see is_indexed()). Combinations that
+    no index serves would scan the whole table, so they are rejected once the table holds more than
+    large_table_rows rows, by the planner's estimate in pg_class, cached for estimate_timeout seconds.
+    """
+
+    filters = {
+        'country': ('country', str),
+        'city': ('city', str),
+        'node_type': ('node_type', str),
+        'level': ('level', int),
+        'supplier': ('supplier_id', int),
+        'debt_min': ('debt__gte', Decimal),
+        'debt_max': ('debt__lte', Decimal),
+    }
+    large_table_rows = 100000
+    estimate_timeout = 300
+
+    def get_filters(self, request):
+        """
+        Returns the ORM lookups for the filters in the query parameters of the request.
+        """
+        lookups = {}
+        node_types = {choice for choice, label in NetworkNode.NODE_CHOICES}
+        for param, (lookup, kind) in self.filters.items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                lookups[lookup] = kind(value)
+            except (ValueError, InvalidOperation):
+                raise ValidationError({param: f'Invalid value: {value}'})
+            if param == 'node_type' and value not in node_types:
+                raise ValidationError({param: f"Choose one of: {', '.join(sorted(node_types))}"})
+        return lookups
+
+    def is_indexed(self, queryset, lookups):
+        """
+        Returns True if an index of the model can serve the filters.
+
+        The columns filtered by equality must be the leading columns of the index, in any order, or one of them
+        must have an index of its own, such as the supplier foreign key: the scan of that index is narrowed to
+        its value and the other filters are applied to its rows. Range filters are applied on top of them, or,
+        without equality filters, must be on the first column of the index.
+        """
+        opts = queryset.model._meta
+        equal = {opts.get_field(lookup).column for lookup in lookups if '__' not in lookup}
+        ranges = {opts.get_field(lookup.split('__')[0]).column for lookup in lookups if '__' in lookup}
+        indexes = [
+            [opts.get_field(name.lstrip('-')).column for name in index.fields] for index in opts.indexes if index.fields
+        ]
+        indexes += [[field.column] for field in opts.concrete_fields if field.db_index or field.primary_key]
+        for columns in indexes:
+            if equal and set(columns[:len(equal)]) == equal:
+                return True
+            if len(columns) == 1 and columns[0] in equal:
+                return True
+            if not equal and ranges == {columns[0]}:
+                return True
+        return False
+
+    def estimated_rows(self, queryset):
+        """
+        Returns the planner's estimate of the number of rows in the table of the queryset.
+        """
+        return queryset.model.objects.db_manager(queryset.db).estimated_count(self.estimate_timeout)
+
+    def check_table_size(self, estimated_rows):
+        """
+        Rejects filters that no index serves on a table of more than large_table_rows rows.
+        """
+        if estimated_rows > self.large_table_rows:
+            raise ValidationError(
+                'This combination of filters is not indexed. Filter by country, city, node_type, level or supplier '
+                'first, e.g. country and city, or city, node_type and level.'
+            )
+
+    def filter_queryset(self, request, queryset, view):
+        lookups = self.get_filters(request)
+        if not lookups:
+            return queryset
+        if not self.is_indexed(queryset, lookups):
+            self.check_table_size(self.estimated_rows(queryset))
+        return queryset.filter(**lookups)
+
+    async def afilter_queryset(self, request, queryset, view):
+        """
+        Async version of filter_queryset(), for the async views. The estimate is read in a thread
+        like every other query of the async ORM.
+        """
+        lookups = self.get_filters(request)
+        if not lookups:
+            return queryset
+        if not self.is_indexed(queryset, lookups):
+            self.check_table_size(await sync_to_async(self.estimated_rows)(queryset))
+        return queryset.filter(**lookups)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': param,
+                'required': False,
+                'in': 'query',
+                'description': f'Filter by {lookup.replace("__gte", " (minimum)").replace("__lte", " (maximum)")}',
+                'schema': {'type': 'integer' if kind is int else 'number' if kind is Decimal else 'string'},
+            }
+            for param, (lookup, kind) in self.filters.items()
+        ]
+
+
+class NetworkNodeSearchBackend(BaseFilterBackend):
+    """
+    Searches network nodes by name, city, street, email and the names and models of their products.
+
+    Every word of the 'search' query parameter is matched as a word prefix against NetworkNode.search_vector,
+    and the whole term, if it has at least min_substring_length characters, also as a substring of
+    NetworkNode.search_document, so partial model numbers are found. Both are served by GIN indexes
+    (the substring match by the trigram index), and both columns are kept up to date by database triggers.
+
+    The results are ordered by search_rank, the text search rank plus the trigram word similarity of the term.
+    Keyset pagination orders by its own key instead, limit/offset pagination keeps the rank order.
+    """
+
+    search_param = 'search'
+    search_config = 'simple'
+    min_substring_length = 3
+
+    def get_search_term(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        term = self.get_search_term(request)
+        if not term:
+            return queryset
+
+        words = re.findall(r'\w+', term)
+        condition = Q()
+        rank = Value(0.0, output_field=FloatField())
+        if words:
+            query = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=self.search_config)
+            condition |= Q(search_vector=query)
+            rank = SearchRank(F('search_vector'), query)
+        if len(term) >= self.min_substring_length:
+            condition |= Q(search_document__icontains=term)
+            rank = rank + TrigramWordSimilarity(term, 'search_document')
+        if not condition:
+            return queryset.none()
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+    async def afilter_queryset(self, request, queryset, view):
+        """
+        Async version of filter_queryset(), which only builds the query.
+        """
+        return self.filter_queryset(request, queryset, view)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Search by name, city, street, email and product name or model, ranked by relevance',
+                'schema': {'type': 'string'},
+            }
+        ]
@@ -0,0 +1,180 @@
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from trading_platform.cache import NODES, SUBTREES, bump_after_sql_write
+from trading_platform.models import DebtMovement, Job, NetworkNode
+
+
+class JobHandler:
+    """
+    Runs one kind of job in chunks.
+
+    Every chunk runs in its own transaction together with the progress of the job, so a long job never holds
+    its locks for longer than one chunk, and a job taken over from a dead worker resumes after the last
+    committed chunk.
+    """
+
+    chunk_size = 1000
+
+    def get_total(self, job):
+        """
+        Returns the number of items the job will process.
+        """
+        raise NotImplementedError('`get_total()` must be implemented.')
+
+    def run_chunk(self, job):
+        """
+        Processes the next chunk, records where it stopped in job.state and returns the number of items processed.
+        Returns 0 when there is nothing left.
+        """
+        raise NotImplementedError('`run_chunk()` must be implemented.')
+
+
+class QuerySetJobHandler(JobHandler):
+    """
+    Handler of jobs over the rows of a queryset, stored by selection() in the params of the job.
+
+    The rows are processed in primary key order, chunk_size at a time, and the queryset is evaluated again
+    for every chunk, so rows that stop matching it in the meantime are skipped.
+    """
+
+    @staticmethod
+    def selection(queryset):
+        """
+        Returns the params of a job over the rows of the queryset: the SQL that selects their primary keys.
+        """
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        return {'sql': sql, 'params': list(params)}
+
+    def get_total(self, job):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM ({job.params['sql']}) AS selection", job.params['params'])
+            return cursor.fetchone()[0]
+
+    def next_ids(self, job):
+        """
+        Returns the primary keys of the next chunk and moves job.state past them.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM ({job.params['sql']}) AS selection WHERE id > %s ORDER BY id LIMIT %s",
+                [*job.params['params'], job.state.get('last_id', 0), self.chunk_size]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            job.state['last_id'] = ids[-1]
+        return ids
+
+
+class ClearDebtJob(QuerySetJobHandler):
+    """
+    Sets the debt of the selected network nodes to zero, with an adjustment in the debt ledger for every node
+    in debt. The nodes of a chunk are locked in the order of their ids before their debts are read,
+    like DebtMovementManager.post_movements() locks them, so a movement posted meanwhile is not lost.
+    """
+
+    def run_chunk(self, job):
+        ids = self.next_ids(job)
+        if ids:
+            debts = NetworkNode.objects.filter(pk__in=ids).exclude(debt=0).order_by('pk').select_for_update(
+                no_key=True).values_list('pk', 'debt')
+            DebtMovement.objects.post_movements(
+                [DebtMovement(node_id=pk, kind=DebtMovement.ADJUSTMENT, amount=-debt) for pk, debt in debts]
+            )
+            bump_after_sql_write(NODES, SUBTREES)
+        return len(ids)
+
+
+handlers = {
+    'clear_debt': ClearDebtJob(),
+}
+
+
+def enqueue(kind, params, user=None):
+    """
+    Queues a job of the given kind and returns it. The job is run by the run_workers command.
+    """
+    return Job.objects.create(kind=kind, params=params, created_by=user)
+
+
+class Worker:
+    """
+    Claims queued jobs one at a time and runs them.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can poll the same table
+    without waiting for each other. A running job whose worker has not reported progress for lease seconds
+    is considered abandoned and claimed again.
+    """
+
+    lease = timedelta(minutes=5)
+
+    def __init__(self, name=None, poll_interval=1.0):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = poll_interval
+        self.stopping = False
+
+    def claim(self):
+        """
+        Marks the oldest available job as running by this worker and returns it, or None if there is none.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            job = Job.objects.select_for_update(skip_locked=True).filter(
+                Q(status=Job.QUEUED) | Q(status=Job.RUNNING, heartbeat_at__lt=now - self.lease)
+            ).order_by('id').first()
+            if job is None:
+                return None
+            job.status = Job.RUNNING
+            job.worker = self.name
+            job.started_at = job.started_at or now
+            job.heartbeat_at = now
+            job.save(update_fields=['status', 'worker', 'started_at', 'heartbeat_at'])
+        return job
+
+    def run(self, job):
+        """
+        Runs the job chunk by chunk until it is finished, fails, is taken over by another worker, or the worker stops.
+        """
+        handler = handlers[job.kind]
+        try:
+            if job.total is None:
+                job.total = handler.get_total(job)
+                Job.objects.filter(pk=job.pk).update(total=job.total)
+            while not self.stopping:
+                with transaction.atomic():
+                    current = Job.objects.select_for_update().only('worker', 'status').get(pk=job.pk)
+                    if current.worker != self.name or current.status != Job.RUNNING:
+                        return
+                    processed = handler.run_chunk(job)
+                    job.done += processed
+                    job.heartbeat_at = timezone.now()
+                    if not processed:
+                        job.status = Job.DONE
+                        job.finished_at = job.heartbeat_at
+                    job.save(update_fields=['state', 'done', 'heartbeat_at', 'status', 'finished_at'])
+                if not processed:
+                    return
+        except Exception:
+            Job.objects.filter(pk=job.pk, worker=self.name).update(
+                status=Job.FAILED, error=traceback.format_exc(), finished_at=timezone.now()
+            )
+
+    def work(self, burst=False):
+        """
+        Runs jobs until the worker is stopped, or, with burst, until no job is left.
+        """
+        while not self.stopping:
+            job = self.claim()
+            if job is not None:
+                self.run(job)
+            elif burst:
+                return
+            else:
+                time.sleep(self.poll_interval)
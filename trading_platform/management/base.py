@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class ProgressCommand(BaseCommand):
+    """
+    Base of the long-running commands, which print their progress with the seconds since the command started.
+    """
+
+    def execute(self, *args, **options):
+        self.started = time.monotonic()
+        return super().execute(*args, **options)
+
+    def elapsed(self):
+        """
+        Returns the seconds since the command started.
+        """
+        return time.monotonic() - self.started
+
+    def progress(self, message):
+        self.stdout.write(f'[{self.elapsed():7.1f}s] {message}')
@@ -0,0 +1,258 @@
+from array import array
+from bisect import bisect_left
+
+from django.db import connection, transaction
+
+from trading_platform.cache import NODES, SUBTREES, bump_after_sql_write
+from trading_platform.management.base import ProgressCommand
+from trading_platform.models import NetworkNode
+
+# parent[i] of a node without a supplier, and of a node whose supplier does not exist
+NO_SUPPLIER = -1
+ORPHAN = -2
+# depth[i] of a node not visited yet, on the chain being walked, in a cycle, and below no factory
+UNVISITED = -1
+WALKING = -2
+CYCLE = -3
+BROKEN = -4
+
+
+class Command(ProgressCommand):
+    """
+    Audits the hierarchy of the whole network and optionally repairs it.
+
+    The (id, supplier_id, level, node_type) of every node is streamed from a server-side cursor into flat arrays,
+    a few bytes per node, and the supplier chains are walked once, so the audit runs in linear time and memory
+    without loading a single model instance. A factory is the top of its chain, and the level of every other node
+    is its distance from the factory. The violations are reported per kind, with the ids of the first nodes:
+
+    - cycle: the node is in a supplier cycle
+    - orphan: the supplier of the node does not exist
+    - factory_with_supplier: the node is a factory and has a supplier
+    - missing_supplier: the node is not a factory and has no supplier
+    - invalid_node_type: the node type is not one of NetworkNode.NODE_CHOICES
+    - no_factory_chain: the supplier chain of the node ends in one of the above instead of a factory
+    - level_mismatch: the stored level differs from the distance of the node from its factory
+    - too_deep: the node is more than 2 levels below its factory
+
+    With --repair the suppliers of factories are cleared and the mismatched levels are set, in batches of
+    --batch-size rows, each in its own transaction. A row changed since it was read is left as it is. The other
+    violations need a decision about the network and are only reported.
+    """
+
+    help = 'Checks the supplier chains, node types and levels of all network nodes and optionally repairs them.'
+
+    kinds = ('cycle', 'orphan', 'factory_with_supplier', 'missing_supplier', 'invalid_node_type',
+             'no_factory_chain', 'level_mismatch', 'too_deep')
+    max_level = 2
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Clear the suppliers of factories and fix the mismatched levels')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per repair transaction')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Rows fetched from the cursor at once')
+        parser.add_argument('--show', type=int, default=20, help='Number of node ids to print per violation kind')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.violations = {kind: 0 for kind in self.kinds}
+        self.samples = {kind: [] for kind in self.kinds}
+
+        self.load()
+        self.progress(f'{len(self.ids)} nodes loaded')
+        self.link()
+        self.walk()
+        self.check_levels()
+        self.progress('Hierarchy checked')
+        self.report()
+
+        if options['repair']:
+            self.repair()
+
+        self.stdout.write(self.style.SUCCESS(f'Audit finished in {self.elapsed():.1f}s.'))
+
+    def add(self, kind, i):
+        self.violations[kind] += 1
+        if len(self.samples[kind]) < self.options['show']:
+            self.samples[kind].append(self.ids[i])
+
+    def load(self):
+        """
+        Streams the nodes in id order into the arrays ids, suppliers (0 for none), levels and types.
+        The type is the position of node_type in NetworkNode.NODE_CHOICES, starting at 1 for a factory, or 0.
+        """
+        self.ids = array('q')
+        self.suppliers = array('q')
+        self.levels = array('i')
+        self.types = array('b')
+        node_types = [choice for choice, label in NetworkNode.NODE_CHOICES]
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, coalesce(supplier_id, 0), level, coalesce(array_position(%s::text[], node_type), 0) '
+                f'FROM {NetworkNode._meta.db_table} ORDER BY id',
+                [node_types]
+            )
+            while rows := cursor.fetchmany(self.options['chunk_size']):
+                ids, suppliers, levels, types = zip(*rows)
+                self.ids.extend(ids)
+                self.suppliers.extend(suppliers)
+                self.levels.extend(levels)
+                self.types.extend(types)
+
+    def index_of(self):
+        """
+        Returns a function from a node id to its position in ids, or -1.
+
+        Ids are usually dense, so the positions are kept in an array over the id range. A sparse id range
+        falls back to a binary search of ids, which is sorted.
+        """
+        ids = self.ids
+        if not ids:
+            return lambda pk: -1
+        low, high = ids[0], ids[-1]
+        if high - low < 4 * len(ids) + 1024:
+            positions = array('i', [-1]) * (high - low + 1)
+            for i, pk in enumerate(ids):
+                positions[pk - low] = i
+            return lambda pk: positions[pk - low] if low <= pk <= high else -1
+
+        def search(pk):
+            i = bisect_left(ids, pk)
+            return i if i < len(ids) and ids[i] == pk else -1
+        return search
+
+    def link(self):
+        """
+        Replaces the supplier ids with the positions of the suppliers in parent. Factories are the tops
+        of their chains, so they get no parent even if they have a supplier; their ids are kept in detached.
+        """
+        index_of = self.index_of()
+        types, suppliers = self.types, self.suppliers
+        self.parent = parent = array('i', [NO_SUPPLIER]) * len(self.ids)
+        self.detached = array('q')
+        for i, supplier in enumerate(suppliers):
+            if types[i] == 1:
+                if supplier:
+                    self.add('factory_with_supplier', i)
+                    self.detached.append(self.ids[i])
+                continue
+            if not types[i]:
+                self.add('invalid_node_type', i)
+            if not supplier:
+                self.add('missing_supplier', i)
+                continue
+            parent[i] = j = index_of(supplier)
+            if j < 0:
+                parent[i] = ORPHAN
+                self.add('orphan', i)
+        self.suppliers = None
+
+    def walk(self):
+        """
+        Computes in depth the distance of every node from its factory. Each node is walked up to the first
+        visited node once, so the walk is linear. A chain that runs into itself is a cycle, and a chain that
+        ends in a node without a supplier other than a factory, or in an orphan, has no factory.
+        """
+        parent, types = self.parent, self.types
+        self.depth = depth = array('i', [UNVISITED]) * len(self.ids)
+        for start in range(len(depth)):
+            if depth[start] != UNVISITED:
+                continue
+            chain = []
+            i = start
+            while depth[i] == UNVISITED:
+                depth[i] = WALKING
+                chain.append(i)
+                if parent[i] < 0:
+                    top = -1 if parent[i] == NO_SUPPLIER and types[i] == 1 else BROKEN
+                    break
+                i = parent[i]
+            else:
+                top = depth[i]
+                if top == WALKING:
+                    cycle = chain[chain.index(i):]
+                    del chain[-len(cycle):]
+                    for j in cycle:
+                        depth[j] = CYCLE
+                        self.add('cycle', j)
+                    top = BROKEN
+                elif top == CYCLE:
+                    top = BROKEN
+            for j in reversed(chain):
+                if top != BROKEN:
+                    top += 1
+                depth[j] = top
+
+    def check_levels(self):
+        parent, depth, levels = self.parent, self.depth, self.levels
+        for i, d in enumerate(depth):
+            if d == BROKEN:
+                if parent[i] >= 0:
+                    self.add('no_factory_chain', i)
+            elif d >= 0:
+                if levels[i] != d:
+                    self.add('level_mismatch', i)
+                if d > self.max_level:
+                    self.add('too_deep', i)
+
+    def report(self):
+        if not any(self.violations.values()):
+            self.stdout.write(self.style.SUCCESS(f'No violations in {len(self.ids)} nodes.'))
+            return
+        for kind in self.kinds:
+            if self.violations[kind]:
+                ids = ', '.join(map(str, self.samples[kind]))
+                more = ', ...' if self.violations[kind] > len(self.samples[kind]) else ''
+                self.stdout.write(self.style.ERROR(f'{kind}: {self.violations[kind]}'))
+                self.stdout.write(f'  ids: {ids}{more}')
+
+    def repair(self):
+        """
+        Clears the suppliers of the factories, then writes the computed levels, batch_size rows per statement.
+        A row is only written if its supplier and level are still the ones that were read.
+        """
+        table = NetworkNode._meta.db_table
+        node_types = NetworkNode.NODE_CHOICES
+        ids, parent, depth, levels = self.ids, self.parent, self.depth, self.levels
+
+        detached = self.write_batches(
+            f'UPDATE {table} n SET supplier_id = NULL FROM unnest(%s::bigint[]) AS v(id) '
+            f'WHERE n.id = v.id AND n.node_type = %s',
+            self.detached, lambda batch: [batch, node_types[0][0]]
+        )
+        self.progress(f'{detached} factory suppliers cleared')
+
+        mismatched = (
+            (ids[i], levels[i], depth[i], ids[parent[i]] if parent[i] >= 0 else None)
+            for i in range(len(ids)) if depth[i] >= 0 and levels[i] != depth[i]
+        )
+        fixed = self.write_batches(
+            f'UPDATE {table} n SET level = v.level '
+            f'FROM unnest(%s::bigint[], %s::int[], %s::int[], %s::bigint[]) AS v(id, stored, level, supplier) '
+            f'WHERE n.id = v.id AND n.level = v.stored AND n.supplier_id IS NOT DISTINCT FROM v.supplier',
+            mismatched, lambda batch: [list(column) for column in zip(*batch)]
+        )
+        self.progress(f'{fixed} levels fixed')
+
+        if detached or fixed:
+            bump_after_sql_write(NODES, SUBTREES)
+
+    def write_batches(self, sql, rows, params):
+        """
+        Runs sql with the params of every batch of rows, each batch in its own transaction,
+        and returns the number of rows written.
+        """
+        written = 0
+        batch = []
+        rows = iter(rows)
+        while True:
+            batch.clear()
+            for row in rows:
+                batch.append(row)
+                if len(batch) == self.options['batch_size']:
+                    break
+            if not batch:
+                return written
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params(batch))
+                written += cursor.rowcount
@@ -0,0 +1,181 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib import import_module
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, login
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.http import HttpRequest
+from django.test.utils import override_settings
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput of the read endpoints served by sync WSGI, by sync views under ASGI and by
+    the async views, in this process, on the current database.
+
+    Every mode serves the same --requests requests of the given --path, as a logged-in user, with at most
+    --concurrency clients in flight. Each client takes --client-delay seconds to read its response, as a slow
+    client on a slow network would. The WSGI mode has --threads worker threads, like a threaded WSGI server,
+    and a worker stays busy until its client has read the response. The ASGI modes call the ASGI application
+    directly on one event loop. The sync mode requests /platform/<path>, the async mode /platform/async/<path>.
+
+    The response cache is disabled during the run, so every request reads the database. The async views render
+    nodes from values(), so set NETWORK_NODE_VALUES_READ=True to compare the sync views with the same rendering.
+    Under ASGI every request runs its queries in a thread of its own, so persistent connections would pile up:
+    the ASGI modes run with CONN_MAX_AGE=0, and every request in flight opens a connection. Keep --concurrency
+    below the max_connections of the server.
+    """
+
+    help = 'Benchmarks the read endpoints under sync WSGI, sync views under ASGI and the async views.'
+
+    modes = ('wsgi', 'asgi-sync', 'asgi-async')
+    host = 'localhost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the active user the requests are made as')
+        parser.add_argument('--path', default='network-node/?page_size=100',
+                            help="Path under /platform/, e.g. 'products/' or 'network-node/1/tree/'")
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode (default 1000)')
+        parser.add_argument('--concurrency', type=int, default=200, help='Clients in flight (default 200)')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI mode (default 8)')
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Seconds a client takes to read a response (default 0.05)')
+        parser.add_argument('--mode', action='append', choices=self.modes,
+                            help='Mode to run, may be repeated (default all)')
+
+    def handle(self, *args, **options):
+        self.options = options
+        path, _, query = options['path'].partition('?')
+        self.query = query.encode()
+        self.cookie = self.login(options['email'])
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            for mode in options['mode'] or self.modes:
+                prefix = '/platform/async/' if mode == 'asgi-async' else '/platform/'
+                connections.close_all()
+                started = time.monotonic()
+                if mode == 'wsgi':
+                    results = self.run_wsgi(prefix + path)
+                else:
+                    with self.conn_max_age(0):
+                        results = asyncio.run(self.run_asgi(prefix + path))
+                self.report(mode, results, time.monotonic() - started)
+
+    @contextmanager
+    def conn_max_age(self, seconds):
+        """
+        Sets CONN_MAX_AGE of every database for the connections opened in the block.
+        """
+        saved = {alias: connections.settings[alias]['CONN_MAX_AGE'] for alias in connections}
+        for alias in saved:
+            connections.settings[alias]['CONN_MAX_AGE'] = seconds
+        try:
+            yield
+        finally:
+            for alias, value in saved.items():
+                connections.settings[alias]['CONN_MAX_AGE'] = value
+
+    def login(self, email):
+        """
+        Logs the user in with a new session and returns the session cookie header.
+        """
+        try:
+            user = get_user_model().objects.get(email=email, is_active=True)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No active user with the email {email}.')
+        request = HttpRequest()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        login(request, user, 'django.contrib.auth.backends.ModelBackend')
+        request.session.save()
+        return f'{settings.SESSION_COOKIE_NAME}={request.session.session_key}'
+
+    def run_wsgi(self, path):
+        """
+        Returns the (status, seconds) of every request served by the WSGI application from the worker threads,
+        counted from the time the client sent it.
+        """
+        application = get_wsgi_application()
+
+        semaphore = threading.Semaphore(self.options['concurrency'])
+
+        def request(started):
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': self.query.decode(),
+                'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'HTTP_HOST': self.host, 'HTTP_COOKIE': self.cookie,
+                'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': self.stderr,
+            }
+            response = application(environ, lambda code, headers: status.append(int(code.split()[0])))
+            try:
+                b''.join(response)
+                time.sleep(self.options['client_delay'])
+            finally:
+                response.close()
+                semaphore.release()
+            return status[0], time.monotonic() - started
+
+        # a client waits in the listen queue of the server until a worker thread is free
+        futures = []
+        with ThreadPoolExecutor(self.options['threads']) as executor:
+            for _ in range(self.options['requests']):
+                semaphore.acquire()
+                futures.append(executor.submit(request, time.monotonic()))
+        return [future.result() for future in futures]
+
+    async def run_asgi(self, path):
+        """
+        Returns the (status, seconds) of every request served by the ASGI application, concurrency at a time.
+        """
+        application = get_asgi_application()
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+
+        async def request():
+            async with semaphore:
+                started = time.monotonic()
+                status = []
+                received = asyncio.Event()
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': self.query,
+                    'root_path': '', 'server': (self.host, 80), 'client': ('127.0.0.1', 0),
+                    'headers': [(b'host', self.host.encode()), (b'cookie', self.cookie.encode())],
+                }
+
+                async def receive():
+                    if not received.is_set():
+                        received.set()
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    # the client never disconnects, the handler cancels this wait when the response is sent
+                    await asyncio.Future()
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    elif not message.get('more_body'):
+                        await asyncio.sleep(self.options['client_delay'])
+
+                await application(scope, receive, send)
+                return status[0], time.monotonic() - started
+
+        return await asyncio.gather(*(request() for _ in range(self.options['requests'])))
+
+    def report(self, mode, results, elapsed):
+        latencies = sorted(seconds for status, seconds in results)
+        errors = sum(status != 200 for status, seconds in results)
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{mode:>10}: {len(results) / elapsed:8.1f} req/s, '
+            f'p50 {quantiles[49] * 1000:7.1f} ms, p95 {quantiles[94] * 1000:7.1f} ms, '
+            f'p99 {quantiles[98] * 1000:7.1f} ms, {errors} errors'
+        )
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{mode}: {errors} of {len(results)} responses were not 200.'))
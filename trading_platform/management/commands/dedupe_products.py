@@ -0,0 +1,72 @@
+from django.db import connection, transaction
+
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, bump_after_sql_write
+from trading_platform.management.base import ProgressCommand
+from trading_platform.models import NetworkNode, Product
+
+
+class Command(ProgressCommand):
+    """
+    Merges the products with the same name and model, compared case-insensitively and without surrounding spaces,
+    into the oldest of them (the lowest id). Run it before the migration that adds the unique index on them.
+
+    The duplicates are found with one grouping query. Then, for every --batch-size duplicates in a transaction
+    of its own, the links of the network nodes to the duplicates are moved to the product kept, a node linked
+    to several of them keeping one link, the search columns of the relinked nodes are refreshed, and
+    the duplicates are deleted. With --dry-run the duplicates are only counted.
+    """
+
+    help = 'Merges duplicate products by normalized name and model and relinks their network nodes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Duplicates merged per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Count the duplicates without merging them')
+
+    def handle(self, *args, **options):
+        product_table = Product._meta.db_table
+        links_table = NetworkNode.products.through._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, keep FROM ('
+                f'  SELECT id, min(id) OVER (PARTITION BY lower(btrim(name)), lower(btrim(model))) AS keep'
+                f'  FROM {product_table}'
+                f') p WHERE id <> keep ORDER BY id'
+            )
+            duplicates = cursor.fetchall()
+        kept = len({keep for duplicate, keep in duplicates})
+        self.progress(f'{len(duplicates)} duplicates of {kept} products found')
+        if options['dry_run'] or not duplicates:
+            return
+
+        links = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(duplicates), batch_size):
+            ids, keeps = (list(column) for column in zip(*duplicates[start:start + batch_size]))
+            with transaction.atomic(), connection.cursor() as cursor:
+                # the links are moved with an UPDATE, which the search triggers of the links do not see, so
+                # the search columns of the nodes are refreshed once, instead of by an INSERT and again by a DELETE
+                cursor.execute(
+                    f'UPDATE {links_table} l SET product_id = c.keep FROM ('
+                    f'  SELECT DISTINCT ON (l.networknode_id, m.keep) l.id, m.keep FROM {links_table} l'
+                    f'  JOIN unnest(%s::bigint[], %s::bigint[]) AS m(id, keep) ON l.product_id = m.id'
+                    f'  WHERE NOT EXISTS (SELECT 1 FROM {links_table} o'
+                    f'                    WHERE o.networknode_id = l.networknode_id AND o.product_id = m.keep)'
+                    f'  ORDER BY l.networknode_id, m.keep, l.id'
+                    f') c WHERE l.id = c.id RETURNING l.networknode_id',
+                    [ids, keeps]
+                )
+                node_ids = [row[0] for row in cursor.fetchall()]
+                links += len(node_ids)
+                node_ids = sorted(set(node_ids))
+                # the links of nodes already linked to the product kept
+                cursor.execute(f'DELETE FROM {links_table} WHERE product_id = ANY(%s::bigint[])', [ids])
+                cursor.execute('SELECT trading_platform_node_search_refresh(%s::bigint[])', [node_ids])
+                cursor.execute(f'DELETE FROM {product_table} WHERE id = ANY(%s::bigint[])', [ids])
+                bump_after_sql_write(PRODUCTS, NODES, SUBTREES)
+            self.progress(f'{start + len(ids)} of {len(duplicates)} duplicates merged')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(duplicates)} duplicates merged into {kept} products, {links} node links moved '
+            f'in {self.elapsed():.1f}s.'
+        ))
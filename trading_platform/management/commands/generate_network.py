@@ -0,0 +1,180 @@
+import csv
+import io
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, bump_after_sql_write
+from trading_platform.management.base import ProgressCommand
+from trading_platform.models import NetworkNode, Product
+
+
+class Command(ProgressCommand):
+    """
+    Generates a synthetic network for load and performance tests: --factories factories, --retail retail networks
+    supplied by the factories, --traders sole traders supplied by the retail networks or, one in five, directly
+    by a factory, a catalog of --products products and about --links-per-node products per node.
+
+    The cities and the products follow skewed distributions, so a few big cities hold most of the nodes and
+    a few popular products most of the links, as in a real network. The retail networks and the traders owe
+    their suppliers a random debt, posted to the debt ledger as opening movements by its trigger.
+
+    The rows are written with COPY, --chunk-size rows per statement, in one transaction, and the database
+    triggers fill the search columns, the product counts and the ledger. The ids continue after the existing
+    rows, and the same --seed generates the same network on an empty database on the same day
+    (the creation times are spread over the --months months before the start of the day).
+    """
+
+    help = 'Generates a synthetic 3-level network of factories, retail networks and sole traders with products.'
+
+    # (country, city, weight)
+    cities = (
+        ('Россия', 'Москва', 30), ('Россия', 'Санкт-Петербург', 15), ('Россия', 'Новосибирск', 6),
+        ('Россия', 'Екатеринбург', 6), ('Россия', 'Казань', 5), ('Россия', 'Нижний Новгород', 4),
+        ('Россия', 'Самара', 3), ('Россия', 'Тула', 2), ('Россия', 'Тверь', 2), ('Беларусь', 'Минск', 6),
+        ('Беларусь', 'Гомель', 2), ('Казахстан', 'Алматы', 5), ('Казахстан', 'Астана', 3),
+        ('Армения', 'Ереван', 2), ('Узбекистан', 'Ташкент', 3), ('Китай', 'Шэньчжэнь', 6),
+    )
+    streets = ('Ленина', 'Мира', 'Советская', 'Гагарина', 'Центральная', 'Садовая', 'Лесная', 'Школьная', 'Победы')
+    surnames = ('Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков')
+    brands = ('Volna', 'Sever', 'Orbita', 'Zenit', 'Rubin', 'Vega', 'Elektron', 'Kvant', 'Signal', 'Polus')
+    product_kinds = ('Смартфон', 'Ноутбук', 'Планшет', 'Телевизор', 'Наушники', 'Монитор', 'Роутер', 'Колонка',
+                     'Фотоаппарат', 'Часы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factories', type=int, default=100, help='Number of factories (default 100)')
+        parser.add_argument('--retail', type=int, default=10000, help='Number of retail networks (default 10000)')
+        parser.add_argument('--traders', type=int, default=100000, help='Number of sole traders (default 100000)')
+        parser.add_argument('--products', type=int, default=10000, help='Number of products (default 10000)')
+        parser.add_argument('--links-per-node', type=int, default=5,
+                            help='Average number of products per node (default 5)')
+        parser.add_argument('--months', type=int, default=24,
+                            help='Months over which the creation times are spread (default 24)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator (default 0)')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows per COPY statement (default 100000)')
+
+    def handle(self, *args, **options):
+        if options['factories'] < 1 and options['retail'] + options['traders'] > 0:
+            raise CommandError('Retail networks and traders need at least one factory.')
+        if options['retail'] < 1 and options['traders'] > 0:
+            raise CommandError('Sole traders need at least one retail network.')
+        if options['links_per_node'] > 0 and options['products'] < 1:
+            raise CommandError('Links need at least one product.')
+
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.until = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.city_weights = list(accumulate(weight for country, city, weight in self.cities))
+
+        node_table = NetworkNode._meta.db_table
+        product_table = Product._meta.db_table
+        links_table = NetworkNode.products.through._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            node_start = self.next_id(cursor, node_table)
+            product_start = self.next_id(cursor, product_table)
+
+            self.copy(cursor, product_table, ('id', 'name', 'model', 'release_date', 'created_at'),
+                      self.product_rows(product_start))
+            self.copy(cursor, node_table, (
+                'id', 'name', 'email', 'country', 'city', 'street', 'house_number', 'node_type', 'supplier_id', 'debt',
+                'level', 'created_at'
+            ), self.node_rows(node_start))
+            links = self.copy(cursor, links_table, ('networknode_id', 'product_id'),
+                              self.link_rows(node_start, product_start))
+
+            for table in (node_table, product_table):
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), max(id)) FROM {table}", [table])
+            bump_after_sql_write(PRODUCTS, NODES, SUBTREES)
+
+        with connection.cursor() as cursor:
+            for table in (node_table, product_table, links_table):
+                cursor.execute(f'ANALYZE {table}')
+
+        nodes = options['factories'] + options['retail'] + options['traders']
+        self.stdout.write(self.style.SUCCESS(
+            f'{nodes} nodes, {options["products"]} products and {links} links generated '
+            f'in {self.elapsed():.1f}s.'
+        ))
+
+    def next_id(self, cursor, table):
+        cursor.execute(f'SELECT coalesce(max(id), 0) + 1 FROM {table}')
+        return cursor.fetchone()[0]
+
+    def copy(self, cursor, table, columns, rows):
+        """
+        Writes the rows to the table with one COPY per chunk_size rows and returns the number of rows.
+        """
+        total = 0
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.options['chunk_size'])):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(chunk)
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+            total += len(chunk)
+            self.progress(f'{table}: {total} rows')
+        return total
+
+    def created_at(self):
+        return self.until - timedelta(seconds=self.random.random() * self.options['months'] * 30 * 86400)
+
+    def product_rows(self, start):
+        for i in range(self.options['products']):
+            brand = self.random.choice(self.brands)
+            release_date = (self.until - timedelta(days=self.random.randrange(3650))).date()
+            yield (start + i, self.random.choice(self.product_kinds), f'{brand} {brand[0]}{start + i}', release_date,
+                   self.created_at().date())
+
+    def node_rows(self, start):
+        """
+        Yields the factories, then the retail networks, then the traders, so the ids of every type are a range.
+        """
+        factories, retail, traders = self.options['factories'], self.options['retail'], self.options['traders']
+        for i in range(factories + retail + traders):
+            pk = start + i
+            if i < factories:
+                node_type, supplier, level, debt = 'Factory', None, 0, 0
+                name = f'Завод {self.random.choice(self.brands)} {pk}'
+            elif i < factories + retail:
+                node_type, supplier, level = 'RetailNetwork', start + self.random.randrange(factories), 1
+                debt = self.random.randrange(100000000)
+                name = f'Сеть {self.random.choice(self.streets)} {pk}'
+            else:
+                node_type = 'IndividualEntrepreneur'
+                if self.random.random() < 0.2:
+                    supplier, level = start + self.random.randrange(factories), 1
+                else:
+                    supplier, level = start + factories + self.random.randrange(retail), 2
+                debt = self.random.randrange(10000000)
+                name = f'ИП {self.random.choice(self.surnames)} {pk}'
+            # most nodes owe their supplier something, some owe nothing
+            if self.random.random() < 0.3:
+                debt = 0
+            country, city, weight = self.random.choices(self.cities, cum_weights=self.city_weights)[0]
+            yield (
+                pk, name, f'node{pk}@example.com', country, city, f'ул. {self.random.choice(self.streets)}',
+                str(self.random.randint(1, 200)), node_type, supplier, f'{debt // 100}.{debt % 100:02d}', level,
+                self.created_at().isoformat(),
+            )
+
+    def link_rows(self, node_start, product_start):
+        """
+        Yields 1 to 2 * links_per_node - 1 products per node. The products are drawn with a quadratic skew
+        towards the first ones, so the first tenth of the catalog gets about a third of the links.
+        """
+        average = self.options['links_per_node']
+        if average < 1:
+            return
+        products = self.options['products']
+        nodes = self.options['factories'] + self.options['retail'] + self.options['traders']
+        for node_id in range(node_start, node_start + nodes):
+            count = min(self.random.randint(1, 2 * average - 1), products)
+            chosen = set()
+            while len(chosen) < count:
+                chosen.add(product_start + int(products * self.random.random() ** 2))
+            for product_id in sorted(chosen):
+                yield node_id, product_id
@@ -0,0 +1,366 @@
+import csv
+import json
+
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, bump_after_sql_write
+from trading_platform.management.base import ProgressCommand
+from trading_platform.models import DebtMovement, NetworkNode, Product
+
+
+class _Echo:
+    """
+    File-like object that returns what is written to it, so csv.writer can produce lines one by one.
+    """
+
+    def write(self, value):
+        return value
+
+
+class _LineReader:
+    """
+    File-like object over an iterator of text lines, read by COPY ... FROM STDIN.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Command(ProgressCommand):
+    """
+    Imports network nodes, products and node-product links from CSV or NDJSON files.
+
+    The files are loaded with COPY into temporary staging tables, the hierarchy rules are checked with a few
+    set-wise queries over the staged and the existing nodes, and the staged rows are merged into the
+    NetworkNode, Product and link tables in one transaction. Rows are matched on 'id': existing rows are updated,
+    new rows are inserted. The level of every node is computed from its supplier chain, including the existing
+    nodes below the imported ones.
+
+    With --dry-run the import is checked and rolled back, and the violations are reported.
+    """
+
+    help = 'Imports network nodes, products and node-product links from CSV or NDJSON files using COPY.'
+
+    staging_columns = {
+        'import_node': {
+            'id': 'bigint', 'name': 'text', 'email': 'text', 'country': 'text', 'city': 'text', 'street': 'text',
+            'house_number': 'text', 'node_type': 'text', 'supplier': 'bigint', 'debt': 'numeric',
+        },
+        'import_product': {
+            'id': 'bigint', 'name': 'text', 'model': 'text', 'release_date': 'date',
+        },
+        'import_link': {
+            'node_id': 'bigint', 'product_id': 'bigint',
+        },
+    }
+    required_columns = {
+        'import_node': ('id', 'name', 'email', 'city', 'street', 'house_number', 'node_type'),
+        'import_product': ('id', 'name', 'model', 'release_date'),
+        'import_link': ('node_id', 'product_id'),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', help='CSV or NDJSON file with network nodes')
+        parser.add_argument('--products', help='CSV or NDJSON file with products')
+        parser.add_argument('--links', help='CSV or NDJSON file with node_id,product_id links')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Format of the files, detected from the file extension by default')
+        parser.add_argument('--dry-run', action='store_true', help='Check the import and report violations only')
+        parser.add_argument('--show', type=int, default=20, help='Number of violations to print')
+        parser.add_argument('--progress-every', type=int, default=100000,
+                            help='Print progress every N rows while copying')
+
+    def handle(self, *args, **options):
+        files = {
+            'import_product': options['products'],
+            'import_node': options['nodes'],
+            'import_link': options['links'],
+        }
+        if not any(files.values()):
+            raise CommandError('Nothing to import, pass --nodes, --products and/or --links.')
+
+        self.options = options
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                self.create_staging_tables(cursor)
+                for table, path in files.items():
+                    if path:
+                        self.copy_file(cursor, table, path)
+
+                violations = self.check_rules(cursor)
+                if violations:
+                    self.report(cursor)
+                if options['dry_run'] or violations:
+                    self.drop_staging_tables(cursor)
+                    transaction.set_rollback(True)
+                    if violations and not options['dry_run']:
+                        raise CommandError('Import aborted, nothing was written.')
+                    self.stdout.write(self.style.SUCCESS('Dry run finished, nothing was written.'))
+                    return
+
+                self.merge(cursor)
+                self.drop_staging_tables(cursor)
+                bump_after_sql_write(PRODUCTS, NODES, SUBTREES)
+
+        self.stdout.write(self.style.SUCCESS(f'Import finished in {self.elapsed():.1f}s.'))
+
+    def create_staging_tables(self, cursor):
+        for table, columns in self.staging_columns.items():
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {table} ({", ".join(f"{name} {kind}" for name, kind in columns.items())}) '
+                f'ON COMMIT DROP'
+            )
+
+    def drop_staging_tables(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {", ".join(self.staging_columns)}, import_level, import_violation')
+
+    def read_lines(self, table, path, source):
+        """
+        Returns the columns of the file and an iterator of its data lines in CSV.
+        """
+        file_format = self.options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        if file_format == 'csv':
+            columns = next(csv.reader([source.readline()]), [])
+            return columns, source
+
+        columns = list(self.staging_columns[table])
+        writer = csv.writer(_Echo())
+
+        def lines():
+            for line in source:
+                if line.strip():
+                    row = json.loads(line)
+                    unknown = set(row) - set(columns)
+                    if unknown:
+                        raise CommandError(f'{path}: unexpected keys {", ".join(sorted(unknown))}')
+                    yield writer.writerow([row.get(name) for name in columns])
+
+        return columns, lines()
+
+    def copy_file(self, cursor, table, path):
+        """
+        Loads a file into a staging table with COPY.
+        """
+        allowed = self.staging_columns[table]
+        every = self.options['progress_every']
+        try:
+            source = open(path, encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(f'Cannot open {path}: {exc}')
+
+        with source:
+            columns, lines = self.read_lines(table, path, source)
+            unknown = [name for name in columns if name not in allowed]
+            missing = [name for name in self.required_columns[table] if name not in columns]
+            if unknown or missing:
+                raise CommandError(
+                    f'{path}: unknown columns: {", ".join(unknown) or "-"}; missing columns: {", ".join(missing) or "-"}'
+                )
+
+            def counted(lines):
+                for count, line in enumerate(lines, 1):
+                    if count % every == 0:
+                        self.progress(f'{table}: {count} rows read')
+                    yield line
+
+            cursor.copy_expert(
+                f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)',
+                _LineReader(counted(iter(lines)))
+            )
+        self.progress(f'{table}: {cursor.rowcount} rows copied from {path}')
+        cursor.execute(f'ANALYZE {table}')
+
+    def check_rules(self, cursor):
+        """
+        Computes the levels of the staged and existing nodes and collects the rule violations.
+        Returns the number of violations.
+        """
+        node_table = NetworkNode._meta.db_table
+        product_table = Product._meta.db_table
+        cursor.execute('CREATE INDEX ON import_node (id)')
+        cursor.execute('CREATE INDEX ON import_node (supplier)')
+
+        # Levels over the staged nodes and the existing ones they do not replace, walked down from the factories.
+        # The walk stops one level past the limit of 2, so chains that are too long or cyclic never reach the end.
+        # A node id repeated in the input is reached once per row: it is kept once, at its lowest level, and
+        # reported by the duplicate_id check below.
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE import_level ON COMMIT DROP AS
+            WITH RECURSIVE graph AS (
+                SELECT id, supplier AS supplier_id, node_type, true AS staged FROM import_node
+                UNION ALL
+                SELECT n.id, n.supplier_id, n.node_type, false FROM {node_table} n
+                WHERE NOT EXISTS (SELECT 1 FROM import_node i WHERE i.id = n.id)
+            ), levels AS (
+                SELECT id, 0 AS level FROM graph WHERE node_type = 'Factory' AND supplier_id IS NULL
+                UNION ALL
+                SELECT g.id, l.level + 1 FROM graph g JOIN levels l ON g.supplier_id = l.id WHERE l.level < 3
+            )
+            SELECT DISTINCT ON (levels.id) levels.id, levels.level, n.level AS stored_level
+            FROM levels LEFT JOIN {node_table} n ON n.id = levels.id
+            ORDER BY levels.id, levels.level
+        """)
+        cursor.execute('CREATE INDEX ON import_level (id)')
+        self.progress('Levels computed')
+
+        node_types = [choice for choice, label in NetworkNode.NODE_CHOICES]
+        checks = [
+            ("'duplicate_id'", 'import_node i', 'i.id IN (SELECT id FROM import_node GROUP BY id HAVING count(*) > 1)',
+             "'node id appears more than once'"),
+            ("'invalid_node_type'", 'import_node i', 'i.node_type <> ALL(%s)', "'node_type ' || coalesce(i.node_type, '')"),
+            ("'factory_with_supplier'", 'import_node i', "i.node_type = 'Factory' AND i.supplier IS NOT NULL",
+             "'supplier ' || i.supplier"),
+            ("'missing_supplier'", 'import_node i', "i.node_type <> 'Factory' AND i.supplier IS NULL", "''"),
+            ("'unknown_supplier'", 'import_node i',
+             f'i.supplier IS NOT NULL AND NOT EXISTS (SELECT 1 FROM import_node s WHERE s.id = i.supplier) '
+             f'AND NOT EXISTS (SELECT 1 FROM {node_table} s WHERE s.id = i.supplier)',
+             "'supplier ' || i.supplier"),
+            ("'too_deep'", 'import_level i', 'i.level > 2 AND (i.stored_level IS DISTINCT FROM i.level '
+                                             'OR EXISTS (SELECT 1 FROM import_node s WHERE s.id = i.id))',
+             "'level ' || i.level"),
+            ("'no_factory_chain'", 'import_node i',
+             "i.node_type <> 'Factory' AND i.supplier IS NOT NULL "
+             "AND NOT EXISTS (SELECT 1 FROM import_level l WHERE l.id = i.id)",
+             "'supplier chain does not reach a factory within 3 levels'"),
+            ("'duplicate_id'", 'import_product i',
+             'i.id IN (SELECT id FROM import_product GROUP BY id HAVING count(*) > 1)',
+             "'product id appears more than once'"),
+            # products are unique by name and model, compared case-insensitively without surrounding spaces
+            # (the index product_name_model_uniq), among the staged ones and against the existing ones
+            ("'duplicate_product'", 'import_product i',
+             '(lower(btrim(i.name)), lower(btrim(i.model))) IN ('
+             '  SELECT lower(btrim(name)), lower(btrim(model)) FROM import_product'
+             '  GROUP BY 1, 2 HAVING count(DISTINCT id) > 1'
+             ')',
+             "'name and model appear with several ids'"),
+            ("'existing_product'", 'import_product i',
+             f'EXISTS (SELECT 1 FROM {product_table} p WHERE lower(btrim(p.name)) = lower(btrim(i.name)) '
+             f'AND lower(btrim(p.model)) = lower(btrim(i.model)) AND p.id <> i.id)',
+             f"'same name and model as product ' || (SELECT p.id FROM {product_table} p "
+             f"WHERE lower(btrim(p.name)) = lower(btrim(i.name)) AND lower(btrim(p.model)) = lower(btrim(i.model)))"),
+            ("'unknown_node'", 'import_link i',
+             f'NOT EXISTS (SELECT 1 FROM import_node s WHERE s.id = i.node_id) '
+             f'AND NOT EXISTS (SELECT 1 FROM {node_table} s WHERE s.id = i.node_id)',
+             "'node ' || coalesce(i.node_id::text, '')"),
+            ("'unknown_product'", 'import_link i',
+             f'NOT EXISTS (SELECT 1 FROM import_product s WHERE s.id = i.product_id) '
+             f'AND NOT EXISTS (SELECT 1 FROM {product_table} s WHERE s.id = i.product_id)',
+             "'product ' || coalesce(i.product_id::text, '')"),
+        ]
+        for table, model in (('import_node', NetworkNode), ('import_product', Product)):
+            for name in self.staging_columns[table]:
+                field = model._meta.get_field(name)
+                if name in self.required_columns[table]:
+                    checks.append(("'missing_field'", f'{table} i', f'i.{name} IS NULL', f"'{name}'"))
+                if getattr(field, 'max_length', None) and self.staging_columns[table][name] == 'text':
+                    checks.append(("'too_long'", f'{table} i', f'length(i.{name}) > {field.max_length}',
+                                   f"'{name} longer than {field.max_length}'"))
+            if table == 'import_node':
+                checks.append(("'invalid_debt'", f'{table} i', 'i.debt >= 10 ^ 8 OR i.debt <> round(i.debt, 2)',
+                               "'debt ' || i.debt"))
+
+        cursor.execute('CREATE TEMPORARY TABLE import_violation (kind text, object text, id bigint, detail text) '
+                       'ON COMMIT DROP')
+        for kind, source, condition, detail in checks:
+            table = source.split()[0]
+            key = 'i.node_id' if table == 'import_link' else 'i.id'
+            label = 'import_node' if table == 'import_level' else table
+            cursor.execute(
+                f"INSERT INTO import_violation SELECT {kind}, '{label}', {key}, {detail} FROM {source} WHERE {condition}",
+                [node_types] if '%s' in condition else None
+            )
+        cursor.execute('SELECT count(*) FROM import_violation')
+        violations = cursor.fetchone()[0]
+        self.progress(f'Checked hierarchy rules: {violations} violations')
+        return violations
+
+    def report(self, cursor):
+        cursor.execute('SELECT object, kind, count(*) FROM import_violation GROUP BY object, kind ORDER BY object, kind')
+        for table, kind, count in cursor.fetchall():
+            self.stdout.write(self.style.ERROR(f'{table}: {kind}: {count}'))
+        cursor.execute('SELECT object, kind, id, detail FROM import_violation ORDER BY object, kind, id LIMIT %s',
+                       [self.options['show']])
+        for table, kind, pk, detail in cursor.fetchall():
+            self.stdout.write(f'  {table} id={pk} {kind}: {detail}')
+
+    def merge(self, cursor):
+        """
+        Upserts the staged products, nodes and links and fixes the levels of the existing nodes below them.
+        A node imported without 'debt' or 'country' keeps its current value. A new debt of an existing node
+        is posted to the debt ledger as an adjustment.
+        """
+        node_table = NetworkNode._meta.db_table
+        product_table = Product._meta.db_table
+        through = NetworkNode.products.through._meta.db_table
+
+        cursor.execute(f"""
+            INSERT INTO {product_table} (id, name, model, release_date, created_at)
+            SELECT id, name, model, release_date, CURRENT_DATE FROM import_product
+            ON CONFLICT (id) DO UPDATE SET
+                name = EXCLUDED.name, model = EXCLUDED.model, release_date = EXCLUDED.release_date
+        """)
+        self.progress(f'{cursor.rowcount} products merged')
+
+        # the debt of an existing node only changes through the ledger, a new node gets an opening movement
+        # from a trigger
+        cursor.execute(f"""
+            INSERT INTO {DebtMovement._meta.db_table} (node_id, kind, amount, created_at)
+            SELECT n.id, %s, i.debt - n.debt, now()
+            FROM import_node i JOIN {node_table} n ON n.id = i.id
+            WHERE i.debt IS NOT NULL AND i.debt <> n.debt
+        """, [DebtMovement.ADJUSTMENT])
+        self.progress(f'{cursor.rowcount} debt adjustments posted')
+
+        cursor.execute(f"""
+            UPDATE {node_table} n SET
+                name = i.name, email = i.email, country = coalesce(i.country, n.country), city = i.city,
+                street = i.street, house_number = i.house_number,
+                node_type = i.node_type, supplier_id = i.supplier, debt = coalesce(i.debt, n.debt), level = l.level
+            FROM import_node i JOIN import_level l ON l.id = i.id
+            WHERE n.id = i.id
+        """)
+        self.progress(f'{cursor.rowcount} nodes updated')
+
+        cursor.execute(f"""
+            INSERT INTO {node_table}
+                (id, name, email, country, city, street, house_number, node_type, supplier_id, debt, level, created_at)
+            SELECT i.id, i.name, i.email, coalesce(i.country, ''), i.city, i.street, i.house_number, i.node_type,
+                   i.supplier,
+                   coalesce(i.debt, 0), l.level, now()
+            FROM import_node i JOIN import_level l ON l.id = i.id
+            WHERE NOT EXISTS (SELECT 1 FROM {node_table} n WHERE n.id = i.id)
+        """)
+        self.progress(f'{cursor.rowcount} nodes inserted')
+
+        cursor.execute(f"""
+            UPDATE {node_table} n SET level = l.level
+            FROM import_level l
+            WHERE l.id = n.id AND l.stored_level <> l.level
+              AND NOT EXISTS (SELECT 1 FROM import_node i WHERE i.id = n.id)
+        """)
+        self.progress(f'{cursor.rowcount} existing nodes moved to a new level')
+
+        cursor.execute(f"""
+            INSERT INTO {through} (networknode_id, product_id)
+            SELECT DISTINCT node_id, product_id FROM import_link
+            ON CONFLICT (networknode_id, product_id) DO NOTHING
+        """)
+        self.progress(f'{cursor.rowcount} links added')
+
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Product, NetworkNode]):
+            cursor.execute(sql)
@@ -0,0 +1,383 @@
+import http.client
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    """
+    Replays a weighted mix of read and write requests against a running server, e.g. runserver, gunicorn or
+    uvicorn, over HTTP, and reports the throughput and the latency percentiles as JSON, so that the runs
+    of two commits on the same data can be compared (--compare). Generate the data with generate_network.
+
+    --concurrency clients each keep a connection open and send their next request as soon as they have read
+    the response, for --duration seconds or until --requests requests are sent. The requests of the first
+    --warmup seconds are not recorded. The clients authenticate with a Bearer token, given with --token or
+    requested for --email and --password. Before the run a sample of up to --sample nodes and products
+    is read from the API, and the requests pick their ids, cities and search terms from it.
+
+    The write scenarios create sole traders supplied by the sampled retail networks, rename and delete
+    the nodes created by the run, and upsert products, new ones with the model 'LT-<run>-<n>'. The nodes created
+    and not deleted, and the new products, are left in the database. --read-only runs the read scenarios only.
+
+    The server throttles every user per endpoint (API_THROTTLE_RATE, API_THROTTLE_BULK_RATE): throttled
+    requests are counted apart from the errors, raise the rates of the server for a load test.
+    """
+
+    help = 'Replays a mix of read and write API requests against a server and reports the latencies as JSON.'
+
+    # name: (default weight, writes)
+    scenarios = {
+        'node_list': (20, False),
+        'node_list_fields': (10, False),
+        'node_filter': (15, False),
+        'node_search': (5, False),
+        'node_detail': (15, False),
+        'node_tree': (5, False),
+        'product_list': (5, False),
+        'product_detail': (5, False),
+        'product_nodes': (5, False),
+        'node_create': (5, True),
+        'node_update': (4, True),
+        'node_delete': (3, True),
+        'product_upsert': (3, True),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server')
+        parser.add_argument('--token', help='Bearer token of an active user')
+        parser.add_argument('--email', help='Email of an active user, to request a token')
+        parser.add_argument('--password', help='Password of the user')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (default 8)')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of the run (default 30)')
+        parser.add_argument('--requests', type=int, help='Stop after this many requests')
+        parser.add_argument('--warmup', type=float, default=0, help='Seconds of requests not recorded (default 0)')
+        parser.add_argument('--mix', help="Weights of the scenarios, e.g. 'node_list=10,node_create=0'")
+        parser.add_argument('--read-only', action='store_true', help='Run the read scenarios only')
+        parser.add_argument('--sample', type=int, default=5000, help='Nodes and products sampled (default 5000)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generators (default 0)')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails')
+        parser.add_argument('--label', default='', help='Label of the run in the report')
+        parser.add_argument('--output', help='File to write the JSON report to (default: the standard output)')
+        parser.add_argument('--compare', help='JSON report of an earlier run to compare this one to')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.url = urlsplit(options['url'])
+        if self.url.scheme not in ('http', 'https') or not self.url.hostname:
+            raise CommandError(f"Invalid URL: {options['url']}")
+        self.weights = self.get_weights(options)
+        self.run_id = f'{int(time.time()):x}'
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.created = []
+
+        connection = self.connect()
+        self.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        self.headers['Authorization'] = f'Bearer {options["token"] or self.get_token(connection)}'
+        self.sample(connection, options['sample'])
+        connection.close()
+
+        started_at = timezone.now()
+        self.started = time.monotonic()
+        self.record_from = self.started + options['warmup']
+        self.deadline = self.record_from + options['duration']
+        results = [[] for _ in range(options['concurrency'])]
+        clients = [
+            threading.Thread(target=self.client, args=(random.Random(options['seed'] + number), results[number]))
+            for number in range(options['concurrency'])
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        results = [result for client_results in results for result in client_results]
+        if not results:
+            raise CommandError('No request was recorded, check --duration and --warmup.')
+        elapsed = max(seconds + latency for name, status, seconds, latency in results)
+
+        report = {
+            'label': options['label'],
+            'commit': self.get_commit(),
+            'url': options['url'],
+            'started_at': started_at.isoformat(),
+            'concurrency': options['concurrency'],
+            'seconds': round(elapsed, 3),
+            **self.summarize(results, elapsed),
+            'scenarios': {
+                name: self.summarize([result for result in results if result[0] == name], elapsed)
+                for name in self.scenarios if any(result[0] == name for result in results)
+            },
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        self.print_summary(report)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.print_comparison(json.load(file), report)
+
+    def get_weights(self, options):
+        """
+        Returns {scenario: weight} of the scenarios to run, from the defaults, --mix and --read-only.
+        """
+        weights = {name: weight for name, (weight, writes) in self.scenarios.items()}
+        for item in filter(None, (options['mix'] or '').split(',')):
+            name, _, weight = item.partition('=')
+            if name not in weights or not weight.isdigit():
+                raise CommandError(f"Invalid --mix item '{item}', scenarios: {', '.join(self.scenarios)}")
+            weights[name] = int(weight)
+        if options['read_only']:
+            weights = {name: weight for name, weight in weights.items() if not self.scenarios[name][1]}
+        weights = {name: weight for name, weight in weights.items() if weight > 0}
+        if not weights:
+            raise CommandError('No scenario to run.')
+        return weights
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.url.hostname, self.url.port, timeout=self.options['timeout'])
+
+    def request(self, connection, method, path, body=None, headers=None):
+        """
+        Sends a request on the connection and returns the status and the decoded JSON body of the response.
+        """
+        connection.request(method, self.url.path.rstrip('/') + path,
+                           body=None if body is None else json.dumps(body).encode(),
+                           headers=headers if headers is not None else self.headers)
+        response = connection.getresponse()
+        content = response.read()
+        if content and response.headers.get_content_type() == 'application/json':
+            return response.status, json.loads(content)
+        return response.status, None
+
+    def get_token(self, connection):
+        if not self.options['email'] or not self.options['password']:
+            raise CommandError('Give --token, or --email and --password.')
+        status, data = self.request(connection, 'POST', '/user/token/',
+                                    {'email': self.options['email'], 'password': self.options['password']},
+                                    headers={'Content-Type': 'application/json'})
+        if status != 200:
+            raise CommandError(f'The token request failed with {status}: {data}')
+        return data['token']
+
+    def get_pages(self, connection, path, limit):
+        """
+        Returns up to limit rows of a list endpoint, following the cursor links of its pages.
+        """
+        rows = []
+        while path and len(rows) < limit:
+            status, data = self.request(connection, 'GET', path)
+            if status != 200:
+                raise CommandError(f'GET {path} failed with {status}: {data}')
+            rows += data['results']
+            path = None
+            if data['next']:
+                next_url = urlsplit(data['next'])
+                path = next_url.path.removeprefix(self.url.path.rstrip('/')) + '?' + next_url.query
+        return rows[:limit]
+
+    def sample(self, connection, limit):
+        page_size = min(limit, 1000)
+        nodes = self.get_pages(
+            connection, f'/platform/network-node/?page_size={page_size}&fields=id,name,city,node_type,level', limit
+        )
+        products = self.get_pages(
+            connection, f'/platform/products/?page_size={page_size}&fields=id,name,model,release_date', limit
+        )
+        if not nodes or not products:
+            raise CommandError('The load test needs nodes and products, generate them with generate_network.')
+        self.nodes = [node['id'] for node in nodes]
+        self.factories = [node['id'] for node in nodes if node['level'] == 0] or self.nodes
+        self.retail = [node['id'] for node in nodes if node['node_type'] == 'RetailNetwork' and node['level'] == 1]
+        self.cities = sorted({node['city'] for node in nodes})
+        self.terms = sorted({word for node in nodes for word in node['name'].split() if len(word) > 3})
+        self.products = products
+        if self.weights.keys() & {'node_create', 'node_update', 'node_delete'} and not self.retail:
+            raise CommandError('No retail network of level 1 in the sample to supply the nodes created.')
+
+    def client(self, rng, results):
+        """
+        Sends requests until the deadline or the request limit, and appends the (scenario, status, start, seconds)
+        of the recorded ones to results. A failed connection is recorded with the status 0 and reopened.
+        """
+        names, weights = list(self.weights), list(self.weights.values())
+        connection = self.connect()
+        while True:
+            with self.lock:
+                if self.options['requests'] is not None and self.sent >= self.options['requests']:
+                    break
+                self.sent += 1
+            name = rng.choices(names, weights)[0]
+            built = getattr(self, f'build_{name}')(rng)
+            if built is None:
+                # no node created by the run to update or delete yet
+                name, built = 'node_create', self.build_node_create(rng)
+            method, path, body = built
+            started = time.monotonic()
+            if started >= self.deadline:
+                break
+            try:
+                status, data = self.request(connection, method, path, body)
+            except (OSError, http.client.HTTPException, ValueError):
+                status, data = 0, None
+                connection.close()
+                connection = self.connect()
+            seconds = time.monotonic() - started
+            if name == 'node_create' and status == 201:
+                with self.lock:
+                    self.created.append((data['id'], data['supplier']))
+            if started >= self.record_from:
+                results.append((name, status, started - self.record_from, seconds))
+        connection.close()
+
+    def take_created(self, remove=False):
+        """
+        Returns the (id, supplier) of the last node created by the run, removed from the list if remove, or None.
+        """
+        with self.lock:
+            if not self.created:
+                return None
+            if remove:
+                return self.created.pop()
+            return self.created[-1]
+
+    def build_node_list(self, rng):
+        return 'GET', '/platform/network-node/?page_size=50', None
+
+    def build_node_list_fields(self, rng):
+        return 'GET', '/platform/network-node/?page_size=100&fields=id,name,city,supplier,debt', None
+
+    def build_node_filter(self, rng):
+        query = {'city': rng.choice(self.cities), 'node_type': 'IndividualEntrepreneur', 'level': 2, 'page_size': 50}
+        return 'GET', f'/platform/network-node/?{urlencode(query)}', None
+
+    def build_node_search(self, rng):
+        return 'GET', f'/platform/network-node/?{urlencode({"search": rng.choice(self.terms), "page_size": 20})}', None
+
+    def build_node_detail(self, rng):
+        return 'GET', f'/platform/network-node/{rng.choice(self.nodes)}/', None
+
+    def build_node_tree(self, rng):
+        return 'GET', f'/platform/network-node/{rng.choice(self.factories)}/tree/?depth=1', None
+
+    def build_product_list(self, rng):
+        return 'GET', '/platform/products/?page_size=100', None
+
+    def build_product_detail(self, rng):
+        return 'GET', f'/platform/products/{rng.choice(self.products)["id"]}/', None
+
+    def build_product_nodes(self, rng):
+        return 'GET', f'/platform/products/{rng.choice(self.products)["id"]}/nodes/?page_size=50', None
+
+    def build_node_create(self, rng):
+        number = rng.randrange(10 ** 9)
+        return 'POST', '/platform/network-node/', {
+            'name': f'ИП Нагрузка {self.run_id}-{number}',
+            'email': f'load-{self.run_id}-{number}@example.com',
+            'country': 'Россия',
+            'city': rng.choice(self.cities),
+            'street': 'ул. Тестовая',
+            'house_number': str(rng.randint(1, 200)),
+            'node_type': 'IndividualEntrepreneur',
+            'supplier': rng.choice(self.retail),
+            'product_ids': sorted({product['id'] for product in rng.sample(self.products, min(3, len(self.products)))}),
+        }
+
+    def build_node_update(self, rng):
+        node = self.take_created()
+        if node is None:
+            return None
+        # the validation of the node needs its supplier, even for a partial update
+        return 'PATCH', f'/platform/network-node/{node[0]}/', {
+            'name': f'ИП Нагрузка {self.run_id}-{node[0]}', 'supplier': node[1],
+        }
+
+    def build_node_delete(self, rng):
+        node = self.take_created(remove=True)
+        if node is None:
+            return None
+        return 'DELETE', f'/platform/network-node/{node[0]}/', None
+
+    def build_product_upsert(self, rng):
+        items = [{'name': product['name'], 'model': product['model'], 'release_date': product['release_date']}
+                 for product in rng.sample(self.products, min(8, len(self.products)))]
+        items += [{'name': 'Смартфон', 'model': f'LT-{self.run_id}-{rng.randrange(10 ** 9)}', 'release_date': '2024-01-01'}
+                  for _ in range(2)]
+        return 'POST', '/platform/products/bulk-upsert/', items
+
+    def summarize(self, results, elapsed):
+        """
+        Returns the request counts, the throughput and the latency percentiles in milliseconds of the results.
+        """
+        latencies = sorted(seconds * 1000 for name, status, started, seconds in results)
+        statuses = Counter(status for name, status, started, seconds in results)
+        errors = sum(count for status, count in statuses.items() if status == 0 or (status >= 400 and status != 429))
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'requests': len(results),
+            'throughput': round(len(results) / elapsed, 2) if elapsed else 0,
+            'errors': errors,
+            'throttled': statuses[429],
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies), 2),
+                'p50': round(quantiles[49], 2),
+                'p95': round(quantiles[94], 2),
+                'p99': round(quantiles[98], 2),
+                'max': round(latencies[-1], 2),
+            },
+        }
+
+    def get_commit(self):
+        """
+        Returns the commit checked out in the project directory, or None outside a git checkout.
+        """
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                  text=True, timeout=5, check=True).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    def print_summary(self, report):
+        rows = [('total', report)] + list(report['scenarios'].items())
+        for name, summary in rows:
+            latency = summary['latency_ms']
+            self.stderr.write(
+                f'{name:>18}: {summary["requests"]:7} requests, {summary["throughput"]:8.1f} req/s, '
+                f'p50 {latency["p50"]:7.1f} ms, p95 {latency["p95"]:7.1f} ms, p99 {latency["p99"]:7.1f} ms, '
+                f'{summary["errors"]} errors, {summary["throttled"]} throttled'
+            )
+
+    def print_comparison(self, baseline, report):
+        """
+        Prints the change of the throughput and of the p50 and p95 latencies from the baseline report.
+        """
+        def change(new, old):
+            return f'{(new - old) / old * 100:+6.1f}%' if old else '     -'
+
+        self.stderr.write(f'compared to {baseline.get("label") or baseline.get("commit") or "the baseline"}:')
+        rows = [('total', report, baseline)]
+        rows += [(name, summary, baseline.get('scenarios', {}).get(name))
+                 for name, summary in report['scenarios'].items()]
+        for name, summary, old in rows:
+            if old is None:
+                continue
+            self.stderr.write(
+                f'{name:>18}: throughput {change(summary["throughput"], old["throughput"])}, '
+                f'p50 {change(summary["latency_ms"]["p50"], old["latency_ms"]["p50"])}, '
+                f'p95 {change(summary["latency_ms"]["p95"], old["latency_ms"]["p95"])}'
+            )
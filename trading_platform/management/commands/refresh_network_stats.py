@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trading_platform.models import NetworkStats
+
+
+class Command(BaseCommand):
+    """
+    Refreshes the NetworkStats materialized view.
+
+    Run it from cron, or with --every to keep refreshing it at a fixed interval.
+    """
+
+    help = 'Refreshes the network statistics materialized view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, help='Keep refreshing every N seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed_at = NetworkStats.refresh()
+            self.stdout.write(self.style.SUCCESS(f'Network statistics refreshed at {refreshed_at.isoformat()}.'))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
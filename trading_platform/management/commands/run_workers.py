@@ -0,0 +1,66 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from trading_platform.jobs import Worker
+
+
+class Command(BaseCommand):
+    """
+    Runs the background jobs queued in the Job table.
+
+    Each worker process claims one job at a time with SELECT ... FOR UPDATE SKIP LOCKED, so the command can run
+    with several processes, on several hosts at once. SIGTERM and SIGINT stop the workers after their current chunk.
+    """
+
+    help = 'Runs the queued background jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes (default 1)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before polling an empty queue again (default 1)')
+        parser.add_argument('--burst', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            self.work(options['poll_interval'], options['burst'])
+            return
+
+        # the children must open their own database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=self.work, args=(options['poll_interval'], options['burst']))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Started {len(processes)} workers.')
+
+        def stop(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def work(self, poll_interval, burst):
+        worker = Worker(poll_interval=poll_interval)
+
+        def stop(signum, frame):
+            worker.stopping = True
+
+        handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            worker.work(burst=burst)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.name} stopped.'))
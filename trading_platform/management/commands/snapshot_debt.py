@@ -0,0 +1,77 @@
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from trading_platform.management.base import ProgressCommand
+from trading_platform.models import DebtMovement, DebtSnapshot
+
+
+class Command(ProgressCommand):
+    """
+    Takes a snapshot of the debts of the network nodes as of --at, the start of the current day by default,
+    and creates the monthly partitions of the debt ledger up to --months-ahead months from now.
+
+    A snapshot is taken for the nodes with movements since the previous snapshot, from their previous snapshot
+    and the sum of these movements, in one statement, so the whole ledger is never scanned. Snapshots are
+    taken in time order.
+
+    A movement is dated with the start of the transaction that posts it, so one committed after the snapshot
+    could be dated before --at and would be missed for good. The snapshot is therefore refused when --at
+    is not before the start of every transaction open on the database, nor in the past: run the command
+    some minutes after the time it snapshots, e.g. daily shortly after midnight. The open transactions are read
+    from pg_stat_activity, which shows those of other roles only to members of pg_read_all_stats, so run
+    the command as the role of the application or as such a member.
+    """
+
+    help = 'Snapshots the debts of the network nodes and creates the partitions of the debt ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='Time of the snapshot, ISO 8601 (default: the start of the current day)')
+        parser.add_argument('--months-ahead', type=int, default=2, help='Months of ledger partitions to create')
+
+    def handle(self, *args, **options):
+        now = timezone.localtime()
+        at = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError(f"Invalid time: {options['at']}")
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+
+        for partition in DebtMovement.objects.create_partitions(now, options['months_ahead'] + 1):
+            self.progress(f'partition {partition} created')
+
+        snapshot_table = DebtSnapshot._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            # serializes the runs, the previous snapshot must not change until this one is written
+            cursor.execute(f'LOCK TABLE {snapshot_table} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(
+                "SELECT least(min(xact_start), clock_timestamp()) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid() AND xact_start IS NOT NULL"
+            )
+            cutoff = cursor.fetchone()[0]
+            if at >= cutoff:
+                raise CommandError(
+                    f'Movements dated before {at.isoformat()} may still be posted: the time of a snapshot must be '
+                    f'in the past and before the start of the open transactions, {cutoff.isoformat()}.'
+                )
+            last = DebtSnapshot.objects.order_by('-taken_at').values_list('taken_at', flat=True).first()
+            if last is not None and last >= at:
+                raise CommandError(f'Snapshots are taken in time order, the last one is as of {last.isoformat()}.')
+            cursor.execute(
+                f'INSERT INTO {snapshot_table} (node_id, taken_at, balance) '
+                f'SELECT m.node_id, %s, coalesce(s.balance, 0) + m.total FROM ('
+                f'  SELECT node_id, sum(amount) AS total FROM {DebtMovement._meta.db_table}'
+                f'  WHERE created_at > %s AND created_at <= %s GROUP BY node_id'
+                f') m LEFT JOIN LATERAL ('
+                f'  SELECT balance FROM {snapshot_table} s WHERE s.node_id = m.node_id ORDER BY s.taken_at DESC LIMIT 1'
+                f') s ON true',
+                [at, last or '-infinity', at]
+            )
+            nodes = cursor.rowcount
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Debts of {nodes} nodes snapshotted as of {at.isoformat()} in {self.elapsed():.1f}s.'
+        ))
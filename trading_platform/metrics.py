@@ -0,0 +1,360 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from trading_platform.cache import get_counters
+from trading_platform.throttling import get_throttle_counters
+
+# The timings of the current request, None outside ServerTimingMiddleware
+_timings = ContextVar('request_timings', default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    'api_request_duration_seconds': ('Time to serve a request, by view, action, method and status.', DURATION_BUCKETS),
+    'api_request_phase_seconds': (
+        'Time spent by a request in a phase: db (the SQL queries), auth, permission, throttle, '
+        'serialize (the view action without its queries) and render, each without the queries and phases within.',
+        DURATION_BUCKETS,
+    ),
+    'api_request_queries': ('SQL queries per request.', QUERY_BUCKETS),
+}
+
+
+class RequestTimings:
+    """
+    The seconds a request spent in each phase, and the number of its SQL queries.
+
+    A phase is timed without the queries and the phases timed within it, so the SQL time of a list action is
+    in 'db' and the rest of it in 'serialize', and the phases add up to the time of the request less the work
+    of the middleware. The queries of a server-side cursor (QuerySet.iterator() on PostgreSQL) are timed when
+    they are sent, the rows fetched later count in the phase that reads them.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {'db': 0.0}
+        self.queries = 0
+        self.accounted = 0.0
+        self.view = None
+        self.action = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.accounted += seconds
+
+    def start(self):
+        """
+        Returns the mark of a phase starting now, for stop().
+        """
+        return time.perf_counter(), self.accounted
+
+    def stop(self, phase, mark):
+        started, accounted = mark
+        self.add(phase, time.perf_counter() - started - (self.accounted - accounted))
+
+    def header(self, total):
+        """
+        Returns the Server-Timing header of the phases and the total, in milliseconds.
+        """
+        metrics = []
+        for phase, seconds in self.phases.items():
+            description = f';desc="{self.queries} queries"' if phase == 'db' else ''
+            metrics.append(f'{phase};dur={seconds * 1000:.1f}{description}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Times the block as a phase of the current request, if there is one.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    mark = timings.start()
+    try:
+        yield
+    finally:
+        timings.stop(phase, mark)
+
+
+def set_view(view, action):
+    """
+    Names the view and the action of the current request in its metrics.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.view, timings.action = view, action
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that times the queries of the current request.
+    """
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Adds record_query() to the execute wrappers of every database connection, on the connection_created signal.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class Registry:
+    """
+    The histograms of this process, as {(name, labels): [count of every bucket and of +Inf, sum]}.
+
+    With METRICS_DIR set, every process writes its histograms to a file of its own in that directory, at most
+    every METRICS_FLUSH_SECONDS seconds after a request and when it exits, and collect() adds up the files of all
+    the processes, so /metrics reports every worker of a multi-process server, whichever worker serves it.
+    The files of the processes that exited are kept, so the counts never go down while the server runs: empty
+    the directory when the server starts, as with the multiprocess mode of the Prometheus client.
+    Without METRICS_DIR collect() reports this process only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.values = {}
+        self.flushed = time.monotonic()
+        self.path = None
+
+    def observe(self, name, labels, value):
+        """
+        Adds the value to the histogram of the name with the labels, a tuple of (label, value) pairs.
+        """
+        buckets = HISTOGRAMS[name][1]
+        with self.lock:
+            entry = self.values.get((name, labels))
+            if entry is None:
+                entry = self.values[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+            entry[bisect_left(buckets, value)] += 1
+            entry[-1] += value
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and time.monotonic() - self.flushed >= settings.METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the histograms of this process to its file in METRICS_DIR, replaced at once.
+        """
+        if not settings.METRICS_DIR or not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            if self.path is None:
+                self.path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}-{uuid.uuid4().hex}.json')
+                atexit.register(self.flush)
+            with self.lock:
+                values = [[name, labels, list(entry)] for (name, labels), entry in self.values.items()]
+            self.flushed = time.monotonic()
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            with open(f'{self.path}.tmp', 'w') as file:
+                json.dump(values, file)
+            os.replace(f'{self.path}.tmp', self.path)
+        finally:
+            self.flush_lock.release()
+
+    def collect(self):
+        """
+        Returns the histograms of all the processes, see the class documentation.
+        """
+        with self.lock:
+            values = {key: list(entry) for key, entry in self.values.items()}
+        if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+            return values
+        for filename in os.listdir(settings.METRICS_DIR):
+            path = os.path.join(settings.METRICS_DIR, filename)
+            # this process is counted from memory, which is fresher than its file
+            if not filename.endswith('.json') or path == self.path:
+                continue
+            try:
+                with open(path) as file:
+                    rows = json.load(file)
+            except (OSError, ValueError):
+                # removed, or replaced while read
+                continue
+            for name, labels, entry in rows:
+                key = (name, tuple(tuple(label) for label in labels))
+                if key in values:
+                    values[key] = [total + value for total, value in zip(values[key], entry)]
+                else:
+                    values[key] = entry
+        return values
+
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def render_metrics():
+    """
+    Returns the histograms of the requests and the counters of the cached responses and of the throttles
+    in the Prometheus text format.
+    """
+    values = registry.collect()
+    lines = []
+    for name, (documentation, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} histogram']
+        for (metric, labels), entry in sorted(values.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), entry):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {entry[-1]}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+
+    # the counters live in the default cache, shared by the processes with a shared cache backend
+    lines += ['# HELP api_cache_responses_total Cached API responses served, by viewset and event.',
+              '# TYPE api_cache_responses_total counter']
+    for view, events in get_counters(['product', 'networknode']).items():
+        for event, value in events.items():
+            lines.append(f'api_cache_responses_total{_labels((("view", view), ("event", event)))} {value}')
+    lines += ['# HELP api_throttle_requests_total Throttled and allowed API requests, by scope.',
+              '# TYPE api_throttle_requests_total counter']
+    for scope, events in get_throttle_counters().items():
+        for event, value in events.items():
+            lines.append(f'api_throttle_requests_total{_labels((("scope", scope), ("event", event)))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request: its SQL queries (see record_query()), the phases timed by ServerTimingMixin and
+    the async views, the rendering of the response, and its total time.
+
+    The timings are sent in a Server-Timing header, unless SERVER_TIMING is off, and added to the histograms of
+    the registry by view and action, served in the Prometheus format at /metrics. The view is the basename
+    of the DRF viewset, or the URL name of other views, and the action the viewset action or the HTTP method.
+    The total time does not include the body of a streamed response (the exports), read after the view returns.
+
+    Put it first in MIDDLEWARE, so that the total time covers the other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.process_response(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.process_response(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the middleware hooks of template responses
+        timings = _timings.get()
+        if timings is not None:
+            mark = timings.start()
+            response.add_post_render_callback(lambda rendered: timings.stop('render', mark))
+        return response
+
+    def process_response(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        view, action = timings.view, timings.action
+        if view is None:
+            match = request.resolver_match
+            view, action = match.view_name if match else 'unmatched', request.method.lower()
+
+        labels = (('view', view), ('action', action))
+        registry.observe('api_request_duration_seconds',
+                         labels + (('method', request.method), ('status', str(response.status_code))), total)
+        for phase, seconds in timings.phases.items():
+            registry.observe('api_request_phase_seconds', labels + (('phase', phase),), seconds)
+        registry.observe('api_request_queries', labels, timings.queries)
+        registry.maybe_flush()
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.header(total)
+        return response
+
+
+class ServerTimingMixin:
+    """
+    Times the authentication, the permission and throttle checks and the action of a DRF view as phases
+    of the request for ServerTimingMiddleware, and names the view and the action of its metrics.
+    """
+
+    def perform_authentication(self, request):
+        with timed('auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with timed('permission'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timed('permission'):
+            super().check_object_permissions(request, obj)
+
+    def check_throttles(self, request):
+        with timed('throttle'):
+            super().check_throttles(request)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        timings = _timings.get()
+        if timings is not None:
+            self.action_mark = timings.start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        timings = _timings.get()
+        if timings is not None:
+            # the action, up to the data of the response, rendered later
+            if getattr(self, 'action_mark', None) is not None:
+                timings.stop('serialize', self.action_mark)
+                self.action_mark = None
+        set_view(getattr(self, 'basename', None) or type(self).__name__,
+                 getattr(self, 'action', None) or request.method.lower())
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0003_alter_networknode_level'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['created_at', 'id'], name='networknode_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='product_created_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0004_networknode_networknode_created_at_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+                CREATE MATERIALIZED VIEW trading_platform_networkstats AS
+                SELECT
+                    row_number() OVER (ORDER BY city, node_type, level, month) AS id,
+                    city, node_type, level, month, node_count, total_debt
+                FROM (
+                    SELECT
+                        city, node_type, level,
+                        date_trunc('month', created_at AT TIME ZONE 'UTC')::date AS month,
+                        count(*) AS node_count,
+                        sum(debt) AS total_debt
+                    FROM trading_platform_networknode
+                    GROUP BY 1, 2, 3, 4
+                ) stats;
+                CREATE UNIQUE INDEX trading_platform_networkstats_key
+                    ON trading_platform_networkstats (city, node_type, level, month);
+            """,
+            reverse_sql='DROP MATERIALIZED VIEW trading_platform_networkstats;',
+        ),
+        migrations.CreateModel(
+            name='NetworkStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100, verbose_name='Город')),
+                ('node_type', models.CharField(choices=[('Factory', 'Завод'), ('RetailNetwork', 'Розничная сеть'), ('IndividualEntrepreneur', 'Индивидуальный предприниматель')], max_length=50, verbose_name='Тип')),
+                ('level', models.IntegerField(verbose_name='Уровень в торговой сети')),
+                ('month', models.DateField(verbose_name='Месяц создания')),
+                ('node_count', models.BigIntegerField(verbose_name='Количество звеньев')),
+                ('total_debt', models.DecimalField(decimal_places=2, max_digits=20, verbose_name='Общий долг поставщикам')),
+            ],
+            options={
+                'verbose_name': 'Статистика сети',
+                'verbose_name_plural': 'Статистика сети',
+                'db_table': 'trading_platform_networkstats',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='NetworkStatsRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Время обновления')),
+            ],
+            options={
+                'verbose_name': 'Обновление статистики сети',
+                'verbose_name_plural': 'Обновления статистики сети',
+            },
+        ),
+    ]
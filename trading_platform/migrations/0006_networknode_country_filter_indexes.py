@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0005_network_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networknode',
+            name='country',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Страна'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['country', 'city', 'node_type', 'level'], name='networknode_country_city_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['city', 'node_type', 'level'], name='networknode_city_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['node_type', 'level', 'debt'], name='networknode_type_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['level', 'debt'], name='networknode_level_debt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=models.Index(fields=['debt'], name='networknode_debt_idx'),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+# search_document and search_vector are derived from the node and the names and models of its products.
+# A row trigger fills them in when a node is inserted or its text columns change, and statement triggers with
+# transition tables recompute them, once per statement, for the nodes whose product links or products changed.
+# They also cover bulk_create(), the bulk endpoint and the COPY import, which bypass the model signals.
+SEARCH_SQL = """
+    CREATE FUNCTION trading_platform_node_products_text(node_id bigint) RETURNS text AS $$
+        SELECT string_agg(concat_ws(' ', p.name, p.model), ' ' ORDER BY p.id)
+        FROM trading_platform_networknode_products np
+        JOIN trading_platform_product p ON p.id = np.product_id
+        WHERE np.networknode_id = node_id
+    $$ LANGUAGE sql STABLE;
+
+    CREATE FUNCTION trading_platform_node_search_vector(name text, address text, products text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(products, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(address, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE FUNCTION trading_platform_node_search_refresh(node_ids bigint[]) RETURNS void AS $$
+        UPDATE trading_platform_networknode n
+        SET search_document = concat_ws(' ', n.name, n.city, n.street, n.email, s.products),
+            search_vector = trading_platform_node_search_vector(
+                n.name, concat_ws(' ', n.city, n.street, n.email), s.products
+            )
+        FROM (SELECT id, trading_platform_node_products_text(id) AS products FROM unnest(node_ids) AS id) s
+        WHERE n.id = s.id
+    $$ LANGUAGE sql;
+
+    CREATE FUNCTION trading_platform_node_search_row() RETURNS trigger AS $$
+    DECLARE
+        products text := trading_platform_node_products_text(NEW.id);
+    BEGIN
+        NEW.search_document := concat_ws(' ', NEW.name, NEW.city, NEW.street, NEW.email, products);
+        NEW.search_vector := trading_platform_node_search_vector(
+            NEW.name, concat_ws(' ', NEW.city, NEW.street, NEW.email), products
+        );
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_networknode_search
+        BEFORE INSERT OR UPDATE OF name, city, street, email ON trading_platform_networknode
+        FOR EACH ROW EXECUTE FUNCTION trading_platform_node_search_row();
+
+    CREATE FUNCTION trading_platform_node_search_links() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM trading_platform_node_search_refresh(ARRAY(SELECT DISTINCT networknode_id FROM new_links));
+        ELSE
+            PERFORM trading_platform_node_search_refresh(ARRAY(SELECT DISTINCT networknode_id FROM old_links));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_networknode_products_search_insert
+        AFTER INSERT ON trading_platform_networknode_products
+        REFERENCING NEW TABLE AS new_links
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_node_search_links();
+
+    CREATE TRIGGER trading_platform_networknode_products_search_delete
+        AFTER DELETE ON trading_platform_networknode_products
+        REFERENCING OLD TABLE AS old_links
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_node_search_links();
+
+    CREATE FUNCTION trading_platform_product_search() RETURNS trigger AS $$
+    BEGIN
+        PERFORM trading_platform_node_search_refresh(ARRAY(
+            SELECT DISTINCT np.networknode_id
+            FROM new_products p
+            JOIN old_products o ON o.id = p.id
+            JOIN trading_platform_networknode_products np ON np.product_id = p.id
+            WHERE (p.name, p.model) IS DISTINCT FROM (o.name, o.model)
+        ));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_product_search
+        AFTER UPDATE ON trading_platform_product
+        REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_product_search();
+
+    SELECT trading_platform_node_search_refresh(ARRAY(SELECT id FROM trading_platform_networknode));
+"""
+
+SEARCH_REVERSE_SQL = """
+    DROP TRIGGER trading_platform_product_search ON trading_platform_product;
+    DROP TRIGGER trading_platform_networknode_products_search_delete ON trading_platform_networknode_products;
+    DROP TRIGGER trading_platform_networknode_products_search_insert ON trading_platform_networknode_products;
+    DROP TRIGGER trading_platform_networknode_search ON trading_platform_networknode;
+    DROP FUNCTION trading_platform_product_search();
+    DROP FUNCTION trading_platform_node_search_links();
+    DROP FUNCTION trading_platform_node_search_row();
+    DROP FUNCTION trading_platform_node_search_refresh(bigint[]);
+    DROP FUNCTION trading_platform_node_search_vector(text, text, text);
+    DROP FUNCTION trading_platform_node_products_text(bigint);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0006_networknode_country_filter_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='networknode',
+            name='search_document',
+            field=models.TextField(default='', editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.AddField(
+            model_name='networknode',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Вектор для поиска'),
+        ),
+        migrations.RunSQL(sql=SEARCH_SQL, reverse_sql=SEARCH_REVERSE_SQL),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='networknode_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networknode',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('search_document'), name='gin_trgm_ops'), name='networknode_search_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:43
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def check_duplicates(apps, schema_editor):
+    """
+    Stops the migration with a hint while the catalog still has duplicates the unique index would reject.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT count(*) FROM (SELECT 1 FROM trading_platform_product '
+            'GROUP BY lower(btrim(name)), lower(btrim(model)) HAVING count(*) > 1) d'
+        )
+        groups = cursor.fetchone()[0]
+    if groups:
+        raise RuntimeError(
+            f'{groups} products have duplicates by name and model. '
+            f'Merge them with "python manage.py dedupe_products" and migrate again.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0008_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower(django.db.models.functions.text.Trim('name')), django.db.models.functions.text.Lower(django.db.models.functions.text.Trim('model')), name='product_name_model_uniq'),
+        ),
+    ]
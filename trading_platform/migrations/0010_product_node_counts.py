@@ -0,0 +1,103 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+# The carrier counts of a product follow its links: statement triggers add and subtract the links inserted,
+# deleted or updated by a statement, grouped by product, and a row trigger moves the products of a node
+# in or out of factory_count when the node becomes or stops being a factory.
+COUNTS_SQL = """
+    CREATE FUNCTION trading_platform_product_counts_links() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE trading_platform_product p
+            SET node_count = p.node_count - c.nodes, factory_count = p.factory_count - c.factories
+            FROM (
+                SELECT l.product_id, count(*) AS nodes, count(*) FILTER (WHERE n.node_type = 'Factory') AS factories
+                FROM old_links l LEFT JOIN trading_platform_networknode n ON n.id = l.networknode_id
+                GROUP BY l.product_id
+            ) c
+            WHERE p.id = c.product_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE trading_platform_product p
+            SET node_count = p.node_count + c.nodes, factory_count = p.factory_count + c.factories
+            FROM (
+                SELECT l.product_id, count(*) AS nodes, count(*) FILTER (WHERE n.node_type = 'Factory') AS factories
+                FROM new_links l LEFT JOIN trading_platform_networknode n ON n.id = l.networknode_id
+                GROUP BY l.product_id
+            ) c
+            WHERE p.id = c.product_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_networknode_products_counts_insert
+        AFTER INSERT ON trading_platform_networknode_products
+        REFERENCING NEW TABLE AS new_links
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_product_counts_links();
+
+    CREATE TRIGGER trading_platform_networknode_products_counts_delete
+        AFTER DELETE ON trading_platform_networknode_products
+        REFERENCING OLD TABLE AS old_links
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_product_counts_links();
+
+    CREATE TRIGGER trading_platform_networknode_products_counts_update
+        AFTER UPDATE ON trading_platform_networknode_products
+        REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_product_counts_links();
+
+    CREATE FUNCTION trading_platform_product_counts_node_type() RETURNS trigger AS $$
+    BEGIN
+        UPDATE trading_platform_product p
+        SET factory_count = p.factory_count + CASE WHEN NEW.node_type = 'Factory' THEN 1 ELSE -1 END
+        FROM trading_platform_networknode_products l
+        WHERE l.networknode_id = NEW.id AND p.id = l.product_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_networknode_counts
+        AFTER UPDATE OF node_type ON trading_platform_networknode
+        FOR EACH ROW WHEN ((OLD.node_type = 'Factory') IS DISTINCT FROM (NEW.node_type = 'Factory'))
+        EXECUTE FUNCTION trading_platform_product_counts_node_type();
+
+    UPDATE trading_platform_product p
+    SET node_count = c.nodes, factory_count = c.factories
+    FROM (
+        SELECT l.product_id, count(*) AS nodes, count(*) FILTER (WHERE n.node_type = 'Factory') AS factories
+        FROM trading_platform_networknode_products l JOIN trading_platform_networknode n ON n.id = l.networknode_id
+        GROUP BY l.product_id
+    ) c
+    WHERE p.id = c.product_id;
+"""
+
+COUNTS_REVERSE_SQL = """
+    DROP TRIGGER trading_platform_networknode_counts ON trading_platform_networknode;
+    DROP TRIGGER trading_platform_networknode_products_counts_update ON trading_platform_networknode_products;
+    DROP TRIGGER trading_platform_networknode_products_counts_delete ON trading_platform_networknode_products;
+    DROP TRIGGER trading_platform_networknode_products_counts_insert ON trading_platform_networknode_products;
+    DROP FUNCTION trading_platform_product_counts_node_type();
+    DROP FUNCTION trading_platform_product_counts_links();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0009_product_name_model_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='factory_count',
+            field=models.PositiveIntegerField(db_default=0, editable=False, verbose_name='Количество заводов'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='node_count',
+            field=models.PositiveIntegerField(db_default=0, editable=False, verbose_name='Количество звеньев'),
+        ),
+        migrations.RunSQL(sql=COUNTS_SQL, reverse_sql=COUNTS_REVERSE_SQL),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:13
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Django cannot create a partitioned table, so the ledger is created here and the model only in the state.
+# The primary key of a partitioned table must include the partition key. The default partition holds
+# the movements of the months without a partition of their own, see DebtMovementManager.create_partitions().
+LEDGER_SQL = """
+    CREATE TABLE trading_platform_debtmovement (
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        kind varchar(20) NOT NULL,
+        amount numeric(10, 2) NOT NULL,
+        created_at timestamp with time zone NOT NULL,
+        node_id bigint NOT NULL
+            CONSTRAINT trading_platform_debtmovement_node_id_fk_networknode_id
+            REFERENCES trading_platform_networknode (id) DEFERRABLE INITIALLY DEFERRED,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE trading_platform_debtmovement_default PARTITION OF trading_platform_debtmovement DEFAULT;
+
+    CREATE INDEX debtmovement_node_created_idx ON trading_platform_debtmovement (node_id, created_at);
+    CREATE INDEX debtmovement_created_brin ON trading_platform_debtmovement USING brin (created_at);
+"""
+
+LEDGER_REVERSE_SQL = 'DROP TABLE trading_platform_debtmovement;'
+
+# The opening movements of the nodes created with a debt, and of the debts of the existing nodes
+OPENING_SQL = """
+    CREATE FUNCTION trading_platform_debt_opening() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO trading_platform_debtmovement (node_id, kind, amount, created_at)
+        SELECT id, 'opening', debt, created_at FROM new_nodes WHERE debt <> 0;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trading_platform_networknode_debt_opening
+        AFTER INSERT ON trading_platform_networknode
+        REFERENCING NEW TABLE AS new_nodes
+        FOR EACH STATEMENT EXECUTE FUNCTION trading_platform_debt_opening();
+
+    INSERT INTO trading_platform_debtmovement (node_id, kind, amount, created_at)
+    SELECT id, 'opening', debt, now() FROM trading_platform_networknode WHERE debt <> 0;
+"""
+
+OPENING_REVERSE_SQL = """
+    DROP TRIGGER trading_platform_networknode_debt_opening ON trading_platform_networknode;
+    DROP FUNCTION trading_platform_debt_opening();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0010_product_node_counts'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(sql=LEDGER_SQL, reverse_sql=LEDGER_REVERSE_SQL),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='DebtMovement',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('kind', models.CharField(choices=[('shipment', 'Поставка'), ('payment', 'Оплата'), ('adjustment', 'Корректировка'), ('opening', 'Начальный остаток')], max_length=20, verbose_name='Тип')),
+                        ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Сумма')),
+                        ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата проведения')),
+                        ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debt_movements', to='trading_platform.networknode', verbose_name='Звено')),
+                    ],
+                    options={
+                        'verbose_name': 'Движение задолженности',
+                        'verbose_name_plural': 'Движения задолженности',
+                        'indexes': [models.Index(fields=['node', 'created_at'], name='debtmovement_node_created_idx'), django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='debtmovement_created_brin')],
+                    },
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DebtSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(verbose_name='Дата снимка')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Долг поставщику')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debt_snapshots', to='trading_platform.networknode', verbose_name='Звено')),
+            ],
+            options={
+                'verbose_name': 'Снимок задолженности',
+                'verbose_name_plural': 'Снимки задолженности',
+                'indexes': [models.Index(fields=['taken_at'], name='debtsnapshot_taken_at_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='debtsnapshot',
+            constraint=models.UniqueConstraint(fields=('node', 'taken_at'), name='debtsnapshot_node_taken_at_uniq'),
+        ),
+        migrations.RunSQL(sql=OPENING_SQL, reverse_sql=OPENING_REVERSE_SQL),
+    ]
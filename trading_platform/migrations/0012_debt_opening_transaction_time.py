@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# The opening movements are dated with the start of the transaction, like the movements posted by
+# DebtMovementManager.post_movements(), instead of the creation time of the node set by the application
+OPENING_SQL = """
+    CREATE OR REPLACE FUNCTION trading_platform_debt_opening() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO trading_platform_debtmovement (node_id, kind, amount, created_at)
+        SELECT id, 'opening', debt, now() FROM new_nodes WHERE debt <> 0;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+"""
+
+OPENING_REVERSE_SQL = """
+    CREATE OR REPLACE FUNCTION trading_platform_debt_opening() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO trading_platform_debtmovement (node_id, kind, amount, created_at)
+        SELECT id, 'opening', debt, created_at FROM new_nodes WHERE debt <> 0;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading_platform', '0011_debt_ledger'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=OPENING_SQL, reverse_sql=OPENING_REVERSE_SQL),
+    ]
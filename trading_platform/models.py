@@ -1,4 +1,90 @@
-from django.db import models
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, models, router, transaction
+from django.db.models import Sum, Value
+from django.db.models.functions import Lower, Trim, Upper
+from django.utils import timezone
+
+
+class ProductManager(models.Manager):
+    """
+    Manager for Product with the catalog lookups by normalized name and model.
+
+    A product is identified by its name and model compared case-insensitively and without surrounding spaces,
+    which the unique index 'product_name_model_uniq' enforces.
+    """
+
+    def find(self, name, model):
+        """
+        Returns the queryset of the product with the normalized name and model, read through the unique index.
+        """
+        return self.annotate(normalized_name=Lower(Trim('name')), normalized_model=Lower(Trim('model'))).filter(
+            normalized_name=Lower(Trim(Value(name))), normalized_model=Lower(Trim(Value(model)))
+        )
+
+    def upsert(self, items, batch_size=5000):
+        """
+        Returns the (id, created) of the products of the items, dicts of name, model and release_date,
+        in the order of the items. The missing products are created; the existing ones, and items that
+        repeat an earlier item, get the id of the product already there and are not changed.
+
+        Every batch_size items are resolved by one INSERT ... ON CONFLICT DO NOTHING statement, which also
+        returns the ids of the existing products. A product created by a concurrent transaction after the
+        statement started is not seen by it, so those few items are resolved again.
+        """
+        result = []
+        for start in range(0, len(items), batch_size):
+            result.extend(self._upsert_batch(items[start:start + batch_size]))
+        return result
+
+    def _upsert_batch(self, items):
+        table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+        sql = f"""
+            WITH input AS (
+                SELECT * FROM unnest(%s::int[], %s::text[], %s::text[], %s::date[]) AS i(item, name, model, release_date)
+            ), created AS (
+                INSERT INTO {table} (name, model, release_date, created_at)
+                SELECT name, model, release_date, %s FROM input ORDER BY item
+                ON CONFLICT ((lower(btrim(name))), (lower(btrim(model)))) DO NOTHING
+                RETURNING id, lower(btrim(name)) AS name, lower(btrim(model)) AS model
+            )
+            SELECT i.item, coalesce(c.id, p.id), c.id IS NOT NULL
+            FROM input i
+            LEFT JOIN created c ON c.name = lower(btrim(i.name)) AND c.model = lower(btrim(i.model))
+            LEFT JOIN {table} p ON lower(btrim(p.name)) = lower(btrim(i.name))
+                AND lower(btrim(p.model)) = lower(btrim(i.model))
+            ORDER BY i.item
+        """
+        result = [None] * len(items)
+        pending = list(range(len(items)))
+        created_ids = set()
+        while pending:
+            params = [
+                pending,
+                [items[position]['name'] for position in pending],
+                [items[position]['model'] for position in pending],
+                [items[position]['release_date'] for position in pending],
+                timezone.localdate(),
+            ]
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            for position, pk, created in rows:
+                if pk is None:
+                    continue
+                # only the first of the items with the same key created the product
+                result[position] = (pk, created and pk not in created_ids)
+                if created:
+                    created_ids.add(pk)
+            pending = [position for position in pending if result[position] is None]
+        return result
 
 
 class Product(models.Model):
@@ -10,16 +96,222 @@ class Product(models.Model):
         model (str): The model of the product.
         release_date (date): The release date of the product.
         created_at (date): The date the product was created.
+        node_count (int): The number of network nodes that carry the product.
+        factory_count (int): The number of factories among them.
+
+    The counts are kept up to date by triggers on the links of the nodes to the products and on the node types
+    (see migration 0010), so they are never written by save().
     """
 
+    COUNT_FIELDS = ('node_count', 'factory_count')
+
     name = models.CharField(max_length=100, verbose_name='Название')
     model = models.CharField(max_length=100, verbose_name='Модель')
     release_date = models.DateField(verbose_name='Дата выпуска')
     created_at = models.DateField(auto_now_add=True, verbose_name='Дата создания')
+    node_count = models.PositiveIntegerField(db_default=0, editable=False, verbose_name='Количество звеньев')
+    factory_count = models.PositiveIntegerField(db_default=0, editable=False, verbose_name='Количество заводов')
+
+    objects = ProductManager()
 
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_at_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(Lower(Trim('name')), Lower(Trim('model')), name='product_name_model_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} {self.model}'
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the product without the counts, which the triggers may have changed since the product was read.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNT_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class NetworkNodeManager(models.Manager):
+    """
+    Manager for NetworkNode with hierarchy queries.
+
+    The supply chain is stored as an adjacency list (the 'supplier' foreign key), so whole chains are
+    fetched with a single recursive CTE instead of walking the foreign key one query at a time.
+
+    The search columns hold the names and models of all linked products, so they are deferred by default.
+    """
+
+    SEARCH_FIELDS = ('search_document', 'search_vector')
+    # the key of the advisory lock that serializes moves, see lock_subtree()
+    MOVE_LOCK_ID = 7301
+
+    TREE_FIELDS = (
+        'id', 'name', 'email', 'country', 'city', 'street', 'house_number', 'node_type', 'supplier', 'debt',
+        'created_at', 'level'
+    )
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.SEARCH_FIELDS)
+
+    def estimated_count(self, timeout=300):
+        """
+        Returns the planner's estimate of the number of rows in the table, from pg_class.
+        The estimate is cached for 'timeout' seconds.
+        """
+        table = self.model._meta.db_table
+
+        def estimate():
+            with connections[self.db].cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+            return max(row[0], 0) if row else 0
+
+        return cache.get_or_set(f'estimated_rows:{table}', estimate, timeout)
+
+    def distinct_cities(self):
+        """
+        Returns the distinct cities of the nodes in alphabetical order.
+
+        The cities are read with a loose index scan of the ('city', ...) index: one index lookup per city
+        instead of a scan of the whole table.
+        """
+        table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+        sql = f"""
+            WITH RECURSIVE cities AS (
+                SELECT min(city) AS city FROM {table}
+                UNION ALL
+                SELECT (SELECT min(city) FROM {table} WHERE city > c.city)
+                FROM cities c
+                WHERE c.city IS NOT NULL
+            )
+            SELECT city FROM cities WHERE city IS NOT NULL
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql)
+            return [row[0] for row in cursor.fetchall()]
+
+    def _tree_sql_parts(self, fields):
+        """
+        Returns the selected field names and the SQL fragments shared by the hierarchy CTEs.
+        'id' and 'supplier' are always selected because the response is nested on them.
+        """
+        opts = self.model._meta
+        qn = connections[self.db].ops.quote_name
+        fields = ['id', 'supplier'] + [name for name in fields if name not in ('id', 'supplier')]
+        columns = [(qn(opts.get_field(name).column), qn(name)) for name in fields]
+        return fields, {
+            'table': qn(opts.db_table),
+            'anchor': ', '.join(f'{column} AS {alias}' for column, alias in columns),
+            'recursive': ', '.join(f'n.{column}' for column, alias in columns),
+            'outer': ', '.join(alias for column, alias in columns),
+        }
+
+    def _fetch_rows(self, sql, params, fields):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [dict(zip(fields + ['depth'], row)) for row in cursor.fetchall()]
+
+    def subtree_rows(self, node_id, depth=None, fields=TREE_FIELDS):
+        """
+        Returns the node and all of its downstream nodes as a list of dicts, ordered by depth and id.
+
+        Each dict holds the requested fields plus 'depth', the distance from the given node.
+        'depth' limits how far down the chain is followed, None means no limit.
+        The list is empty if the node does not exist.
+        """
+        fields, parts = self._tree_sql_parts(fields)
+        sql = f"""
+            WITH RECURSIVE subtree AS (
+                SELECT {parts['anchor']}, 0 AS depth, ARRAY[id] AS path
+                FROM {parts['table']}
+                WHERE id = %s
+                UNION ALL
+                SELECT {parts['recursive']}, s.depth + 1, s.path || n.id
+                FROM {parts['table']} n
+                JOIN subtree s ON n.supplier_id = s.id
+                WHERE NOT n.id = ANY(s.path) AND (%s::integer IS NULL OR s.depth < %s::integer)
+            )
+            SELECT {parts['outer']}, depth FROM subtree ORDER BY depth, id
+        """
+        return self._fetch_rows(sql, [node_id, depth, depth], fields)
+
+    def lock_subtree(self, node_id):
+        """
+        Locks the node and all its downstream nodes for a move and returns their distance from the node as {id: depth}.
+
+        Must run in a transaction. Moves are serialized with a transaction-level advisory lock, so two moves
+        cannot make a cycle. The nodes are locked with SELECT ... FOR UPDATE, which also keeps new nodes from
+        being attached to them; the subtree is read again after every lock until no new node shows up.
+        """
+        using = router.db_for_write(self.model)
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [self.MOVE_LOCK_ID])
+        locked = set()
+        while True:
+            depths = {row['id']: row['depth'] for row in self.db_manager(using).subtree_rows(node_id, fields=('id',))}
+            new = depths.keys() - locked
+            if not new:
+                return depths
+            list(self.select_for_update().filter(pk__in=new).order_by('pk').values_list('pk', flat=True))
+            locked |= new
+
+    def move_subtree(self, node_id, supplier_id, level):
+        """
+        Sets the supplier and the level of the node, and the level of every downstream node from its distance
+        to the node, with one recursive UPDATE. Returns the number of updated nodes.
+        """
+        using = router.db_for_write(self.model)
+        table = connections[using].ops.quote_name(self.model._meta.db_table)
+        sql = f"""
+            WITH RECURSIVE subtree AS (
+                SELECT id, 0 AS depth, ARRAY[id] AS path
+                FROM {table}
+                WHERE id = %s
+                UNION ALL
+                SELECT n.id, s.depth + 1, s.path || n.id
+                FROM {table} n
+                JOIN subtree s ON n.supplier_id = s.id
+                WHERE NOT n.id = ANY(s.path)
+            )
+            UPDATE {table} n
+            SET level = %s + s.depth, supplier_id = CASE WHEN s.depth = 0 THEN %s ELSE n.supplier_id END
+            FROM subtree s
+            WHERE n.id = s.id AND (s.depth = 0 OR n.level <> %s + s.depth)
+        """
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [node_id, level, supplier_id, level])
+            return cursor.rowcount
+
+    def ancestor_rows(self, node_id, fields=TREE_FIELDS):
+        """
+        Returns the node and its upstream chain up to the factory as a list of dicts, factory first.
+
+        Each dict holds the requested fields plus 'depth', the distance from the given node.
+        The list is empty if the node does not exist.
+        """
+        fields, parts = self._tree_sql_parts(fields)
+        sql = f"""
+            WITH RECURSIVE chain AS (
+                SELECT {parts['anchor']}, 0 AS depth, ARRAY[id] AS path
+                FROM {parts['table']}
+                WHERE id = %s
+                UNION ALL
+                SELECT {parts['recursive']}, c.depth + 1, c.path || n.id
+                FROM {parts['table']} n
+                JOIN chain c ON n.id = c.supplier
+                WHERE NOT n.id = ANY(c.path)
+            )
+            SELECT {parts['outer']}, depth FROM chain ORDER BY depth DESC
+        """
+        return self._fetch_rows(sql, [node_id], fields)
 
 
 class NetworkNode(models.Model):
@@ -32,6 +324,7 @@ class NetworkNode(models.Model):
     level = models.IntegerField(verbose_name='Уровень в торговой сети')
     name = models.CharField(max_length=100, verbose_name='Название')
     email = models.EmailField(verbose_name='Email', help_text='Введите действующий email')
+    country = models.CharField(max_length=100, blank=True, default='', verbose_name='Страна')
     city = models.CharField(max_length=100, verbose_name='Город')
     street = models.CharField(max_length=100, verbose_name='Улица')
     house_number = models.CharField(max_length=20, verbose_name='Номер дома')
@@ -41,7 +334,295 @@ class NetworkNode(models.Model):
     products = models.ManyToManyField('Product', related_name='network_nodes', verbose_name='Продукты')
     debt = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Долг поставщику')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    # Filled in by database triggers from the node and its linked products, see migration 0007.
+    search_document = models.TextField(default='', editable=False, verbose_name='Текст для поиска')
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Вектор для поиска')
+
+    objects = NetworkNodeManager()
 
     class Meta:
         verbose_name = 'Звено'
         verbose_name_plural = 'Звенья'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='networknode_created_at_id_idx'),
+            models.Index(fields=['country', 'city', 'node_type', 'level'], name='networknode_country_city_idx'),
+            models.Index(fields=['city', 'node_type', 'level'], name='networknode_city_type_idx'),
+            models.Index(fields=['node_type', 'level', 'debt'], name='networknode_type_level_idx'),
+            models.Index(fields=['level', 'debt'], name='networknode_level_debt_idx'),
+            models.Index(fields=['debt'], name='networknode_debt_idx'),
+            GinIndex(fields=['search_vector'], name='networknode_search_vector_idx'),
+            GinIndex(OpClass(Upper('search_document'), name='gin_trgm_ops'), name='networknode_search_trgm_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class NetworkStats(models.Model):
+    """
+    Node counts and debt of the network, per city, node type, level and month of creation.
+
+    Read-only model over the 'trading_platform_networkstats' materialized view. The view is refreshed
+    concurrently by refresh(), so it can be read while it is being refreshed.
+    """
+
+    city = models.CharField(max_length=100, verbose_name='Город')
+    node_type = models.CharField(max_length=50, choices=NetworkNode.NODE_CHOICES, verbose_name='Тип')
+    level = models.IntegerField(verbose_name='Уровень в торговой сети')
+    month = models.DateField(verbose_name='Месяц создания')
+    node_count = models.BigIntegerField(verbose_name='Количество звеньев')
+    total_debt = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Общий долг поставщикам')
+
+    class Meta:
+        managed = False
+        db_table = 'trading_platform_networkstats'
+        verbose_name = 'Статистика сети'
+        verbose_name_plural = 'Статистика сети'
+
+    @classmethod
+    def refresh(cls):
+        """
+        Refreshes the materialized view and records the time of the refresh.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {connection.ops.quote_name(cls._meta.db_table)}')
+            refresh, created = NetworkStatsRefresh.objects.update_or_create(pk=1, defaults={'refreshed_at': timezone.now()})
+        return refresh.refreshed_at
+
+
+class NetworkStatsRefresh(models.Model):
+    """
+    The time of the last refresh of the NetworkStats materialized view, stored in a single row.
+    """
+
+    refreshed_at = models.DateTimeField(verbose_name='Время обновления')
+
+    class Meta:
+        verbose_name = 'Обновление статистики сети'
+        verbose_name_plural = 'Обновления статистики сети'
+
+
+class Job(models.Model):
+    """
+    A background job, claimed and run in chunks by the run_workers command (see trading_platform.jobs).
+
+    Attributes:
+        kind (str): The handler that runs the job.
+        params (dict): The input of the job, set when it is queued.
+        state (dict): Where the job stopped, saved after every chunk so another worker can resume it.
+        total (int): The number of items to process, set when the job starts.
+        done (int): The number of items processed so far.
+        heartbeat_at (datetime): The time the worker last reported progress. A running job without
+            a heartbeat for longer than the lease is claimed again.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+    KIND_CHOICES = (
+        ('clear_debt', 'Очистка задолженности'),
+    )
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES, verbose_name='Тип')
+    params = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='Параметры')
+    state = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='Состояние')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, verbose_name='Статус')
+    total = models.PositiveBigIntegerField(null=True, blank=True, verbose_name='Всего')
+    done = models.PositiveBigIntegerField(default=0, verbose_name='Выполнено')
+    error = models.TextField(blank=True, default='', verbose_name='Ошибка')
+    worker = models.CharField(max_length=100, blank=True, default='', verbose_name='Обработчик')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                   verbose_name='Автор')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начало')
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний отчёт')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Окончание')
+
+    class Meta:
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.pk}'
+
+
+class DebtMovementManager(models.Manager):
+    """
+    Manager for DebtMovement with the postings to the ledger, the balances as of a time and the monthly partitions.
+    """
+
+    def post_movements(self, movements, batch_size=1000):
+        """
+        Appends the movements to the ledger and applies them to the debts of their nodes, in the current
+        transaction. Returns the new debts as {node id: debt}.
+
+        The movements are inserted with one statement per batch_size movements. They are summed per node, and
+        the debts are updated batch_size nodes at a time in the order of their ids: the nodes of a batch are
+        locked in that order first, so two calls that share nodes lock them in the same order and never deadlock.
+        A debt is updated relative to its current value (debt = debt + total, as F('debt') + total would),
+        so no concurrent movement is lost between a read and a write.
+
+        The movements are dated with the start time of the database transaction, now() in SQL, like the opening
+        movements of the trigger, so a movement is never dated before the transaction that commits it started.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        node_table = connection.ops.quote_name(NetworkNode._meta.db_table)
+        totals = defaultdict(Decimal)
+        for movement in movements:
+            totals[movement.node_id] += movement.amount
+
+        debts = {}
+        node_ids = sorted(totals)
+        with connection.cursor() as cursor:
+            # the start of the database transaction, which snapshot_debt compares to the open transactions
+            cursor.execute('SELECT now()')
+            now = cursor.fetchone()[0]
+            for movement in movements:
+                movement.created_at = now
+            for start in range(0, len(movements), batch_size):
+                batch = movements[start:start + batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} (node_id, kind, amount, created_at) '
+                    f'SELECT node_id, kind, amount, %s FROM unnest(%s::bigint[], %s::text[], %s::numeric[]) '
+                    f'AS m(node_id, kind, amount)',
+                    [now, [m.node_id for m in batch], [m.kind for m in batch], [m.amount for m in batch]]
+                )
+            for start in range(0, len(node_ids), batch_size):
+                batch = node_ids[start:start + batch_size]
+                cursor.execute(f'SELECT id FROM {node_table} WHERE id = ANY(%s) ORDER BY id FOR NO KEY UPDATE', [batch])
+                cursor.execute(
+                    f'UPDATE {node_table} n SET debt = n.debt + v.amount '
+                    f'FROM unnest(%s::bigint[], %s::numeric[]) AS v(id, amount) WHERE n.id = v.id RETURNING n.id, n.debt',
+                    [batch, [totals[pk] for pk in batch]]
+                )
+                debts.update(cursor.fetchall())
+        return debts
+
+    def balance_as_of(self, node_id, at):
+        """
+        Returns the debt of the node at the time 'at': the balance of its last snapshot taken at or before then,
+        plus the movements posted since, read with one query each.
+        """
+        snapshot = DebtSnapshot.objects.db_manager(self.db).filter(node_id=node_id, taken_at__lte=at).order_by(
+            '-taken_at').values_list('taken_at', 'balance').first()
+        movements = self.filter(node_id=node_id, created_at__lte=at)
+        balance = Decimal(0)
+        if snapshot is not None:
+            movements = movements.filter(created_at__gt=snapshot[0])
+            balance = snapshot[1]
+        return balance + (movements.aggregate(total=Sum('amount'))['total'] or 0)
+
+    def create_partitions(self, start, months):
+        """
+        Creates the monthly partitions of the ledger from the month of 'start' for 'months' months, and returns
+        the names of those created. The movements of these months that were stored in the default partition,
+        because their partition did not exist yet, are moved to the new partitions.
+        """
+        connection = connections[self.db]
+        table = self.model._meta.db_table
+        month = datetime(start.year, start.month, 1, tzinfo=dt_timezone.utc)
+        created = []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+                [table]
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            for _ in range(months):
+                next_month = (month + timedelta(days=32)).replace(day=1)
+                partition = f'{table}_{month:%Y%m}'
+                if partition not in existing:
+                    bounds = f"FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+                    with transaction.atomic(using=self.db):
+                        cursor.execute(f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)')
+                        cursor.execute(
+                            f'WITH moved AS (DELETE FROM {table}_default WHERE created_at >= %s AND created_at < %s '
+                            f'RETURNING *) INSERT INTO {partition} SELECT * FROM moved',
+                            [month, next_month]
+                        )
+                        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES {bounds}')
+                    created.append(partition)
+                month = next_month
+        return created
+
+
+class DebtMovement(models.Model):
+    """
+    A change of the debt of a network node to its supplier, in the append-only debt ledger.
+
+    The debt of a node is the sum of its movements: every node created with a debt gets an opening movement
+    from a database trigger, and the debt is only changed by posting movements (see
+    DebtMovementManager.post_movements()). The table is partitioned by month of 'created_at', see migration 0011.
+
+    Attributes:
+        node (NetworkNode): The node whose debt changes.
+        kind (str): A shipment (positive amount), a payment (negative), an adjustment or the opening balance.
+        amount (Decimal): The change of the debt.
+        created_at (datetime): The time the movement was posted.
+    """
+
+    SHIPMENT = 'shipment'
+    PAYMENT = 'payment'
+    ADJUSTMENT = 'adjustment'
+    OPENING = 'opening'
+    KIND_CHOICES = (
+        (SHIPMENT, 'Поставка'),
+        (PAYMENT, 'Оплата'),
+        (ADJUSTMENT, 'Корректировка'),
+        (OPENING, 'Начальный остаток'),
+    )
+
+    node = models.ForeignKey(NetworkNode, on_delete=models.CASCADE, related_name='debt_movements',
+                             verbose_name='Звено')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата проведения')
+
+    objects = DebtMovementManager()
+
+    class Meta:
+        verbose_name = 'Движение задолженности'
+        verbose_name_plural = 'Движения задолженности'
+        indexes = [
+            models.Index(fields=['node', 'created_at'], name='debtmovement_node_created_idx'),
+            BrinIndex(fields=['created_at'], name='debtmovement_created_brin'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.amount}'
+
+
+class DebtSnapshot(models.Model):
+    """
+    The debt of a network node at a point in time, taken by the snapshot_debt command, so the debt at any time
+    is read from the last snapshot before it and the few movements since (see DebtMovementManager.balance_as_of()).
+
+    A snapshot is only taken for the nodes whose debt moved since the previous one.
+    """
+
+    node = models.ForeignKey(NetworkNode, on_delete=models.CASCADE, related_name='debt_snapshots',
+                             verbose_name='Звено')
+    taken_at = models.DateTimeField(verbose_name='Дата снимка')
+    balance = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Долг поставщику')
+
+    class Meta:
+        verbose_name = 'Снимок задолженности'
+        verbose_name_plural = 'Снимки задолженности'
+        indexes = [
+            models.Index(fields=['taken_at'], name='debtsnapshot_taken_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['node', 'taken_at'], name='debtsnapshot_node_taken_at_uniq'),
+        ]
@@ -0,0 +1,182 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, Cursor, CursorPagination, LimitOffsetPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the ('created_at', 'id') key.
+
+    DRF's CursorPagination keeps only the first ordering field in the cursor and skips rows with the same value
+    by offset, which degrades on columns with many equal values (Product.created_at is a date).
+    Here the cursor holds the whole key, so every page is a range scan of the ('created_at', 'id') index
+    that stops after page_size + 1 rows, however deep the page is.
+    """
+
+    ordering = ('created_at', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset(), for the async views.
+        """
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Returns the queryset of the requested page, with one extra row to tell whether another page follows.
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request) or Cursor(offset=0, reverse=False, position=None)
+
+        field_name, pk_name = self.ordering
+        if self.cursor.position is not None:
+            value, pk = self.decode_position(queryset, self.cursor.position)
+            lookup = 'lt' if self.cursor.reverse else 'gt'
+            queryset = queryset.filter(**{f'{field_name}__{lookup}e': value}).filter(
+                Q(**{f'{field_name}__{lookup}': value}) | Q(**{f'{pk_name}__{lookup}': pk})
+            )
+
+        if self.cursor.reverse:
+            queryset = queryset.order_by(f'-{field_name}', f'-{pk_name}')
+        else:
+            queryset = queryset.order_by(field_name, pk_name)
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.cursor.reverse:
+            self.page.reverse()
+        return self.page
+
+    def decode_position(self, queryset, position):
+        """
+        Returns the ordering field value and the primary key stored in a cursor position.
+        """
+        field_name, pk_name = self.ordering
+        try:
+            value, pk = position.rsplit('|', 1)
+            return queryset.model._meta.get_field(field_name).to_python(value), int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, instance):
+        """
+        Returns the cursor position of a model instance, or of a dict row of a values() queryset.
+        """
+        field_name, pk_name = self.ordering
+        if isinstance(instance, dict):
+            return f'{instance[field_name].isoformat()}|{instance[pk_name]}'
+        return f'{getattr(instance, field_name).isoformat()}|{getattr(instance, pk_name)}'
+
+    def get_next_link(self):
+        if not self.page:
+            return None
+        if self.cursor.reverse and self.cursor.position is None:
+            return None
+        if not self.cursor.reverse and not self.has_more:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.page:
+            return None
+        if not self.cursor.reverse and self.cursor.position is None:
+            return None
+        if self.cursor.reverse and not self.has_more:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0])))
+
+
+class OffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination for the clients that need page numbers.
+    """
+
+    default_limit = 100
+    max_limit = 1000
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset(), for the async views.
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [row async for row in queryset[self.offset:self.offset + self.limit]]
+
+
+class OptInPagination(BasePagination):
+    """
+    Paginates only when the client asks for it.
+
+    'cursor' or 'page_size' in the query selects KeysetPagination, 'limit' or 'offset' selects OffsetPagination.
+    Without any of them the full list is returned, as before pagination was added.
+    """
+
+    keyset_class = KeysetPagination
+    offset_class = OffsetPagination
+    paginator = None
+
+    def get_paginator(self, request):
+        """
+        Returns the paginator selected by the query parameters of the request, or None.
+        """
+        params = request.query_params
+        if self.keyset_class.cursor_query_param in params or self.keyset_class.page_size_query_param in params:
+            return self.keyset_class()
+        if self.offset_class.limit_query_param in params or self.offset_class.offset_query_param in params:
+            return self.offset_class()
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        if self.paginator is None:
+            return None
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset(), for the async views.
+        """
+        self.paginator = self.get_paginator(request)
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.keyset_class().get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_schema_fields(self, view):
+        return self.keyset_class().get_schema_fields(view) + self.offset_class().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return (self.keyset_class().get_schema_operation_parameters(view) +
+                self.offset_class().get_schema_operation_parameters(view))
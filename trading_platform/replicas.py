@@ -0,0 +1,129 @@
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# The database the reads of the current request go to, None for the router's default
+_read_database = ContextVar('read_database', default=None)
+
+
+def get_read_database():
+    """
+    Returns the replica the reads of the current request go to, or None if they go to the primary.
+    """
+    return _read_database.get()
+
+
+def reads_may_lag(since):
+    """
+    Returns True if the current request reads from a replica that may not have replayed the writes made
+    since the time in nanoseconds yet.
+    """
+    return _read_database.get() is not None and time.time_ns() - since < settings.DATABASE_REPLICA_PIN_SECONDS * 10 ** 9
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of the requests routed by ReplicaMiddleware to a replica, and everything else to the primary.
+
+    Writes, SELECT ... FOR UPDATE and migrations always go to 'default', so are the reads of management commands,
+    workers and requests that ReplicaMiddleware does not route.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Routes the reads of safe API requests (GET, HEAD, OPTIONS under /platform/) to a random replica
+    of DATABASE_REPLICAS, exports included.
+
+    A client reads its own writes: the response to any other request sets a cookie that keeps the client on
+    the primary for DATABASE_REPLICA_PIN_SECONDS, longer than the replicas take to replay the write.
+    Without replicas the middleware does nothing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    paths = ('/platform/',)
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+    pin_cookie = 'primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        database = self.get_read_database(request)
+        token = _read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        return self.process_response(request, response, database)
+
+    async def __acall__(self, request):
+        database = self.get_read_database(request)
+        token = _read_database.set(database)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        return self.process_response(request, response, database)
+
+    def get_read_database(self, request):
+        """
+        Returns the replica the request reads from, or None for the primary.
+        """
+        if (not settings.DATABASE_REPLICAS or request.method not in self.safe_methods
+                or not request.path.startswith(self.paths) or self.pin_cookie in request.COOKIES):
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def process_response(self, request, response, database):
+        if settings.DATABASE_REPLICAS and request.method not in self.safe_methods:
+            response.set_cookie(self.pin_cookie, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        if database is not None and response.streaming:
+            # a streamed body (an export) is read after the view returns
+            if response.is_async:
+                response.streaming_content = self.astream(response.streaming_content, database)
+            else:
+                response.streaming_content = self.stream(response.streaming_content, database)
+        return response
+
+    def stream(self, content, database):
+        token = _read_database.set(database)
+        try:
+            yield from content
+        finally:
+            _read_database.reset(token)
+
+    async def astream(self, content, database):
+        token = _read_database.set(database)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            _read_database.reset(token)
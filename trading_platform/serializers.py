@@ -1,28 +1,100 @@
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, bump_after_sql_write
+from trading_platform.models import DebtMovement, Product, NetworkNode, NetworkStats
 
-from trading_platform.models import Product, NetworkNode
 
+class SparseFieldsMixin:
+    """
+    Lets a serializer render a subset of its fields.
 
-class ProductSerializer(serializers.ModelSerializer):
+    'fields' lists the readable fields to keep, all of them if None. The write-only fields are always kept.
+    'expand' lists the relations to render as nested objects, with the serializers of expanded_fields,
+    instead of their default representation.
+    """
+
+    expanded_fields = {}
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            if name in self.expanded_fields:
+                self.fields[name] = self.expanded_fields[name]()
+        if fields is not None:
+            for name in [name for name, field in self.fields.items() if not field.write_only and name not in fields]:
+                self.fields.pop(name)
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Product Serializer
 
     This serializer is used to serialize and deserialize Product objects.
+    'node_count' and 'factory_count' are the numbers of nodes and factories that carry the product. They are
+    left out of the products nested in the nodes (nested_fields), which change with the links of other nodes.
     """
+
+    nested_fields = ('id', 'name', 'model', 'release_date', 'created_at')
+
     class Meta:
         model = Product
-        fields = ('id', 'name', 'model', 'release_date', 'created_at')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'name', 'model', 'release_date', 'created_at', 'node_count', 'factory_count')
+        read_only_fields = ('id', 'created_at', 'node_count', 'factory_count')
+
+    def validate(self, data):
+        """
+        This method rejects a product with the name and model of another product, compared case-insensitively
+        and without surrounding spaces, as the unique index compares them.
+        """
+        name = data.get('name', getattr(self.instance, 'name', None))
+        model = data.get('model', getattr(self.instance, 'model', None))
+        duplicates = Product.objects.find(name, model)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError('A product with this name and model already exists.')
+        return data
 
 
-class NetworkNodeSerializer(serializers.ModelSerializer):
+class ProductUpsertSerializer(ProductSerializer):
+    """
+    Serializer for the items of the bulk upsert endpoint of products.
+
+    The items are only validated field by field: the existing products are found by
+    ProductManager.upsert() for the whole request.
+    """
+
+    def validate(self, data):
+        return data
+
+
+class NetworkNodeSupplierSerializer(serializers.ModelSerializer):
+    """
+    Read-only serializer of the supplier of a node, for responses with 'expand=supplier'.
+    """
+
+    class Meta:
+        model = NetworkNode
+        fields = ('id', 'name', 'node_type', 'level', 'country', 'city')
+        read_only_fields = fields
+
+
+class NetworkNodeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     This class defines the Serializer for the NetworkNode model.
 
     The Serializer is used to serialize and deserialize NetworkNode objects.
+    With 'supplier' in 'expand' the supplier is rendered by NetworkNodeSupplierSerializer instead of its id.
     """
 
-    products = ProductSerializer(many=True, read_only=True)
+    expanded_fields = {'supplier': lambda: NetworkNodeSupplierSerializer(read_only=True)}
+
+    products = ProductSerializer(many=True, read_only=True, fields=ProductSerializer.nested_fields)
     """
     This field defines a many-to-many relationship between the NetworkNode model and the Product model.
     The field returns a list of products associated with the node, and it is read-only.
@@ -64,6 +136,7 @@ class NetworkNodeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'email',
+            'country',
             'city',
             'street',
             'house_number',
@@ -84,27 +157,33 @@ class NetworkNodeSerializer(serializers.ModelSerializer):
             'supplier_name'
         ]
 
-    def validate(self, data):
+    @staticmethod
+    def get_level(node_type, supplier):
         """
-        This method is used to validate the input data.
+        This method is used to compute the hierarchy level of a node.
 
-        The method checks the 'node_type' field and the 'supplier' field, and raises a ValidationError if the input data is invalid.
-        The method sets the 'level' field based on the 'node_type' and 'supplier' fields.
+        The method checks the 'node_type' and the 'supplier' of the node, and raises a ValidationError
+        if they break the hierarchy rules.
+        The 'supplier' is any object with a 'level' attribute, or None.
         """
-        node_type = data.get('node_type')
-        supplier = data.get('supplier')
-
         if node_type == 'Factory':
             if supplier is not None:
                 raise serializers.ValidationError("The factory cannot have a supplier")
-            data['level'] = 0
-        elif node_type!= 'Factory':
-            if supplier is None:
-                raise serializers.ValidationError("Non-factory nodes must have a supplier")
-            if supplier.level >= 2:
-                raise serializers.ValidationError("The hierarchy level cannot be more than 2")
-            data['level'] = supplier.level + 1
+            return 0
+        if supplier is None:
+            raise serializers.ValidationError("Non-factory nodes must have a supplier")
+        if supplier.level >= 2:
+            raise serializers.ValidationError("The hierarchy level cannot be more than 2")
+        return supplier.level + 1
 
+    def validate(self, data):
+        """
+        This method is used to validate the input data.
+
+        The method checks the 'node_type' field and the 'supplier' field, and raises a ValidationError if the input data is invalid.
+        The method sets the 'level' field based on the 'node_type' and 'supplier' fields.
+        """
+        data['level'] = self.get_level(data.get('node_type'), data.get('supplier'))
         return data
 
     def create(self, validated_data):
@@ -116,8 +195,7 @@ class NetworkNodeSerializer(serializers.ModelSerializer):
         """
         product_ids = validated_data.pop('products', [])
         network_node = NetworkNode.objects.create(**validated_data)
-        for product in product_ids:
-            network_node.products.add(product)
+        network_node.products.add(*product_ids)
         return network_node
 
     def update(self, instance, validated_data):
@@ -127,8 +205,573 @@ class NetworkNodeSerializer(serializers.ModelSerializer):
         The method populates the 'products' field based on the 'product_ids' field, and then updates the existing NetworkNode object using the validated data.
         The method sets the 'products' field to the specified products, and then returns the updated node.
         """
-        product_ids = validated_data.get('product_ids')
+        product_ids = validated_data.pop('products', None)
         validated_data.pop('debt', None)
         if product_ids is not None:
             instance.products.set(product_ids)
         return super().update(instance, validated_data)
+
+
+class NetworkNodeBulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer for bulk creation (POST) and partial update (PATCH) of NetworkNode objects.
+
+    The items are validated field by field first, then the nodes they reference (suppliers and, for updates,
+    the nodes themselves with their current suppliers) and their products are fetched in one query each,
+    and the hierarchy rules are checked in memory. For updates, a supplier updated by the same request counts with
+    the level the request gives it, whatever the order of the items.
+    The errors are returned per item, in the order of the input, and nothing is written if any item is invalid.
+    """
+
+    batch_size = 1000
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data or (self.max_length is not None and len(data) > self.max_length):
+            return super().to_internal_value(data)
+
+        items = []
+        errors = []
+        for item in data:
+            try:
+                items.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                items.append(None)
+                errors.append(exc.detail)
+
+        valid_items = [item for item in items if item is not None]
+        node_ids = {item['id'] for item in valid_items if 'id' in item}
+        supplier_ids = {item['supplier'] for item in valid_items if item.get('supplier') is not None}
+        product_ids = {pk for item in valid_items for pk in item.get('product_ids', ())}
+        self.nodes = NetworkNode.objects.select_related('supplier').in_bulk(node_ids | supplier_ids)
+        self.product_ids = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+
+        # the PATCH items by the id of their node, the first one of a duplicated node, and the errors of their
+        # hierarchy once checked
+        self.updates = {item['id']: item for item in reversed(valid_items) if self.partial and item.get('id') in self.nodes}
+        self.hierarchy_errors = {}
+
+        seen_ids = set()
+        for index, item in enumerate(items):
+            if item is not None:
+                errors[index] = self.validate_item(item, seen_ids)
+                seen_ids.add(item.get('id'))
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def validate_item(self, item, seen_ids):
+        """
+        Checks one item against the fetched nodes and products, sets its 'level' and returns its errors.
+        """
+        errors = self.check_id(item, seen_ids) or self.check_products(item)
+        if errors:
+            return errors
+        if self.partial:
+            return self.check_update_hierarchy(item['id'])
+        return self.check_hierarchy(item)
+
+    def check_id(self, item, seen_ids):
+        if not self.partial:
+            return {'id': ['This field is not allowed when creating nodes.']} if 'id' in item else {}
+        if 'id' not in item:
+            return {'id': ['This field is required.']}
+        if item['id'] in seen_ids:
+            return {'id': ['Duplicate node.']}
+        if item['id'] not in self.nodes:
+            return {'id': [f'Invalid pk "{item["id"]}" - object does not exist.']}
+        return {}
+
+    def check_products(self, item):
+        missing_products = [pk for pk in item.get('product_ids', ()) if pk not in self.product_ids]
+        if missing_products:
+            return {'product_ids': [f'Invalid pk "{pk}" - object does not exist.' for pk in missing_products]}
+        return {}
+
+    def get_supplier(self, item):
+        """
+        Returns the id of the supplier of the item and the supplier, the current one of the node if the item
+        does not change it.
+        """
+        if 'supplier' in item:
+            return item['supplier'], self.nodes.get(item['supplier'])
+        instance = self.nodes[item['id']] if 'id' in item else None
+        return getattr(instance, 'supplier_id', None), getattr(instance, 'supplier', None)
+
+    def check_update_hierarchy(self, node_id):
+        """
+        Checks the hierarchy of the PATCH item of the node and returns its errors, after the items of its
+        suppliers updated by the same request, so that its level follows from the levels the request gives them
+        whatever the order of the items. The chain of these suppliers is walked up first, then checked downwards.
+        """
+        start = node_id
+        chain = []
+        while node_id in self.updates and node_id not in self.hierarchy_errors and node_id not in chain:
+            chain.append(node_id)
+            node_id = self.get_supplier(self.updates[node_id])[0]
+        if node_id in chain and node_id != chain[-1]:
+            # the suppliers loop back, a node that is its own supplier is reported by check_hierarchy()
+            loop = chain.index(node_id)
+            for pk in chain[loop:]:
+                self.hierarchy_errors[pk] = {'supplier': ['The suppliers of these nodes make a cycle.']}
+            chain = chain[:loop]
+        for pk in reversed(chain):
+            self.hierarchy_errors[pk] = self.check_hierarchy(self.updates[pk])
+        return self.hierarchy_errors[start]
+
+    def check_hierarchy(self, item):
+        """
+        Checks the supplier and the node type of the item, sets its 'level' and returns its errors.
+        A supplier updated by the same request counts with the level the request gives it.
+        """
+        supplier_id, supplier = self.get_supplier(item)
+        if supplier_id is not None:
+            if supplier is None:
+                return {'supplier': [f'Invalid pk "{supplier_id}" - object does not exist.']}
+            if supplier_id == item.get('id'):
+                return {'supplier': ['A node cannot be its own supplier.']}
+            if supplier_id in self.hierarchy_errors:
+                if self.hierarchy_errors[supplier_id]:
+                    return {'supplier': [f'The supplier "{supplier_id}" is not valid in this request.']}
+                supplier = NetworkNode(level=self.updates[supplier_id]['level'])
+
+        instance = self.nodes.get(item.get('id'))
+        node_type = item['node_type'] if 'node_type' in item else getattr(instance, 'node_type', None)
+        try:
+            item['level'] = NetworkNodeSerializer.get_level(node_type, supplier)
+        except serializers.ValidationError as exc:
+            return {api_settings.NON_FIELD_ERRORS_KEY: exc.detail}
+        return {}
+
+    def save(self, **kwargs):
+        """
+        Creates the nodes for POST and updates them for PATCH, in one transaction.
+        """
+        with transaction.atomic():
+            if self.partial:
+                self.instance = self.update(self.nodes, self.validated_data)
+            else:
+                self.instance = self.create(self.validated_data)
+            names = [NODES, SUBTREES]
+            if any('product_ids' in item or 'node_type' in item for item in self.validated_data):
+                # the links and the node types are counted by the products
+                names.append(PRODUCTS)
+            bump_after_sql_write(*names)
+        return self.instance
+
+    def create(self, validated_data):
+        nodes = [
+            NetworkNode(supplier_id=item.get('supplier'),
+                        **{name: value for name, value in item.items() if name not in ('supplier', 'product_ids')})
+            for item in validated_data
+        ]
+        NetworkNode.objects.bulk_create(nodes, batch_size=self.batch_size)
+        self.set_products(nodes, validated_data)
+        return nodes
+
+    def update(self, instance, validated_data):
+        """
+        Updates the nodes with one bulk UPDATE. 'instance' maps the ids of the nodes to the nodes.
+        As with the single node API, 'debt' cannot be updated.
+        """
+        nodes = []
+        fields = set()
+        for item in validated_data:
+            node = instance[item['id']]
+            for name, value in item.items():
+                if name in ('id', 'product_ids', 'debt'):
+                    continue
+                setattr(node, 'supplier_id' if name == 'supplier' else name, value)
+                fields.add(name)
+            nodes.append(node)
+        if fields:
+            NetworkNode.objects.bulk_update(nodes, fields, batch_size=self.batch_size)
+        self.set_products(nodes, validated_data)
+        return nodes
+
+    def set_products(self, nodes, validated_data):
+        """
+        Makes the products of the nodes match the 'product_ids' of the items, for the items that have them.
+        The through table is diffed against the wanted links, so only the changed rows are deleted and inserted.
+        """
+        through = NetworkNode.products.through
+        node_ids = [node.pk for node, item in zip(nodes, validated_data) if 'product_ids' in item]
+        if not node_ids:
+            return
+        wanted = {
+            (node.pk, product_id)
+            for node, item in zip(nodes, validated_data)
+            for product_id in item.get('product_ids', ())
+        }
+        existing = {}
+        if self.partial:
+            existing = {
+                (node_id, product_id): pk
+                for pk, node_id, product_id in through.objects.filter(networknode_id__in=node_ids).values_list(
+                    'pk', 'networknode_id', 'product_id')
+            }
+        stale = [pk for link, pk in existing.items() if link not in wanted]
+        if stale:
+            through.objects.filter(pk__in=stale).delete()
+        through.objects.bulk_create(
+            [through(networknode_id=node_id, product_id=product_id) for node_id, product_id in wanted - existing.keys()],
+            batch_size=self.batch_size
+        )
+
+
+class NetworkNodeBulkSerializer(NetworkNodeSerializer):
+    """
+    Serializer for the items of the bulk NetworkNode endpoint.
+
+    The relations are plain ids, resolved for the whole request by NetworkNodeBulkListSerializer,
+    which also runs the hierarchy checks of NetworkNodeSerializer.validate().
+    """
+
+    id = serializers.IntegerField(required=False)
+    supplier = serializers.IntegerField(allow_null=True, required=False)
+    product_ids = serializers.ListField(child=serializers.IntegerField(), required=False, write_only=True)
+
+    class Meta(NetworkNodeSerializer.Meta):
+        list_serializer_class = NetworkNodeBulkListSerializer
+
+    def validate(self, data):
+        return data
+
+
+class NetworkNodeMoveSerializer(serializers.Serializer):
+    """
+    Serializer that moves a node with its whole downstream subtree under a new supplier.
+
+    The subtree is locked while it is validated, and the levels of all its nodes are recomputed with one
+    recursive UPDATE (see NetworkNodeManager.lock_subtree() and move_subtree()). It must be used in a transaction.
+    """
+
+    id = serializers.IntegerField(read_only=True)
+    supplier = serializers.PrimaryKeyRelatedField(queryset=NetworkNode.objects.all(), allow_null=True)
+    level = serializers.IntegerField(read_only=True)
+    subtree_size = serializers.IntegerField(read_only=True)
+
+    def validate(self, data):
+        """
+        This method is used to validate the move.
+
+        The method locks the subtree and the new supplier, and raises a ValidationError if the new supplier is in
+        the subtree, or if the node type or the depth of the subtree break the hierarchy rules at the new place.
+        """
+        node = self.instance
+        depths = NetworkNode.objects.lock_subtree(node.pk)
+        supplier = data['supplier']
+        if supplier is not None:
+            if supplier.pk in depths:
+                raise serializers.ValidationError('A node cannot be moved under itself or its downstream nodes')
+            supplier = NetworkNode.objects.select_for_update().only('level').get(pk=supplier.pk)
+        level = NetworkNodeSerializer.get_level(node.node_type, supplier)
+        if level + max(depths.values()) > 2:
+            raise serializers.ValidationError(
+                f'The hierarchy level cannot be more than 2: the moved subtree is {max(depths.values())} levels deep'
+            )
+        data['level'] = level
+        data['subtree_size'] = len(depths)
+        return data
+
+    def save(self, **kwargs):
+        """
+        This method is used to move the node and to recompute the levels of its subtree.
+        """
+        node = self.instance
+        supplier = self.validated_data['supplier']
+        NetworkNode.objects.move_subtree(node.pk, supplier.pk if supplier else None, self.validated_data['level'])
+        bump_after_sql_write(NODES, SUBTREES)
+        node.supplier = supplier
+        node.level = self.validated_data['level']
+        node.subtree_size = self.validated_data['subtree_size']
+        return node
+
+
+class NetworkNodeRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer for the NetworkNode rows returned by the hierarchy queries of NetworkNodeManager.
+
+    The rows are plain dicts, so the values are rendered with the same field classes NetworkNodeSerializer uses,
+    and nested into a tree through the 'supplier' and 'depth' keys of each row.
+    """
+
+    converters = {
+        'debt': serializers.DecimalField(max_digits=10, decimal_places=2).to_representation,
+        'created_at': serializers.DateTimeField().to_representation,
+    }
+
+    def __init__(self, *args, fields=NetworkNode.objects.TREE_FIELDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = fields
+
+    def to_representation(self, row):
+        data = {}
+        for name in self.selected_fields:
+            value = row[name]
+            converter = self.converters.get(name)
+            data[name] = converter(value) if converter is not None and value is not None else value
+        return data
+
+    def tree_representation(self, rows):
+        """
+        Nests subtree rows (ordered by depth) under their suppliers and returns the root node.
+        """
+        nodes = {}
+        for row in rows:
+            node = self.to_representation(row)
+            node['children'] = []
+            nodes[row['id']] = node
+            if row['depth']:
+                nodes[row['supplier']]['children'].append(node)
+        return nodes[rows[0]['id']]
+
+    def chain_representation(self, rows):
+        """
+        Nests ancestor rows (ordered from the factory down) into a single chain and returns its top node.
+        """
+        top = parent = None
+        for row in rows:
+            node = self.to_representation(row)
+            node['children'] = []
+            if parent is None:
+                top = node
+            else:
+                parent['children'].append(node)
+            parent = node
+        return top
+
+
+class NetworkNodeValuesSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer that renders NetworkNode rows exactly like NetworkNodeSerializer, without model instances.
+
+    The nodes are read as dicts with get_values(), and their products with one query per chunk_size nodes,
+    grouped by node. Every field is rendered by a converter taken once from the field of the same name of
+    NetworkNodeSerializer or ProductSerializer, or copied as it is when that field renders the database value
+    unchanged (strings, integers and primary keys).
+
+    'fields' and 'expand' select the fields as for NetworkNodeSerializer. get_values() reads only the columns
+    of the selected fields, and the products are only read when 'products' is one of them.
+    """
+
+    sources = {'supplier': 'supplier_id', 'supplier_name': 'supplier__name'}
+    converted_fields = (serializers.DecimalField, serializers.DateTimeField, serializers.DateField)
+
+    def __init__(self, *args, chunk_size=2000, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunk_size = chunk_size
+        self.node_fields = self.compile(NetworkNodeSerializer(fields=fields, expand=expand))
+        self.product_fields = self.compile(ProductSerializer(fields=ProductSerializer.nested_fields))
+        self.supplier_fields = None
+        if 'supplier' in expand:
+            self.supplier_fields = self.compile(NetworkNodeSupplierSerializer(), prefix='supplier__')
+        self.with_products = any(name == 'products' for name, source, converter in self.node_fields)
+
+    def get_values(self, queryset):
+        """
+        Returns the queryset as dicts with the columns needed to render the nodes,
+        and the columns of the keyset pagination.
+        """
+        columns = ['id', 'created_at']
+        for name, source, converter in self.node_fields:
+            if name == 'supplier' and self.supplier_fields is not None:
+                columns += ['supplier_id', *(source for name, source, converter in self.supplier_fields)]
+            elif name != 'products':
+                columns.append(source)
+        return queryset.values(*dict.fromkeys(columns))
+
+    def compile(self, serializer, prefix=''):
+        """
+        Returns (name, source, converter) for the readable fields of the serializer, in their output order.
+        The sources of a related serializer are prefixed with the lookup of the relation.
+        """
+        return [
+            (name, prefix + name if prefix else self.sources.get(name, name),
+             field.to_representation if isinstance(field, self.converted_fields) else None)
+            for name, field in serializer.fields.items() if not field.write_only
+        ]
+
+    def get_product_links(self, node_ids):
+        """
+        Returns the (node id, *product columns) rows of the products of the nodes, ordered by product id.
+        """
+        links = NetworkNode.products.through.objects.filter(networknode_id__in=node_ids).order_by('product_id')
+        return links.values_list('networknode_id', *(f'product__{name}' for name, source, converter in self.product_fields))
+
+    def group_products(self, links):
+        """
+        Returns the rendered products of get_product_links() rows, grouped by node id.
+        """
+        products = defaultdict(list)
+        for node_id, *values in links:
+            products[node_id].append({
+                name: converter(value) if converter is not None and value is not None else value
+                for (name, source, converter), value in zip(self.product_fields, values)
+            })
+        return products
+
+    def get_products(self, node_ids):
+        """
+        Returns the rendered products of the nodes, grouped by node id and ordered by product id,
+        or nothing if the products are not rendered.
+        """
+        if not self.with_products:
+            return {}
+        return self.group_products(self.get_product_links(node_ids))
+
+    async def aget_products(self, node_ids):
+        """
+        Async version of get_products().
+        """
+        if not self.with_products:
+            return {}
+        return self.group_products([link async for link in self.get_product_links(node_ids)])
+
+    @staticmethod
+    def render_values(row, fields):
+        return {
+            name: converter(row[source]) if converter is not None and row[source] is not None else row[source]
+            for name, source, converter in fields
+        }
+
+    def render_chunk(self, chunk, products):
+        """
+        Yields the rendered nodes of a chunk of get_values() rows, given the products of get_products().
+        """
+        for row in chunk:
+            data = {}
+            for name, source, converter in self.node_fields:
+                if name == 'products':
+                    data[name] = products[row['id']]
+                    continue
+                if name == 'supplier' and self.supplier_fields is not None:
+                    data[name] = self.render_values(row, self.supplier_fields) if row['supplier_id'] is not None else None
+                    continue
+                value = row[source]
+                if value is None and name == 'supplier_name':
+                    # NetworkNodeSerializer skips 'supplier_name' for nodes without a supplier
+                    continue
+                data[name] = converter(value) if converter is not None and value is not None else value
+            yield data
+
+    def iter_representation(self, rows):
+        """
+        Yields the rendered nodes of an iterable of get_values() rows, reading the products chunk by chunk.
+        """
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield from self.render_chunk(chunk, self.get_products([row['id'] for row in chunk]))
+
+    async def aiter_representation(self, rows):
+        """
+        Async version of iter_representation(), for an async iterable of rows such as QuerySet.aiterator().
+        """
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                for data in self.render_chunk(chunk, await self.aget_products([row['id'] for row in chunk])):
+                    yield data
+                chunk = []
+        if chunk:
+            for data in self.render_chunk(chunk, await self.aget_products([row['id'] for row in chunk])):
+                yield data
+
+    def to_representation(self, rows):
+        return list(self.iter_representation(rows))
+
+    async def ato_representation(self, rows):
+        """
+        Async version of to_representation(), for a list of rows.
+        """
+        data = []
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            data.extend(self.render_chunk(chunk, await self.aget_products([row['id'] for row in chunk])))
+        return data
+
+
+class DebtMovementListSerializer(serializers.ListSerializer):
+    """
+    List serializer of the debt movements posted in one request.
+
+    The items are validated field by field first, then their nodes are fetched in one query.
+    The errors are returned per item, in the order of the input.
+    """
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        node_ids = set(NetworkNode.objects.filter(pk__in={item['node_id'] for item in items}).values_list('pk', flat=True))
+        errors = [
+            {} if item['node_id'] in node_ids else {'node': [f'Invalid pk "{item["node_id"]}" - object does not exist.']}
+            for item in items
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+
+class DebtMovementSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the movements of the debt ledger.
+
+    A shipment increases the debt and has a positive amount, a payment decreases it and has a negative one,
+    an adjustment may have either. The opening movements are only written by the database.
+    """
+
+    node = serializers.IntegerField(source='node_id')
+    kind = serializers.ChoiceField(
+        choices=[(kind, label) for kind, label in DebtMovement.KIND_CHOICES if kind != DebtMovement.OPENING]
+    )
+
+    class Meta:
+        model = DebtMovement
+        fields = ('id', 'node', 'kind', 'amount', 'created_at')
+        read_only_fields = ('id', 'created_at')
+        list_serializer_class = DebtMovementListSerializer
+
+    def validate(self, data):
+        """
+        This method checks the sign of the amount against the kind of the movement.
+        """
+        if data['amount'] == 0:
+            raise serializers.ValidationError({'amount': 'The amount cannot be zero.'})
+        if data['kind'] == DebtMovement.SHIPMENT and data['amount'] < 0:
+            raise serializers.ValidationError({'amount': 'A shipment must have a positive amount.'})
+        if data['kind'] == DebtMovement.PAYMENT and data['amount'] > 0:
+            raise serializers.ValidationError({'amount': 'A payment must have a negative amount.'})
+        return data
+
+
+class DebtAsOfSerializer(serializers.Serializer):
+    """
+    Serializer for the query parameters of the debt of a node as of a time, the current debt without 'at'.
+    """
+
+    at = serializers.DateTimeField(required=False)
+
+
+class NetworkStatsSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the NetworkStats rows aggregated over the requested dimensions.
+
+    Only the dimensions passed in 'group_by' are returned, next to the node count and the total
+    and average debt of each group.
+    """
+
+    DIMENSIONS = ('city', 'node_type', 'level', 'month')
+
+    node_count = serializers.IntegerField()
+    total_debt = serializers.DecimalField(max_digits=20, decimal_places=2)
+    average_debt = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        model = NetworkStats
+        fields = ('city', 'node_type', 'level', 'month', 'node_count', 'total_debt', 'average_debt')
+
+    def __init__(self, *args, group_by=DIMENSIONS, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.DIMENSIONS:
+            if name not in group_by:
+                self.fields.pop(name)
@@ -0,0 +1,62 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from trading_platform.cache import NODES, PRODUCTS, SUBTREES, bump_versions, subtree
+from trading_platform.models import NetworkNode, Product
+
+
+@receiver(pre_save, sender=NetworkNode)
+def remember_node_position(sender, instance, raw, using, **kwargs):
+    """
+    Stores the name, the supplier and the type of the node before the update, to tell which cached subtrees
+    it changes and whether it changes the factory counts of its products.
+    """
+    instance._saved_position = None
+    if instance.pk and not raw:
+        instance._saved_position = sender._base_manager.using(using).filter(pk=instance.pk).values_list(
+            'name', 'supplier_id', 'node_type').first()
+
+
+@receiver(post_save, sender=NetworkNode)
+def invalidate_node(sender, instance, using, **kwargs):
+    """
+    Invalidates the node lists and the subtrees that contain the node.
+
+    A new supplier moves the whole subtree of the node, and a new name is shown by its children
+    ('supplier_name'), so in these cases all subtrees are invalidated. A new type changes the factory counts
+    of the products of the node.
+    """
+    position = getattr(instance, '_saved_position', None)
+    if position is not None and position[2] != instance.node_type:
+        bump_versions(PRODUCTS, using=using)
+    if position is not None and position[:2] != (instance.name, instance.supplier_id):
+        bump_versions(NODES, SUBTREES, using=using)
+    else:
+        chain = sender.objects.db_manager(using).ancestor_rows(instance.pk, fields=('id',))
+        bump_versions(NODES, *(subtree(row['id']) for row in chain), using=using)
+
+
+@receiver(post_delete, sender=NetworkNode)
+def invalidate_deleted_node(sender, using, **kwargs):
+    # the links of the node are deleted with it, which changes the counts of its products
+    bump_versions(NODES, SUBTREES, PRODUCTS, using=using)
+
+
+@receiver(m2m_changed, sender=NetworkNode.products.through)
+def invalidate_node_products(sender, instance, action, reverse, using, **kwargs):
+    """
+    Invalidates the nodes whose products were added, removed or cleared, and the products, whose counts
+    of nodes changed.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bump_versions(NODES, SUBTREES, PRODUCTS, using=using)
+    else:
+        bump_versions(NODES, subtree(instance.pk), PRODUCTS, using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, using, **kwargs):
+    bump_versions(PRODUCTS, using=using)
@@ -1,8 +1,32 @@
-from django.test import TestCase, Client
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Prefetch
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 
-from trading_platform.models import Product
+from trading_platform.admin import EstimatedCountPaginator
+from trading_platform.filters import NetworkNodeFilterBackend
+from trading_platform.jobs import ClearDebtJob, Worker, enqueue
+from trading_platform.metrics import Registry
+from trading_platform.models import DebtMovement, DebtSnapshot, Job, NetworkNode, Product
+from trading_platform.replicas import ReplicaMiddleware, ReplicaRouter, get_read_database
+from trading_platform.serializers import NetworkNodeSerializer, NetworkNodeValuesSerializer
 from user.models import User
+from user.tokens import user_cache
 
 
 class NetworkNodeTestCase(TestCase):
@@ -44,6 +68,7 @@ class NetworkNodeTestCase(TestCase):
             "id": response.json()["id"],
             "name": "Транзисторный завод",
             "email": "email1@example.com",
+            "country": "",
             "city": "Город первого звена",
             "street": "Улица первого звена",
             "house_number": "1",
@@ -99,6 +124,7 @@ class NetworkNodeTestCase(TestCase):
             "id": put_response.json()["id"],
             "name": "NewТранзисторный завод",
             "email": "Newemail1@example.com",
+            "country": "",
             "city": "NewГород первого звена",
             "street": "NewУлица первого звена",
             "house_number": "1",
@@ -164,6 +190,7 @@ class NetworkNodeTestCase(TestCase):
             "id": post_response.json()["id"],
             "name": "Транзисторный завод",
             "email": "email1@example.com",
+            "country": "",
             "city": "Город первого звена",
             "street": "Улица первого звена",
             "house_number": "1",
@@ -219,3 +246,2006 @@ class NetworkNodeTestCase(TestCase):
         )
 
         self.assertEqual(len(get_response.json()), 2)
+
+
+class QueryBudgetMixin:
+    """
+    Assertions that fail when the number of queries an endpoint runs grows with the size of its result.
+    """
+
+    def assertQueryBudget(self, url, grow, budget):
+        """
+        Requests 'url', calls 'grow' to add rows to its result and requests it again.
+
+        Both requests must succeed and run the same number of queries, and that number must not exceed 'budget'
+        (authentication queries included). The response cache is cleared before each request, so the
+        queries of the view itself are counted.
+        """
+        cache.clear()
+        with CaptureQueriesContext(connection) as before:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        grow()
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        queries = '\n'.join(query['sql'] for query in after.captured_queries)
+        self.assertEqual(
+            len(after), len(before),
+            f'{url} ran {len(before)} queries, then {len(after)} after its result grew:\n{queries}'
+        )
+        self.assertLessEqual(len(after), budget, f'{url} ran {len(after)} queries, budget is {budget}:\n{queries}')
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        self.products = [
+            Product.objects.create(name=f'product_{i}', model=f'model_{i}', release_date='2023-09-10')
+            for i in range(3)
+        ]
+        self.factory = self.create_node(None)
+
+    def create_node(self, supplier):
+        node = NetworkNode.objects.create(
+            name='Звено',
+            email='email1@example.com',
+            city='Город',
+            street='Улица',
+            house_number='1',
+            node_type='Factory' if supplier is None else 'RetailNetwork',
+            level=0 if supplier is None else supplier.level + 1,
+            supplier=supplier
+        )
+        node.products.set(self.products)
+        return node
+
+    def create_products(self, count):
+        start = Product.objects.count()
+        Product.objects.bulk_create([
+            Product(name='product', model=f'model {start + i}', release_date='2023-09-10') for i in range(count)
+        ])
+
+    def test_list_network_node_query_budget(self):
+        self.create_node(self.factory)
+
+        self.assertQueryBudget(
+            '/platform/network-node/',
+            lambda: [self.create_node(self.factory) for _ in range(10)],
+            budget=4
+        )
+
+    def test_retrieve_network_node_query_budget(self):
+        node = self.create_node(self.factory)
+
+        self.assertQueryBudget(
+            f'/platform/network-node/{node.pk}/',
+            lambda: self.create_products(10) or node.products.set(Product.objects.all()),
+            budget=4
+        )
+
+    def test_list_product_query_budget(self):
+        self.assertQueryBudget('/platform/products/', lambda: self.create_products(10), budget=3)
+
+
+class NetworkNodeTreeTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, **address)
+        self.traders = [
+            NetworkNode.objects.create(name=f'ИП {i}', node_type='IndividualEntrepreneur', level=2,
+                                       supplier=self.retail, **address)
+            for i in range(3)
+        ]
+
+    def test_tree_network_node(self):
+        response = self.client.get(f'/platform/network-node/{self.factory.pk}/tree/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        tree = response.json()
+        self.assertEqual(tree['id'], self.factory.pk)
+        self.assertEqual(tree['debt'], '0.00')
+        self.assertEqual([node['id'] for node in tree['children']], [self.retail.pk])
+        self.assertEqual(
+            [node['id'] for node in tree['children'][0]['children']],
+            [trader.pk for trader in self.traders]
+        )
+
+    def test_tree_network_node_depth_and_fields(self):
+        response = self.client.get(f'/platform/network-node/{self.factory.pk}/tree/?depth=1&fields=name,level')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertJSONEqual(response.content, {
+            'id': self.factory.pk,
+            'supplier': None,
+            'name': 'Завод',
+            'level': 0,
+            'children': [
+                {'id': self.retail.pk, 'supplier': self.factory.pk, 'name': 'Сеть', 'level': 1, 'children': []}
+            ]
+        })
+
+    def test_tree_network_node_invalid_params(self):
+        url = f'/platform/network-node/{self.factory.pk}/tree/'
+
+        self.assertEqual(self.client.get(url, {'depth': '-1'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/platform/network-node/0/tree/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tree_network_node_query_count(self):
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+
+        self.assertQueryBudget(
+            f'/platform/network-node/{self.factory.pk}/tree/',
+            lambda: NetworkNode.objects.bulk_create([
+                NetworkNode(name=f'ИП {i}', node_type='IndividualEntrepreneur', level=2, supplier=self.retail,
+                            **address)
+                for i in range(20)
+            ]),
+            budget=3
+        )
+
+    def test_ancestors_network_node(self):
+        trader = self.traders[0]
+        response = self.client.get(f'/platform/network-node/{trader.pk}/ancestors/?fields=name')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertJSONEqual(response.content, {
+            'id': self.factory.pk,
+            'supplier': None,
+            'name': 'Завод',
+            'children': [{
+                'id': self.retail.pk,
+                'supplier': self.factory.pk,
+                'name': 'Сеть',
+                'children': [{'id': trader.pk, 'supplier': self.retail.pk, 'name': 'ИП 0', 'children': []}]
+            }]
+        })
+
+
+class PaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        Product.objects.bulk_create([
+            Product(name=f'product_{i}', model=f'model_{i}', release_date='2023-09-10') for i in range(7)
+        ])
+        self.product_ids = list(Product.objects.order_by('created_at', 'id').values_list('id', flat=True))
+
+    def test_list_without_pagination(self):
+        response = self.client.get('/platform/products/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 7)
+
+    def test_cursor_pagination(self):
+        ids = []
+        url = '/platform/products/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            ids += [product['id'] for product in page['results']]
+            url = page['next']
+
+        self.assertEqual(ids, self.product_ids)
+        self.assertEqual(len(page['results']), 1)
+
+        response = self.client.get(page['previous'])
+        self.assertEqual([product['id'] for product in response.json()['results']], self.product_ids[3:6])
+
+        response = self.client.get(response.json()['previous'])
+        self.assertEqual([product['id'] for product in response.json()['results']], self.product_ids[:3])
+        self.assertIsNone(response.json()['previous'])
+
+    def test_cursor_pagination_invalid_cursor(self):
+        response = self.client.get('/platform/products/?cursor=invalid')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_limit_offset_pagination(self):
+        response = self.client.get('/platform/products/?limit=2&offset=4')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 7)
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class ProductUpsertTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+
+    def test_bulk_upsert(self):
+        items = [
+            {'name': ' телефон', 'model': 'p-1 ', 'release_date': '2024-01-01'},
+            {'name': 'Телевизор', 'model': 'T-1', 'release_date': '2021-01-31'},
+            {'name': 'ТЕЛЕВИЗОР', 'model': 't-1', 'release_date': '2021-01-31'},
+        ]
+        response = self.client.post('/platform/products/bulk-upsert/', items, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tv = Product.objects.get(name='Телевизор')
+        self.assertEqual(response.json(), [
+            {'id': self.product.pk, 'created': False},
+            {'id': tv.pk, 'created': True},
+            {'id': tv.pk, 'created': False},
+        ])
+        self.product.refresh_from_db()
+        self.assertEqual(str(self.product.release_date), '2023-09-10')
+
+        response = self.client.post('/platform/products/bulk-upsert/', items[1:], content_type='application/json')
+        self.assertEqual(response.json(), [{'id': tv.pk, 'created': False}] * 2)
+        self.assertEqual(Product.objects.count(), 2)
+
+        response = self.client.post('/platform/products/bulk-upsert/', [{'name': 'Планшет'}], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_duplicate_product(self):
+        response = self.client.post('/platform/products/', {'name': 'ТЕЛЕФОН ', 'model': 'p-1', 'release_date': '2024-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        other = Product.objects.create(name='Телефон', model='P-2', release_date='2023-09-10')
+        response = self.client.patch(f'/platform/products/{other.pk}/', {'model': 'P-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f'/platform/products/{self.product.pk}/', {'model': 'p-1'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_dedupe_products(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX product_name_model_uniq')
+        duplicate = Product.objects.create(name='ТЕЛЕФОН', model='p-1', release_date='2023-09-10')
+        other = Product.objects.create(name='телефон ', model='P-1', release_date='2023-09-10')
+        tv = Product.objects.create(name='Телевизор', model='T-1', release_date='2021-01-31')
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        factory.products.add(self.product, duplicate, tv)
+        retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1, supplier=factory, **address)
+        retail.products.add(other)
+
+        out = io.StringIO()
+        call_command('dedupe_products', '--dry-run', stdout=out)
+        self.assertIn('2 duplicates of 1 products found', out.getvalue())
+        self.assertEqual(Product.objects.count(), 4)
+
+        call_command('dedupe_products', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(set(Product.objects.values_list('pk', flat=True)), {self.product.pk, tv.pk})
+        self.assertEqual(set(factory.products.values_list('pk', flat=True)), {self.product.pk, tv.pk})
+        self.assertEqual(set(retail.products.values_list('pk', flat=True)), {self.product.pk})
+
+
+class ProductNodesTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+        self.other = Product.objects.create(name='Телевизор', model='T-1', release_date='2021-01-31')
+        address = {'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', email='email1@example.com', city='Москва',
+                                                  node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', email='email2@example.com', city='Казань',
+                                                 node_type='RetailNetwork', level=1, supplier=self.factory, **address)
+        self.factory.products.add(self.product, self.other)
+        self.retail.products.add(self.product)
+
+    def assertCounts(self, product, node_count, factory_count):
+        product.refresh_from_db()
+        self.assertEqual((product.node_count, product.factory_count), (node_count, factory_count))
+
+    def test_counts(self):
+        self.assertCounts(self.product, 2, 1)
+        self.assertCounts(self.other, 1, 1)
+
+        self.retail.products.remove(self.product)
+        self.other.network_nodes.add(self.retail)
+        self.assertCounts(self.product, 1, 1)
+        self.assertCounts(self.other, 2, 1)
+
+        self.retail.node_type = 'Factory'
+        self.retail.supplier = None
+        self.retail.save()
+        self.assertCounts(self.other, 2, 2)
+
+        response = self.client.patch('/platform/network-node/bulk/', [
+            {'id': self.retail.pk, 'product_ids': [self.product.pk]},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCounts(self.product, 2, 2)
+        self.assertCounts(self.other, 1, 1)
+
+        # the counts are not overwritten by a product read before the links changed
+        stale = Product.objects.get(pk=self.product.pk)
+        self.factory.delete()
+        stale.save()
+        self.assertCounts(self.product, 1, 1)
+
+    def test_counts_in_responses(self):
+        response = self.client.get(f'/platform/products/{self.product.pk}/')
+        self.assertEqual((response.json()['node_count'], response.json()['factory_count']), (2, 1))
+
+        self.retail.products.clear()
+        response = self.client.get(f'/platform/products/{self.product.pk}/')
+        self.assertEqual((response.json()['node_count'], response.json()['factory_count']), (1, 1))
+
+        response = self.client.get(f'/platform/network-node/{self.factory.pk}/')
+        self.assertNotIn('node_count', response.json()['products'][0])
+
+    def test_nodes(self):
+        response = self.client.get(f'/platform/products/{self.product.pk}/nodes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([node['id'] for node in response.json()], [self.factory.pk, self.retail.pk])
+        self.assertNotIn('products', response.json()[0])
+
+        response = self.client.get(f'/platform/products/{self.product.pk}/nodes/', {'city': 'Казань'})
+        self.assertEqual([node['name'] for node in response.json()], ['Сеть'])
+
+        response = self.client.get(f'/platform/products/{self.other.pk}/nodes/', {'city': 'Казань'})
+        self.assertEqual(response.json(), [])
+        self.retail.products.add(self.other)
+        response = self.client.get(f'/platform/products/{self.other.pk}/nodes/', {'city': 'Казань'})
+        self.assertEqual([node['name'] for node in response.json()], ['Сеть'])
+
+        response = self.client.get(f'/platform/products/{self.product.pk}/nodes/', {'page_size': 1})
+        self.assertEqual([node['id'] for node in response.json()['results']], [self.factory.pk])
+
+        response = self.client.get('/platform/products/0/nodes/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class NetworkNodeBulkTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        self.products = [
+            Product.objects.create(name=f'product_{i}', model=f'model_{i}', release_date='2023-09-10')
+            for i in range(3)
+        ]
+        self.factory = NetworkNode.objects.create(
+            name='Завод', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='Factory', level=0
+        )
+
+    def node_data(self, name, **kwargs):
+        return {
+            "name": name,
+            "email": "email1@example.com",
+            "city": "Город",
+            "street": "Улица",
+            "house_number": "1",
+            "node_type": "RetailNetwork",
+            "supplier": self.factory.pk,
+            "product_ids": [self.products[0].pk],
+            **kwargs
+        }
+
+    def test_bulk_create_network_node(self):
+        data = [self.node_data(f'Сеть {i}') for i in range(3)] + [self.node_data('Завод 2', node_type='Factory',
+                                                                                 supplier=None, product_ids=[])]
+
+        response = self.client.post('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([node['name'] for node in response.json()], ['Сеть 0', 'Сеть 1', 'Сеть 2', 'Завод 2'])
+        self.assertEqual([node['level'] for node in response.json()], [1, 1, 1, 0])
+        self.assertEqual(response.json()[0]['supplier_name'], 'Завод')
+        self.assertEqual([product['id'] for product in response.json()[0]['products']], [self.products[0].pk])
+        self.assertEqual(NetworkNode.objects.count(), 5)
+
+    def test_bulk_create_network_node_errors(self):
+        trader = NetworkNode.objects.create(
+            name='ИП', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='IndividualEntrepreneur', level=2, supplier=self.factory
+        )
+        data = [
+            self.node_data('Сеть'),
+            self.node_data('Без поставщика', supplier=0),
+            self.node_data('Четвертый уровень', supplier=trader.pk),
+            self.node_data('Без продукта', product_ids=[0]),
+            self.node_data('Без email', email='email'),
+        ]
+
+        response = self.client.post('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['supplier'])
+        self.assertEqual(errors[2], {'non_field_errors': ['The hierarchy level cannot be more than 2']})
+        self.assertEqual(list(errors[3]), ['product_ids'])
+        self.assertEqual(list(errors[4]), ['email'])
+        self.assertEqual(NetworkNode.objects.count(), 2)
+
+    def test_bulk_create_network_node_query_count(self):
+        def bulk_create_queries(count):
+            data = [self.node_data(f'Сеть {i}', product_ids=[product.pk for product in self.products])
+                    for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/platform/network-node/bulk/', data=data, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(bulk_create_queries(2), bulk_create_queries(50))
+
+    def test_bulk_update_network_node(self):
+        nodes = [
+            NetworkNode.objects.create(
+                name=f'Сеть {i}', email='email1@example.com', city='Город', street='Улица', house_number='1',
+                node_type='RetailNetwork', level=1, supplier=self.factory
+            )
+            for i in range(2)
+        ]
+        nodes[0].products.set(self.products[:2])
+        data = [
+            {'id': nodes[0].pk, 'name': 'Новая сеть', 'product_ids': [self.products[1].pk, self.products[2].pk]},
+            {'id': nodes[1].pk, 'node_type': 'Factory', 'supplier': None, 'debt': 10},
+        ]
+
+        response = self.client.patch('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content.decode())
+        first, second = response.json()
+        self.assertEqual(first['name'], 'Новая сеть')
+        self.assertEqual([product['id'] for product in first['products']], [self.products[1].pk, self.products[2].pk])
+        self.assertEqual((second['node_type'], second['supplier'], second['level']), ('Factory', None, 0))
+        self.assertEqual(second['debt'], '0.00')
+
+    def test_bulk_update_network_node_batch_levels(self):
+        trader = NetworkNode.objects.create(
+            name='ИП', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='IndividualEntrepreneur', level=2, supplier=self.factory
+        )
+        retail = NetworkNode.objects.create(
+            name='Сеть', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='RetailNetwork', level=1, supplier=self.factory
+        )
+        # the retail network is attached to the trader before the trader becomes a factory
+        data = [{'id': retail.pk, 'supplier': trader.pk}, {'id': trader.pk, 'node_type': 'Factory', 'supplier': None}]
+
+        response = self.client.patch('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content.decode())
+        self.assertEqual([node['level'] for node in response.json()], [1, 0])
+
+    def test_bulk_update_network_node_supplier_cycle(self):
+        first, second = [
+            NetworkNode.objects.create(
+                name=f'Сеть {i}', email='email1@example.com', city='Город', street='Улица', house_number='1',
+                node_type='RetailNetwork', level=1, supplier=self.factory
+            )
+            for i in range(2)
+        ]
+        data = [{'id': first.pk, 'supplier': second.pk}, {'id': second.pk, 'supplier': first.pk}]
+
+        response = self.client.patch('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [{'supplier': ['The suppliers of these nodes make a cycle.']}] * 2)
+
+    def test_bulk_update_network_node_errors(self):
+        data = [{'name': 'Без id'}, {'id': 0, 'name': 'Нет такого'}, {'id': self.factory.pk, 'supplier': self.factory.pk}]
+
+        response = self.client.patch('/platform/network-node/bulk/', data=data, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([list(error) for error in response.json()], [['id'], ['id'], ['supplier']])
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        self.product = Product.objects.create(name='product_1', model='model_1', release_date='2023-09-10')
+        self.factory = NetworkNode.objects.create(
+            name='Завод', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='Factory', level=0
+        )
+        self.factory.products.set([self.product])
+        self.retail = NetworkNode.objects.create(
+            name='Сеть, "первая"', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='RetailNetwork', level=1, supplier=self.factory, debt='10.50'
+        )
+
+    def test_export_network_node_ndjson(self):
+        response = self.client.get('/platform/network-node/export/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        exported = [json.loads(line) for line in lines]
+        listed = self.client.get('/platform/network-node/').json()
+        self.assertEqual(exported, sorted(listed, key=lambda node: node['id']))
+
+    def test_export_network_node_csv(self):
+        response = self.client.get('/platform/network-node/export/', {'export_format': 'csv'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['name'] for row in rows], ['Завод', 'Сеть, "первая"'])
+        self.assertEqual(rows[0]['products'], str(self.product.pk))
+        self.assertEqual(rows[1]['supplier_name'], 'Завод')
+        self.assertEqual(rows[1]['debt'], '10.50')
+
+    def test_export_product(self):
+        response = self.client.get('/platform/products/export/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            self.client.get(f'/platform/products/{self.product.pk}/').json()
+        )
+
+    def test_export_invalid_format(self):
+        response = self.client.get('/platform/products/export/', {'export_format': 'xml'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportNetworkTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.factory = NetworkNode.objects.create(
+            name='Завод', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='Factory', level=0
+        )
+        self.retail = NetworkNode.objects.create(
+            name='Сеть', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='RetailNetwork', level=1, supplier=self.factory
+        )
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def import_network(self, **options):
+        out = io.StringIO()
+        call_command('import_network', stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_network(self):
+        products = self.write_file('products.csv', 'id,name,model,release_date\n100,Транзистор,КТ315,2023-09-10\n')
+        nodes = self.write_file('nodes.ndjson', '\n'.join(json.dumps(node, ensure_ascii=False) for node in [
+            {'id': 200, 'name': 'Завод 2', 'email': 'a@example.com', 'city': 'Город', 'street': 'Улица',
+             'house_number': '2', 'node_type': 'Factory', 'supplier': None},
+            {'id': 201, 'name': 'ИП', 'email': 'a@example.com', 'city': 'Город', 'street': 'Улица',
+             'house_number': '3', 'node_type': 'IndividualEntrepreneur', 'supplier': 200, 'debt': '12.50'},
+            {'id': self.retail.pk, 'name': 'Сеть', 'email': 'a@example.com', 'city': 'Город', 'street': 'Улица',
+             'house_number': '1', 'node_type': 'RetailNetwork', 'supplier': 201},
+        ]))
+        links = self.write_file('links.csv', 'node_id,product_id\n200,100\n201,100\n')
+
+        self.import_network(products=products, nodes=nodes, links=links)
+
+        self.assertEqual(Product.objects.get(pk=100).model, 'КТ315')
+        self.assertEqual(
+            {node.pk: (node.level, node.supplier_id) for node in NetworkNode.objects.all()},
+            {self.factory.pk: (0, None), 200: (0, None), 201: (1, 200), self.retail.pk: (2, 201)}
+        )
+        self.assertEqual(NetworkNode.objects.get(pk=201).debt, Decimal('12.50'))
+        self.assertEqual(list(NetworkNode.objects.get(pk=201).products.values_list('pk', flat=True)), [100])
+
+        new_node = NetworkNode.objects.create(
+            name='ИП 2', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='Factory', level=0
+        )
+        self.assertGreater(new_node.pk, 201)
+
+    def test_import_network_violations(self):
+        trader = NetworkNode.objects.create(
+            name='ИП', email='email1@example.com', city='Город', street='Улица', house_number='1',
+            node_type='IndividualEntrepreneur', level=2, supplier=self.retail
+        )
+        nodes = self.write_file('nodes.csv', '\n'.join([
+            'id,name,email,city,street,house_number,node_type,supplier',
+            f'300,Завод,a@example.com,Город,Улица,1,Factory,{self.factory.pk}',
+            '301,Сеть,a@example.com,Город,Улица,1,RetailNetwork,',
+            '302,Сеть,a@example.com,Город,Улица,1,RetailNetwork,999999',
+            f'303,ИП,a@example.com,Город,Улица,1,IndividualEntrepreneur,{trader.pk}',
+            '304,ИП,a@example.com,Город,Улица,1,IndividualEntrepreneur,305',
+            '305,ИП,a@example.com,Город,Улица,1,IndividualEntrepreneur,304',
+            '',
+        ]))
+
+        output = self.import_network(nodes=nodes, dry_run=True)
+
+        for kind in ('factory_with_supplier', 'missing_supplier', 'unknown_supplier', 'too_deep', 'no_factory_chain'):
+            self.assertIn(kind, output)
+        self.assertIn('Dry run finished', output)
+        self.assertFalse(NetworkNode.objects.filter(pk__gte=300).exists())
+
+        with self.assertRaises(CommandError):
+            self.import_network(nodes=nodes)
+        self.assertFalse(NetworkNode.objects.filter(pk__gte=300).exists())
+
+    def test_import_network_duplicate_node_ids(self):
+        nodes = self.write_file('nodes.csv', '\n'.join([
+            'id,name,email,city,street,house_number,node_type,supplier',
+            '300,Завод,a@example.com,Город,Улица,1,Factory,',
+            '300,Завод 2,a@example.com,Город,Улица,2,Factory,',
+            '301,Сеть,a@example.com,Город,Улица,1,RetailNetwork,300',
+            '',
+        ]))
+
+        output = self.import_network(nodes=nodes, dry_run=True)
+        self.assertIn('import_node: duplicate_id: 2', output)
+
+        with self.assertRaises(CommandError):
+            self.import_network(nodes=nodes)
+        self.assertFalse(NetworkNode.objects.filter(pk__gte=300).exists())
+
+    def test_import_network_duplicate_products(self):
+        products = self.write_file('products.csv', '\n'.join([
+            'id,name,model,release_date',
+            '100,Транзистор,КТ315,2023-09-10',
+            '101, транзистор ,кт315,2023-09-10',
+            '',
+        ]))
+
+        output = self.import_network(products=products, dry_run=True)
+        self.assertIn('import_product: duplicate_product: 2', output)
+
+        with self.assertRaises(CommandError):
+            self.import_network(products=products)
+        self.assertFalse(Product.objects.exists())
+
+    def test_import_network_existing_products(self):
+        product = Product.objects.create(name='Транзистор', model='КТ315', release_date='2023-09-10')
+        product.refresh_from_db()
+        products = self.write_file('products.csv', '\n'.join([
+            'id,name,model,release_date',
+            f'{product.pk},Транзистор,КТ315,2024-01-01',
+            f'{product.pk + 1},ТРАНЗИСТОР,КТ315 ,2023-09-10',
+            '',
+        ]))
+
+        output = self.import_network(products=products, dry_run=True)
+        self.assertIn('import_product: existing_product: 1', output)
+        self.assertIn(f'id={product.pk + 1} existing_product: same name and model as product {product.pk}', output)
+
+        with self.assertRaises(CommandError):
+            self.import_network(products=products)
+        self.assertEqual(list(Product.objects.values_list('pk', 'release_date')),
+                         [(product.pk, product.release_date)])
+
+    def test_import_network_unknown_columns(self):
+        nodes = self.write_file('nodes.csv', 'id,name,password\n1,Завод,secret\n')
+
+        with self.assertRaises(CommandError):
+            self.import_network(nodes=nodes)
+
+
+class NetworkStatsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword',
+            is_superuser=True
+        )
+        self.client.force_login(self.user)
+
+        factory = NetworkNode.objects.create(
+            name='Завод', email='email1@example.com', city='Москва', street='Улица', house_number='1',
+            node_type='Factory', level=0
+        )
+        for city, debt in (('Москва', '10.00'), ('Тула', '20.00'), ('Тула', '25.00')):
+            NetworkNode.objects.create(
+                name='Сеть', email='email1@example.com', city=city, street='Улица', house_number='1',
+                node_type='RetailNetwork', level=1, supplier=factory, debt=debt
+            )
+
+    def test_stats_before_refresh(self):
+        response = self.client.get('/platform/stats/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()['refreshed_at'])
+
+    def test_stats_refresh(self):
+        response = self.client.post('/platform/stats/refresh/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/platform/stats/', {'group_by': 'city,level'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.json()['refreshed_at'])
+        self.assertEqual(response.json()['results'], [
+            {'city': 'Москва', 'level': 0, 'node_count': 1, 'total_debt': '0.00', 'average_debt': '0.00'},
+            {'city': 'Москва', 'level': 1, 'node_count': 1, 'total_debt': '10.00', 'average_debt': '10.00'},
+            {'city': 'Тула', 'level': 1, 'node_count': 2, 'total_debt': '45.00', 'average_debt': '22.50'},
+        ])
+
+        response = self.client.get('/platform/stats/')
+        self.assertEqual(response.json()['results'], [
+            {'node_count': 4, 'total_debt': '55.00', 'average_debt': '13.75'}
+        ])
+
+    def test_stats_refresh_requires_superuser(self):
+        self.user.is_superuser = False
+        self.user.save()
+
+        response = self.client.post('/platform/stats/refresh/')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stats_invalid_group_by(self):
+        response = self.client.get('/platform/stats/', {'group_by': 'email'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NetworkNodeFilterTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        self.factory = NetworkNode.objects.create(
+            name='Завод', email='email1@example.com', country='Россия', city='Москва', street='Улица',
+            house_number='1', node_type='Factory', level=0
+        )
+        self.retail = NetworkNode.objects.create(
+            name='Сеть', email='email1@example.com', country='Россия', city='Тула', street='Улица',
+            house_number='1', node_type='RetailNetwork', level=1, supplier=self.factory, debt='100.00'
+        )
+        self.foreign = NetworkNode.objects.create(
+            name='Сеть', email='email1@example.com', country='Беларусь', city='Минск', street='Улица',
+            house_number='1', node_type='RetailNetwork', level=1, supplier=self.factory, debt='5.00'
+        )
+
+    def filtered_ids(self, **params):
+        response = self.client.get('/platform/network-node/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(node['id'] for node in response.json())
+
+    def test_filter_network_node(self):
+        self.assertEqual(self.filtered_ids(country='Россия'), [self.factory.pk, self.retail.pk])
+        self.assertEqual(self.filtered_ids(country='Россия', city='Тула'), [self.retail.pk])
+        self.assertEqual(self.filtered_ids(node_type='RetailNetwork', level=1, debt_min=10), [self.retail.pk])
+        self.assertEqual(self.filtered_ids(supplier=self.factory.pk), [self.retail.pk, self.foreign.pk])
+        self.assertEqual(self.filtered_ids(debt_max='5'), [self.factory.pk, self.foreign.pk])
+
+    def test_filter_network_node_export(self):
+        response = self.client.get('/platform/network-node/export/', {'country': 'Беларусь'})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.foreign.pk])
+
+    def test_filter_network_node_invalid_value(self):
+        for params in ({'level': 'one'}, {'debt_min': 'many'}, {'node_type': 'Shop'}):
+            response = self.client.get('/platform/network-node/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_network_node_unindexed_on_large_table(self):
+        params = {'country': 'Россия', 'node_type': 'RetailNetwork'}
+
+        self.assertEqual(self.filtered_ids(**params), [self.retail.pk])
+
+        cache.clear()
+        with mock.patch.object(NetworkNodeFilterBackend, 'large_table_rows', -1):
+            response = self.client.get('/platform/network-node/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            self.assertEqual(self.filtered_ids(country='Россия', city='Тула', node_type='RetailNetwork'),
+                             [self.retail.pk])
+            self.assertEqual(self.filtered_ids(debt_min=10), [self.retail.pk])
+
+    def test_filter_network_node_supplier_on_large_table(self):
+        cache.clear()
+        with mock.patch.object(NetworkNodeFilterBackend, 'large_table_rows', -1):
+            # the index of the supplier foreign key serves the other filters too
+            self.assertEqual(self.filtered_ids(supplier=self.factory.pk, country='Россия', debt_min=10),
+                             [self.retail.pk])
+            self.assertEqual(self.filtered_ids(supplier=self.factory.pk, node_type='RetailNetwork'),
+                             [self.retail.pk, self.foreign.pk])
+
+
+class NetworkNodeSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        self.transistor = Product.objects.create(name='Транзистор', model='KT315-A', release_date='2023-09-10')
+        self.factory = NetworkNode.objects.create(
+            name='Транзистор', email='factory@example.com', city='Москва', street='Заводская',
+            house_number='1', node_type='Factory', level=0
+        )
+        self.retail = NetworkNode.objects.create(
+            name='Сеть', email='retail@example.com', city='Тула', street='Ленина',
+            house_number='1', node_type='RetailNetwork', level=1, supplier=self.factory
+        )
+        self.retail.products.add(self.transistor)
+        self.factory.products.add(self.transistor)
+
+    def searched_ids(self, term, **params):
+        response = self.client.get('/platform/network-node/', {'search': term, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        return [node['id'] for node in (data['results'] if params else data)]
+
+    def test_search_network_node(self):
+        self.assertEqual(self.searched_ids('Тула'), [self.retail.pk])
+        self.assertEqual(self.searched_ids('ленин'), [self.retail.pk])
+        self.assertEqual(self.searched_ids('retail@example.com'), [self.retail.pk])
+        self.assertEqual(self.searched_ids('нет такого'), [])
+
+    def test_search_network_node_by_partial_product_model(self):
+        self.assertEqual(sorted(self.searched_ids('315')), [self.factory.pk, self.retail.pk])
+        self.assertEqual(sorted(self.searched_ids('kt31')), [self.factory.pk, self.retail.pk])
+
+    def test_search_network_node_ranked(self):
+        self.assertEqual(self.searched_ids('транзистор'), [self.factory.pk, self.retail.pk])
+        self.assertEqual(self.searched_ids('транзистор', limit=1), [self.factory.pk])
+
+    def test_search_network_node_follows_writes(self):
+        self.transistor.model = 'KT361'
+        self.transistor.save()
+        self.assertEqual(self.searched_ids('315'), [])
+        self.assertEqual(sorted(self.searched_ids('361')), [self.factory.pk, self.retail.pk])
+
+        self.retail.products.remove(self.transistor)
+        self.assertEqual(self.searched_ids('361'), [self.factory.pk])
+
+        self.retail.name = 'Магазин'
+        self.retail.save()
+        self.assertEqual(self.searched_ids('магаз'), [self.retail.pk])
+
+        response = self.client.post('/platform/network-node/bulk/', [
+            {'name': 'Склад', 'email': 'stock@example.com', 'city': 'Тверь', 'street': 'Ленина', 'house_number': '2',
+             'node_type': 'IndividualEntrepreneur', 'supplier': self.factory.pk, 'product_ids': [self.transistor.pk]}
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.searched_ids('склад kt361'), [response.json()[0]['id']])
+
+
+class SparseFieldsetTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        self.product = Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, debt='10.00', **address)
+        self.retail.products.add(self.product)
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in queries]
+
+    def test_fields(self):
+        response, queries = self.get(f'/platform/network-node/{self.retail.pk}/', {'fields': 'id,name,debt'})
+        self.assertEqual(response.json(), {'id': self.retail.pk, 'name': 'Сеть', 'debt': '10.00'})
+        # neither the supplier nor the products are read, nor the unused columns
+        node_query = [sql for sql in queries if 'trading_platform_networknode' in sql][0]
+        self.assertNotIn('city', node_query)
+        self.assertFalse([sql for sql in queries if 'trading_platform_product' in sql or 'INNER JOIN' in sql])
+
+        response = self.client.get('/platform/products/', {'fields': 'id,model'})
+        self.assertEqual(response.json(), [{'id': self.product.pk, 'model': 'P-1'}])
+
+    def test_expand(self):
+        response = self.client.get(f'/platform/network-node/{self.retail.pk}/', {'expand': 'products,supplier'})
+        data = response.json()
+        self.assertEqual(data['supplier'], {'id': self.factory.pk, 'name': 'Завод', 'node_type': 'Factory',
+                                            'level': 0, 'country': '', 'city': 'Город'})
+        self.assertEqual([product['id'] for product in data['products']], [self.product.pk])
+
+        # a sparse response leaves the products out unless they are asked for
+        data = self.client.get('/platform/network-node/', {'expand': 'supplier'}).json()
+        self.assertNotIn('products', data[0])
+        self.assertIsNone(data[0]['supplier'])
+
+        # the full representation is unchanged
+        data = self.client.get(f'/platform/network-node/{self.retail.pk}/').json()
+        self.assertEqual(data['supplier'], self.factory.pk)
+        self.assertEqual(len(data['products']), 1)
+
+    def test_unknown_fields(self):
+        response = self.client.get('/platform/network-node/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'fields': 'Unknown fields: password'})
+        response = self.client.get('/platform/products/', {'expand': 'network_nodes'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        self.product = Product.objects.create(name='Телевизор', model='T-1', release_date='2023-09-10')
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, **address)
+        self.other = NetworkNode.objects.create(name='Другой завод', node_type='Factory', level=0, **address)
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        return response, len(queries)
+
+    def test_cached_response(self):
+        response, misses = self.get('/platform/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        cached, hits = self.get('/platform/products/')
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertLess(hits, misses)
+
+        not_modified, conditional = self.get('/platform/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(conditional, hits)
+
+        not_modified, conditional = self.get('/platform/products/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        counters = self.client.get('/platform/stats/cache/')
+        self.assertEqual(counters.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_superuser = True
+        self.user.save()
+        counters = self.client.get('/platform/stats/cache/')
+        self.assertEqual(counters.json()['product'], {'hits': 1, 'misses': 1, 'not_modified': 2})
+
+    def test_cached_response_padded_pk(self):
+        # a new city invalidates only the subtrees that contain the node, bumped by its integer id
+        url = f'/platform/network-node/0{self.retail.pk}/'
+        self.assertEqual(self.client.get(url).json()['city'], 'Город')
+        tree_url = f'/platform/network-node/00{self.factory.pk}/tree/'
+        self.assertEqual(self.client.get(tree_url).status_code, status.HTTP_200_OK)
+
+        self.retail.city = 'Другой город'
+        self.retail.save()
+        self.assertEqual(self.client.get(url).json()['city'], 'Другой город')
+        self.assertEqual([child['city'] for child in self.client.get(tree_url).json()['children']], ['Другой город'])
+
+    def test_cached_response_invalidated_by_writes(self):
+        products = self.client.get('/platform/products/')
+        self.product.model = 'T-2'
+        self.product.save()
+        response = self.client.get('/platform/products/')
+        self.assertNotEqual(response['ETag'], products['ETag'])
+        self.assertEqual(response.json()[0]['model'], 'T-2')
+
+        retail = self.client.get(f'/platform/network-node/{self.retail.pk}/')
+        self.retail.products.add(self.product)
+        response = self.client.get(f'/platform/network-node/{self.retail.pk}/')
+        self.assertNotEqual(response['ETag'], retail['ETag'])
+        self.assertEqual(len(response.json()['products']), 1)
+
+        tree = self.client.get(f'/platform/network-node/{self.factory.pk}/tree/')
+        other = self.client.get(f'/platform/network-node/{self.other.pk}/tree/')
+        self.client.patch(f'/platform/network-node/{self.retail.pk}/', {'city': 'Тула', 'supplier': self.factory.pk},
+                          content_type='application/json')
+        response = self.client.get(f'/platform/network-node/{self.factory.pk}/tree/')
+        self.assertEqual(response.json()['children'][0]['city'], 'Тула')
+        self.assertNotEqual(response['ETag'], tree['ETag'])
+        self.assertEqual(self.client.get(f'/platform/network-node/{self.other.pk}/tree/')['ETag'], other['ETag'])
+
+        nodes = self.client.get('/platform/network-node/')
+        response = self.client.patch('/platform/network-node/bulk/', [{'id': self.other.pk, 'name': 'Новый завод'}],
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/platform/network-node/')
+        self.assertNotEqual(response['ETag'], nodes['ETag'])
+        self.assertIn('Новый завод', [node['name'] for node in response.json()])
+
+
+class NetworkNodeValuesTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        self.phone = Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+        self.tv = Product.objects.create(name='Телевизор', model='T-1', release_date='2021-01-31')
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.factory.products.add(self.tv, self.phone)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1, country='Россия',
+                                                 supplier=self.factory, debt='1234.5', **address)
+        self.retail.products.add(self.phone)
+        self.trader = NetworkNode.objects.create(name='ИП', node_type='IndividualEntrepreneur', level=2,
+                                                 supplier=self.retail, debt='0.01', **address)
+
+    def assertSameResponse(self, url, params=None):
+        """
+        Requests 'url' through NetworkNodeSerializer and through NetworkNodeValuesSerializer and compares the bodies.
+        """
+        responses = []
+        for values_read in (False, True):
+            cache.clear()
+            with self.settings(NETWORK_NODE_VALUES_READ=values_read):
+                responses.append(self.client.get(url, params))
+        self.assertEqual(responses[0].status_code, responses[1].status_code)
+        self.assertEqual(responses[0].content.decode(), responses[1].content.decode())
+        return responses[1]
+
+    def test_values_serializer_matches_serializer(self):
+        queryset = NetworkNode.objects.order_by('id')
+        rows = NetworkNodeValuesSerializer().get_values(queryset)
+        # the products in the order of the viewset, the updates of their counts move them in the table
+        queryset = queryset.prefetch_related(Prefetch('products', queryset=Product.objects.order_by('id')))
+
+        self.assertEqual(
+            NetworkNodeValuesSerializer(chunk_size=1).to_representation(rows),
+            NetworkNodeSerializer(queryset, many=True).data
+        )
+
+    def test_values_read_list_matches_serializer(self):
+        self.assertSameResponse('/platform/network-node/')
+        self.assertSameResponse('/platform/network-node/', {'limit': 2, 'offset': 1})
+        self.assertSameResponse('/platform/network-node/', {'country': 'Россия'})
+        self.assertSameResponse('/platform/network-node/', {'search': 'телефон'})
+
+        page = self.assertSameResponse('/platform/network-node/', {'page_size': 2}).json()
+        self.assertSameResponse(page['next'])
+
+    def test_values_read_sparse_fields_match_serializer(self):
+        self.assertSameResponse('/platform/network-node/', {'fields': 'id,name,debt'})
+        self.assertSameResponse('/platform/network-node/', {'fields': 'name,supplier_name,products'})
+        self.assertSameResponse('/platform/network-node/', {'expand': 'supplier'})
+        self.assertSameResponse(f'/platform/network-node/{self.trader.pk}/', {'fields': 'id', 'expand': 'products,supplier'})
+
+    def test_values_read_retrieve_matches_serializer(self):
+        for node in (self.factory, self.retail, self.trader):
+            self.assertSameResponse(f'/platform/network-node/{node.pk}/')
+        self.assertEqual(self.assertSameResponse('/platform/network-node/0/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.assertSameResponse('/platform/network-node/x/').status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(NETWORK_NODE_VALUES_READ=True)
+    def test_values_read_query_budget(self):
+        def grow():
+            for i in range(10):
+                node = NetworkNode.objects.create(name=f'ИП {i}', email='email1@example.com', city='Город',
+                                                  street='Улица', house_number='1', node_type='IndividualEntrepreneur',
+                                                  level=2, supplier=self.retail)
+                node.products.add(self.phone, self.tv)
+
+        self.assertQueryBudget('/platform/network-node/', grow, budget=4)
+
+
+class NetworkNodeAdminTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword',
+            is_staff=True,
+            is_superuser=True
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        self.address = {'email': 'email1@example.com', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', city='Москва', node_type='Factory', level=0,
+                                                  **self.address)
+        self.retail = NetworkNode.objects.create(name='Сеть', city='Тула', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, **self.address)
+
+    def grow(self):
+        NetworkNode.objects.bulk_create([
+            NetworkNode(name=f'ИП {i}', city=f'Город {i}', node_type='IndividualEntrepreneur', level=2,
+                        supplier=self.retail, **self.address)
+            for i in range(10)
+        ])
+
+    def test_admin_changelist_query_budget(self):
+        self.assertQueryBudget('/admin/trading_platform/networknode/', self.grow, budget=6)
+
+    def test_admin_changelist_estimated_count(self):
+        self.grow()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE trading_platform_networknode')
+
+        with mock.patch.object(EstimatedCountPaginator, 'estimate_above', 0):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/trading_platform/networknode/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.context['cl'].result_count, 12)
+            self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+
+            response = self.client.get('/admin/trading_platform/networknode/', {'city': 'Тула'})
+            self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_admin_city_filter(self):
+        self.assertEqual(NetworkNode.objects.distinct_cities(), ['Москва', 'Тула'])
+
+        response = self.client.get('/admin/trading_platform/networknode/', {'city': 'Тула'})
+        self.assertEqual([node.pk for node in response.context['cl'].result_list], [self.retail.pk])
+
+        self.grow()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/trading_platform/networknode/')
+        self.assertFalse([query for query in queries if 'WITH RECURSIVE' in query['sql']])
+        choices = [choice['display'] for choice in response.context['cl'].filter_specs[0].choices(response.context['cl'])]
+        self.assertEqual(choices[1:], ['Москва', 'Тула'])
+
+    def test_admin_supplier_autocomplete(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'trading_platform', 'model_name': 'networknode', 'field_name': 'supplier', 'term': 'зав'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [{'id': str(self.factory.pk), 'text': 'Завод'}])
+
+        url = f'/admin/trading_platform/networknode/{self.retail.pk}/change/'
+        self.client.get(url)
+        self.assertQueryBudget(url, self.grow, budget=7)
+
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword',
+            is_staff=True,
+            is_superuser=True
+        )
+        self.client.force_login(self.user)
+
+        address = {'email': 'email1@example.com', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', city='Москва', node_type='Factory', level=0,
+                                                  **address)
+        self.nodes = [
+            NetworkNode.objects.create(name=f'Сеть {i}', city=city, node_type='RetailNetwork', level=1,
+                                       supplier=self.factory, debt='100.00', **address)
+            for i, city in enumerate(('Тула', 'Тула', 'Тверь'))
+        ]
+
+    def clear_debt(self, node_ids, url='/admin/trading_platform/networknode/', **data):
+        response = self.client.post(url, {'action': 'clear_debt', '_selected_action': node_ids, 'index': 0, **data})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        return Job.objects.latest('id')
+
+    def run_workers(self):
+        call_command('run_workers', burst=True, stdout=io.StringIO())
+
+    def debts(self):
+        return [str(node.debt) for node in NetworkNode.objects.filter(supplier=self.factory).order_by('id')]
+
+    def test_clear_debt_runs_as_job(self):
+        job = self.clear_debt([self.nodes[0].pk, self.nodes[2].pk])
+
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.created_by, self.user)
+        self.assertEqual(self.debts(), ['100.00', '100.00', '100.00'])
+
+        self.run_workers()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.done), (Job.DONE, 2, 2))
+        self.assertEqual(self.debts(), ['0.00', '100.00', '0.00'])
+
+        response = self.client.get('/admin/trading_platform/job/')
+        self.assertContains(response, '2 / 2 (100%)')
+
+    def test_clear_debt_select_across_filter(self):
+        self.clear_debt([self.nodes[0].pk], url='/admin/trading_platform/networknode/?city=Тула', select_across=1)
+
+        with mock.patch.object(ClearDebtJob, 'chunk_size', 1):
+            self.run_workers()
+
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.total, job.done, job.state), (Job.DONE, 2, 2, {'last_id': self.nodes[1].pk}))
+        self.assertEqual(self.debts(), ['0.00', '0.00', '100.00'])
+
+    def test_failed_job(self):
+        job = self.clear_debt([self.nodes[0].pk])
+
+        with mock.patch.object(ClearDebtJob, 'run_chunk', side_effect=RuntimeError('database is gone')):
+            self.run_workers()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('database is gone', job.error)
+        self.assertEqual(self.debts(), ['100.00', '100.00', '100.00'])
+
+    def test_abandoned_job_is_claimed_again(self):
+        now = timezone.now()
+        running = enqueue('clear_debt', ClearDebtJob.selection(NetworkNode.objects.all()))
+        abandoned = enqueue('clear_debt', ClearDebtJob.selection(NetworkNode.objects.all()))
+        Job.objects.filter(pk=running.pk).update(status=Job.RUNNING, worker='other', heartbeat_at=now)
+        Job.objects.filter(pk=abandoned.pk).update(status=Job.RUNNING, worker='other',
+                                                   heartbeat_at=now - Worker.lease * 2)
+
+        worker = Worker(name='worker')
+        job = worker.claim()
+        self.assertEqual((job.pk, job.worker), (abandoned.pk, 'worker'))
+        self.assertIsNone(worker.claim())
+
+
+class DebtLedgerTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1, supplier=self.factory,
+                                                 debt='100.00', **address)
+
+    def post(self, movements):
+        return self.client.post('/platform/debt-movements/bulk/', movements, content_type='application/json')
+
+    def test_post_movements(self):
+        self.assertEqual(list(DebtMovement.objects.values_list('node', 'kind', 'amount')),
+                         [(self.retail.pk, 'opening', Decimal('100.00'))])
+
+        response = self.post([
+            {'node': self.retail.pk, 'kind': 'shipment', 'amount': '50.00'},
+            {'node': self.factory.pk, 'kind': 'adjustment', 'amount': '10.00'},
+            {'node': self.retail.pk, 'kind': 'payment', 'amount': '-30.00'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'posted': 3, 'debts': [
+            {'node': self.factory.pk, 'debt': '10.00'},
+            {'node': self.retail.pk, 'debt': '120.00'},
+        ]})
+        self.retail.refresh_from_db()
+        self.assertEqual(self.retail.debt, Decimal('120.00'))
+
+        response = self.client.get('/platform/debt-movements/', {'node': self.retail.pk})
+        self.assertEqual([(item['kind'], item['amount']) for item in response.json()],
+                         [('opening', '100.00'), ('shipment', '50.00'), ('payment', '-30.00')])
+
+    def test_invalid_movements(self):
+        response = self.post([
+            {'node': self.retail.pk, 'kind': 'shipment', 'amount': '50.00'},
+            {'node': self.retail.pk, 'kind': 'payment', 'amount': '30.00'},
+            {'node': self.retail.pk, 'kind': 'opening', 'amount': '30.00'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn('amount', errors[1])
+        self.assertIn('kind', errors[2])
+
+        response = self.post([{'node': 0, 'kind': 'shipment', 'amount': '50.00'}])
+        self.assertEqual(response.json(), [{'node': ['Invalid pk "0" - object does not exist.']}])
+
+        response = self.post([{'node': self.retail.pk, 'kind': 'shipment', 'amount': '99999999.00'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(DebtMovement.objects.count(), 1)
+        self.retail.refresh_from_db()
+        self.assertEqual(self.retail.debt, Decimal('100.00'))
+
+    def test_clear_debt_posts_adjustments(self):
+        enqueue('clear_debt', ClearDebtJob.selection(NetworkNode.objects.all()))
+        call_command('run_workers', burst=True, stdout=io.StringIO())
+
+        self.retail.refresh_from_db()
+        self.assertEqual(self.retail.debt, Decimal('0.00'))
+        self.assertEqual(list(DebtMovement.objects.order_by('id').values_list('kind', 'amount')),
+                         [('opening', Decimal('100.00')), ('adjustment', Decimal('-100.00'))])
+
+    def test_create_partitions(self):
+        table = DebtMovement._meta.db_table
+        now = timezone.now()
+        self.assertEqual(DebtMovement.objects.create_partitions(now, 2),
+                         [f'{table}_{now:%Y%m}', f'{table}_{(now.replace(day=1) + timedelta(days=32)):%Y%m}'])
+        self.assertEqual(DebtMovement.objects.create_partitions(now, 2), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT (SELECT count(*) FROM {table}_default), (SELECT count(*) FROM {table}_{now:%Y%m})')
+            self.assertEqual(cursor.fetchone(), (0, 1))
+        self.assertEqual(DebtMovement.objects.get().node, self.retail)
+
+
+class DebtSnapshotTestCase(TransactionTestCase):
+    """
+    Commits every request, since the movements are dated with the start of their transaction.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1, supplier=self.factory,
+                                                 debt='100.00', **address)
+
+    def post(self, movements):
+        return self.client.post('/platform/debt-movements/bulk/', movements, content_type='application/json')
+
+    def test_debt_as_of(self):
+        before = timezone.now()
+        self.post([{'node': self.retail.pk, 'kind': 'shipment', 'amount': '50.00'}])
+        first = timezone.now()
+        call_command('snapshot_debt', '--at', first.isoformat(), stdout=io.StringIO())
+        self.post([{'node': self.retail.pk, 'kind': 'payment', 'amount': '-20.00'}])
+        self.assertEqual(list(DebtSnapshot.objects.values_list('node', 'balance')), [(self.retail.pk, Decimal('150.00'))])
+
+        # a snapshot taken at the time asked for leaves no movements to add
+        with self.assertNumQueries(2):
+            self.assertEqual(DebtMovement.objects.balance_as_of(self.retail.pk, first), Decimal('150.00'))
+
+        url = f'/platform/network-node/{self.retail.pk}/debt/'
+        self.assertEqual(self.client.get(url, {'at': first.isoformat()}).json()['debt'], '150.00')
+        self.assertEqual(self.client.get(url, {'at': timezone.now().isoformat()}).json()['debt'], '130.00')
+        self.assertEqual(self.client.get(url, {'at': before.isoformat()}).json()['debt'], '100.00')
+        self.assertEqual(self.client.get(url).json()['debt'], '130.00')
+        self.assertEqual(self.client.get(url, {'at': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        second = timezone.now()
+        call_command('snapshot_debt', '--at', second.isoformat(), stdout=io.StringIO())
+        self.assertEqual(list(DebtSnapshot.objects.filter(taken_at=second).values_list('node', 'balance')),
+                         [(self.retail.pk, Decimal('130.00'))])
+        with self.assertRaises(CommandError):
+            call_command('snapshot_debt', '--at', first.isoformat(), stdout=io.StringIO())
+
+    def test_snapshot_cutoff(self):
+        self.post([{'node': self.retail.pk, 'kind': 'shipment', 'amount': '50.00'}])
+        with self.assertRaises(CommandError):
+            call_command('snapshot_debt', '--at', (timezone.now() + timedelta(minutes=1)).isoformat(),
+                         stdout=io.StringIO())
+
+        # a transaction still open may post movements dated before any later time
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT 1')
+            with self.assertRaises(CommandError):
+                call_command('snapshot_debt', '--at', timezone.now().isoformat(), stdout=io.StringIO())
+            cursor.execute('ROLLBACK')
+        call_command('snapshot_debt', '--at', timezone.now().isoformat(), stdout=io.StringIO())
+        self.assertEqual(list(DebtSnapshot.objects.values_list('node', 'balance')), [(self.retail.pk, Decimal('150.00'))])
+
+
+class NetworkNodeMoveTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.other_factory = NetworkNode.objects.create(name='Другой завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, **address)
+        self.other_retail = NetworkNode.objects.create(name='Другая сеть', node_type='RetailNetwork', level=1,
+                                                       supplier=self.factory, **address)
+        self.traders = NetworkNode.objects.bulk_create([
+            NetworkNode(name=f'ИП {i}', node_type='IndividualEntrepreneur', level=2, supplier=self.retail, **address)
+            for i in range(3)
+        ])
+
+    def move(self, node, supplier):
+        return self.client.post(f'/platform/network-node/{node.pk}/move/', {'supplier': supplier and supplier.pk},
+                                content_type='application/json')
+
+    def levels(self):
+        return dict(NetworkNode.objects.values_list('name', 'level'))
+
+    def test_move_network_node(self):
+        # levels left behind by an earlier supplier change, fixed by the move
+        NetworkNode.objects.filter(supplier=self.retail).update(level=1)
+        tree = self.client.get(f'/platform/network-node/{self.other_factory.pk}/tree/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.move(self.retail, self.other_factory)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'id': self.retail.pk, 'supplier': self.other_factory.pk, 'level': 1,
+                                           'subtree_size': 4})
+        self.assertEqual(len([query for query in queries if query['sql'].lstrip().startswith('WITH RECURSIVE')
+                              and 'UPDATE' in query['sql']]), 1)
+        self.assertEqual(self.levels(), {'Завод': 0, 'Другой завод': 0, 'Сеть': 1, 'Другая сеть': 1,
+                                         'ИП 0': 2, 'ИП 1': 2, 'ИП 2': 2})
+        self.retail.refresh_from_db()
+        self.assertEqual(self.retail.supplier, self.other_factory)
+
+        response = self.client.get(f'/platform/network-node/{self.other_factory.pk}/tree/')
+        self.assertNotEqual(response['ETag'], tree['ETag'])
+        self.assertEqual([child['id'] for child in response.json()['children']], [self.retail.pk])
+
+    def test_move_network_node_leaf_changes_level(self):
+        response = self.move(self.traders[0], self.other_factory)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.traders[0].refresh_from_db()
+        self.assertEqual((self.traders[0].supplier_id, self.traders[0].level), (self.other_factory.pk, 1))
+
+    def test_move_network_node_invalid(self):
+        cases = [
+            (self.retail, self.traders[0]),  # into its own subtree
+            (self.retail, self.retail),  # under itself
+            (self.retail, self.other_retail),  # the traders would be on level 3
+            (self.factory, self.other_factory),  # factories have no supplier
+            (self.retail, None),  # retail networks need one
+        ]
+        for node, supplier in cases:
+            response = self.move(node, supplier)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (node.name, supplier))
+
+        self.assertEqual(self.levels(), {'Завод': 0, 'Другой завод': 0, 'Сеть': 1, 'Другая сеть': 1,
+                                         'ИП 0': 2, 'ИП 1': 2, 'ИП 2': 2})
+        self.assertEqual(NetworkNode.objects.get(pk=self.retail.pk).supplier_id, self.factory.pk)
+
+
+class AuditNetworkTestCase(TestCase):
+    def setUp(self):
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.other_factory = NetworkNode.objects.create(name='Другой завод', node_type='Factory', level=0, **address)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1,
+                                                 supplier=self.factory, **address)
+        self.trader = NetworkNode.objects.create(name='ИП', node_type='IndividualEntrepreneur', level=2,
+                                                 supplier=self.retail, **address)
+        self.loop = NetworkNode.objects.bulk_create([
+            NetworkNode(name=f'Цикл {i}', node_type='RetailNetwork', level=1, **address) for i in range(3)
+        ])
+
+    def audit_network(self, **options):
+        out = io.StringIO()
+        call_command('audit_network', stdout=out, **options)
+        return out.getvalue()
+
+    def break_network(self):
+        NetworkNode.objects.filter(pk=self.other_factory.pk).update(supplier=self.trader, level=3)
+        NetworkNode.objects.filter(pk=self.trader.pk).update(level=1)
+        NetworkNode.objects.filter(pk=self.loop[0].pk).update(supplier=self.loop[1])
+        NetworkNode.objects.filter(pk=self.loop[1].pk).update(supplier=self.loop[0])
+
+    def test_audit_network(self):
+        NetworkNode.objects.filter(pk__in=[node.pk for node in self.loop]).delete()
+
+        self.assertIn('No violations in 4 nodes.', self.audit_network())
+
+    def test_audit_network_violations(self):
+        self.break_network()
+
+        out = self.audit_network()
+
+        self.assertIn(f'cycle: 2\n  ids: {self.loop[0].pk}, {self.loop[1].pk}\n', out)
+        self.assertIn(f'factory_with_supplier: 1\n  ids: {self.other_factory.pk}\n', out)
+        self.assertIn(f'missing_supplier: 1\n  ids: {self.loop[2].pk}\n', out)
+        self.assertIn(f'level_mismatch: 2\n  ids: {self.other_factory.pk}, {self.trader.pk}\n', out)
+        self.assertNotIn('orphan', out)
+        self.assertNotIn('too_deep', out)
+
+    def test_audit_network_repair(self):
+        self.break_network()
+
+        out = self.audit_network(repair=True, batch_size=1)
+
+        self.assertIn('1 factory suppliers cleared', out)
+        self.assertIn('2 levels fixed', out)
+        other_factory = NetworkNode.objects.get(pk=self.other_factory.pk)
+        self.assertEqual((other_factory.supplier_id, other_factory.level), (None, 0))
+        self.assertEqual(NetworkNode.objects.get(pk=self.trader.pk).level, 2)
+
+        out = self.audit_network()
+        self.assertNotIn('level_mismatch', out)
+        self.assertNotIn('factory_with_supplier', out)
+        self.assertIn('cycle: 2', out)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        self.phone = Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+        self.tv = Product.objects.create(name='Телевизор', model='T-1', release_date='2021-01-31')
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+        self.factory.products.add(self.tv, self.phone)
+        self.retail = NetworkNode.objects.create(name='Сеть', node_type='RetailNetwork', level=1, country='Россия',
+                                                 supplier=self.factory, debt='1234.5', **address)
+        self.retail.products.add(self.phone)
+        self.trader = NetworkNode.objects.create(name='ИП', node_type='IndividualEntrepreneur', level=2,
+                                                 supplier=self.retail, debt='0.01', **address)
+
+    def assertSameResponse(self, path, params=None, client=None):
+        """
+        Requests /platform/<path> and /platform/async/<path> and compares the bodies, links included.
+        """
+        client = client or self.client
+        cache.clear()
+        response = client.get(f'/platform/{path}', params)
+        async_response = client.get(f'/platform/async/{path}', params)
+        self.assertEqual(response.status_code, async_response.status_code)
+        self.assertEqual(response.content.decode(), async_response.content.decode().replace('/platform/async/', '/platform/'))
+        return async_response
+
+    def test_async_products(self):
+        self.assertSameResponse('products/')
+        self.assertSameResponse('products/', {'limit': 1, 'offset': 1})
+        self.assertSameResponse(f'products/{self.phone.pk}/')
+        self.assertEqual(self.assertSameResponse('products/0/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_network_nodes(self):
+        self.assertSameResponse('network-node/')
+        self.assertSameResponse('network-node/', {'country': 'Россия'})
+        self.assertSameResponse('network-node/', {'search': 'телефон', 'limit': 2})
+        self.assertEqual(self.assertSameResponse('network-node/', {'level': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        page = self.assertSameResponse('network-node/', {'page_size': 2}).json()
+        self.assertSameResponse(page['next'].split('/platform/async/')[1])
+
+        for node in (self.factory, self.retail, self.trader):
+            self.assertSameResponse(f'network-node/{node.pk}/')
+        self.assertEqual(self.assertSameResponse('network-node/0/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_sparse_fields(self):
+        self.assertSameResponse('products/', {'fields': 'id,name'})
+        self.assertSameResponse('network-node/', {'fields': 'id,name,debt', 'page_size': 2})
+        self.assertSameResponse(f'network-node/{self.retail.pk}/', {'expand': 'products,supplier'})
+        self.assertEqual(self.assertSameResponse('network-node/', {'expand': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_async_network_node_tree(self):
+        self.assertSameResponse(f'network-node/{self.factory.pk}/tree/')
+        self.assertSameResponse(f'network-node/{self.factory.pk}/tree/', {'depth': 1, 'fields': 'name,level'})
+        self.assertSameResponse(f'network-node/{self.trader.pk}/ancestors/')
+        self.assertEqual(self.assertSameResponse(f'network-node/{self.factory.pk}/tree/', {'fields': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.assertSameResponse('network-node/0/ancestors/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_permissions(self):
+        self.assertEqual(self.assertSameResponse('network-node/', client=Client()).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.assertSameResponse('products/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'api': '3/min', 'bulk': '1/min', 'export': '1/min'},
+})
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_token_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/platform/products/').status_code, status.HTTP_200_OK)
+        response = self.client.get('/platform/products/')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '20')
+
+        # the async views share the buckets of the viewsets, other endpoints and clients have their own
+        response = self.client.get('/platform/async/products/')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get('/platform/network-node/').status_code, status.HTTP_200_OK)
+        self.assertEqual(Client().get('/platform/products/').status_code, status.HTTP_403_FORBIDDEN)
+
+        # a token is back after a third of a minute
+        now = time.time()
+        with mock.patch('trading_platform.throttling.time.time', return_value=now + 21):
+            self.assertEqual(self.client.get('/platform/products/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/platform/products/').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_export_scope(self):
+        self.assertEqual(self.client.get('/platform/products/export/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/platform/products/export/').status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get('/platform/products/').status_code, status.HTTP_200_OK)
+
+        self.user.is_superuser = True
+        self.user.save()
+        counters = self.client.get('/platform/stats/throttle/').json()
+        self.assertEqual(counters['export'], {'allowed': 1, 'throttled': 1})
+        self.assertEqual(counters['api'], {'allowed': 2, 'throttled': 0})
+
+
+# the primary stands in for the replica, the routing decisions are recorded by read_databases()
+@override_settings(DATABASE_REPLICAS=['default'], DATABASE_REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+        address = {'email': 'email1@example.com', 'city': 'Город', 'street': 'Улица', 'house_number': '1'}
+        self.factory = NetworkNode.objects.create(name='Завод', node_type='Factory', level=0, **address)
+
+    def read_databases(self, method, path, data=None):
+        """
+        Makes the request, reading a streamed body too, and returns the response and the set of databases
+        the router sent its reads to (None for the primary).
+        """
+        databases = set()
+
+        def db_for_read(router, model, **hints):
+            databases.add(get_read_database())
+            return get_read_database()
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            response = getattr(self.client, method)(path, data, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, databases
+
+    def test_safe_api_reads_go_to_replica(self):
+        for path in ('/platform/network-node/', f'/platform/network-node/{self.factory.pk}/tree/',
+                     '/platform/network-node/export/', '/platform/async/network-node/'):
+            response, databases = self.read_databases('get', path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+            self.assertEqual(databases, {'default'}, path)
+            self.assertNotIn(ReplicaMiddleware.pin_cookie, response.cookies)
+
+        response, databases = self.read_databases('get', '/admin/trading_platform/networknode/')
+        self.assertEqual(databases, {None})
+        self.assertIsNone(get_read_database())
+
+    def test_writes_pin_client_to_primary(self):
+        response, databases = self.read_databases('patch', '/platform/network-node/bulk/',
+                                                  [{'id': self.factory.pk, 'name': 'Новый завод'}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(databases, {None})
+        self.assertEqual(response.cookies[ReplicaMiddleware.pin_cookie]['max-age'], 5)
+
+        response, databases = self.read_databases('get', f'/platform/network-node/{self.factory.pk}/')
+        self.assertEqual(response.json()['name'], 'Новый завод')
+        self.assertEqual(databases, {None})
+
+        self.client.cookies.pop(ReplicaMiddleware.pin_cookie)
+        response, databases = self.read_databases('get', f'/platform/network-node/{self.factory.pk}/')
+        self.assertEqual(databases, {'default'})
+
+    def test_replica_reads_after_write_not_cached(self):
+        self.factory.save()
+
+        response, databases = self.read_databases('get', '/platform/network-node/')
+        self.assertEqual(databases, {'default'})
+        self.assertNotIn('ETag', response)
+        response, databases = self.read_databases('get', '/platform/network-node/')
+        self.assertNotIn('ETag', response)
+
+        with self.settings(DATABASE_REPLICA_PIN_SECONDS=0):
+            self.client.get('/platform/network-node/')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/platform/network-node/')
+        self.assertIn('ETag', response)
+        self.assertFalse(any('trading_platform_networknode' in query['sql'] for query in queries))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'Set POSTGRES_REPLICA_HOSTS to test with a replica')
+class ReplicaTestCase(TransactionTestCase):
+    """
+    Runs against the replicas of the settings, which mirror the test database in tests,
+    so they see the rows committed by the test.
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_reads_from_replica(self):
+        replica = settings.DATABASE_REPLICAS[0]
+        with override_settings(DATABASE_REPLICAS=[replica]), CaptureQueriesContext(connections[replica]) as queries:
+            response = self.client.get('/platform/network-node/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(any('trading_platform_networknode' in query['sql'] for query in queries))
+
+
+class TokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        cache.clear()
+        user_cache.clear()
+        Product.objects.create(name='Телефон', model='P-1', release_date='2023-09-10')
+
+    def get_token(self):
+        response = self.client.post('/user/token/', {'email': 'test@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['expires_in'], settings.API_TOKEN_MAX_AGE)
+        return response.json()['token']
+
+    def get(self, path, token):
+        return self.client.get(path, headers={'Authorization': f'Bearer {token}'})
+
+    def test_token(self):
+        response = self.client.post('/user/token/', {'email': 'test@example.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        token = self.get_token()
+        self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get('/platform/async/products/', token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get('/platform/products/', token + 'x').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.get('/platform/async/products/', 'x').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cached_user(self):
+        token = self.get_token()
+        self.get('/platform/products/', token)
+
+        # the user of the token comes from the cache, neither sessions nor users are read
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.get('/platform/async/products/', token).status_code, status.HTTP_200_OK)
+        self.assertFalse([query['sql'] for query in queries if 'user_user' in query['sql']
+                          or 'django_session' in query['sql']])
+
+    def test_user_changes(self):
+        token = self.get_token()
+        self.get('/platform/products/', token)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.get('/platform/async/products/', token).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_200_OK)
+
+    def test_revoke(self):
+        token = self.get_token()
+        response = self.client.post('/user/token/revoke/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.get('/platform/products/', self.get_token()).status_code, status.HTTP_200_OK)
+
+    def test_expired_token(self):
+        token = self.get_token()
+        with override_settings(API_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.get('/platform/products/', token).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class GenerateNetworkTestCase(TestCase):
+    def generate(self, **options):
+        call_command('generate_network', factories=2, retail=5, traders=20, products=10, links_per_node=3,
+                     chunk_size=7, stdout=io.StringIO(), **options)
+        return list(NetworkNode.objects.order_by('id').values_list(
+            'id', 'name', 'city', 'node_type', 'supplier_id', 'level', 'debt'
+        ))
+
+    def test_generate(self):
+        nodes = self.generate(seed=1)
+        self.assertEqual(len(nodes), 27)
+        self.assertEqual(Product.objects.count(), 10)
+        levels = {pk: level for pk, name, city, node_type, supplier, level, debt in nodes}
+        for pk, name, city, node_type, supplier, level, debt in nodes:
+            if node_type == 'Factory':
+                self.assertEqual((supplier, level, debt), (None, 0, 0))
+            else:
+                self.assertEqual(level, levels[supplier] + 1)
+                if node_type == 'RetailNetwork':
+                    self.assertEqual(level, 1)
+
+        links = NetworkNode.products.through.objects.count()
+        self.assertTrue(27 <= links <= 27 * 5)
+        self.assertEqual(sum(Product.objects.values_list('node_count', flat=True)), links)
+        self.assertEqual(sum(DebtMovement.objects.values_list('amount', flat=True)),
+                         sum(debt for *row, debt in nodes))
+        self.assertFalse(NetworkNode.objects.filter(search_document='').exists())
+
+        # the ids continue after the existing rows, and the sequences after the generated ids
+        self.generate(seed=1)
+        self.assertEqual(NetworkNode.objects.count(), 54)
+        node = NetworkNode.objects.create(name='Завод', email='f@example.com', country='Россия', city='Тула',
+                                          street='Мира', house_number='1', node_type='Factory', level=0)
+        self.assertEqual(node.pk, max(NetworkNode.objects.exclude(pk=node.pk).values_list('id', flat=True)) + 1)
+
+    def test_seed(self):
+        nodes = self.generate(seed=1)
+        NetworkNode.objects.all().delete()
+        Product.objects.all().delete()
+        self.assertEqual(self.generate(seed=1), nodes)
+        NetworkNode.objects.all().delete()
+        Product.objects.all().delete()
+        self.assertNotEqual(self.generate(seed=2), nodes)
+
+
+class LoadTestTestCase(LiveServerTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        cache.clear()
+        call_command('generate_network', factories=2, retail=5, traders=20, products=10, stdout=io.StringIO())
+
+    def test_load_test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.json')
+            call_command('load_test', url=self.live_server_url, email='test@example.com', password='testpassword',
+                         requests=60, concurrency=3, output=output, label='base', stderr=io.StringIO())
+            with open(output) as file:
+                report = json.load(file)
+            self.assertEqual(report['requests'], 60)
+            self.assertEqual(report['errors'], 0, report['statuses'])
+            self.assertEqual(sum(scenario['requests'] for scenario in report['scenarios'].values()), 60)
+            self.assertTrue(report['latency_ms']['p50'] <= report['latency_ms']['p95'] <= report['latency_ms']['p99'])
+
+            err = io.StringIO()
+            out = io.StringIO()
+            call_command('load_test', url=self.live_server_url, email='test@example.com', password='testpassword',
+                         requests=10, read_only=True, compare=output, stdout=out, stderr=err)
+            report = json.loads(out.getvalue())
+            self.assertFalse(report['scenarios'].keys() & {'node_create', 'node_update', 'node_delete',
+                                                           'product_upsert'})
+            self.assertIn('compared to base', err.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('load_test', url=self.live_server_url, email='test@example.com', password='wrong')
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.force_login(self.user)
+        cache.clear()
+        NetworkNode.objects.create(name='Завод', email='f@example.com', country='Россия', city='Тула',
+                                   street='Мира', house_number='1', node_type='Factory', level=0)
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, duration, *description = metric.split(';')
+            metrics[name] = float(duration.removeprefix('dur='))
+        return metrics
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/platform/network-node/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        metrics = self.server_timing(response)
+        self.assertEqual(set(metrics), {'db', 'auth', 'permission', 'throttle', 'serialize', 'render', 'total'})
+        # the phases are exclusive, so they add up to at most the total, give or take the rounding
+        total = metrics.pop('total')
+        self.assertLessEqual(sum(metrics.values()), total + 0.4)
+
+        metrics = self.server_timing(self.client.get('/platform/async/network-node/'))
+        self.assertEqual(set(metrics), {'db', 'auth', 'permission', 'throttle', 'serialize', 'total'})
+
+        with override_settings(SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get('/platform/network-node/'))
+
+    def test_metrics(self):
+        self.client.get('/platform/network-node/')
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(Client().get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code,
+                             status.HTTP_403_FORBIDDEN)
+            response = Client().get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('# TYPE api_request_duration_seconds histogram', content)
+        self.assertIn('api_request_phase_seconds_count{view="networknode",action="list",phase="serialize"}', content)
+        self.assertIn('api_request_queries_bucket{view="networknode",action="list",le="+Inf"}', content)
+        self.assertIn('api_cache_responses_total{view="networknode",event="misses"}', content)
+        self.assertIn('api_throttle_requests_total{scope="api",event="allowed"}', content)
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    def test_processes(self):
+        labels = (('view', 'networknode'), ('action', 'list'))
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            first, second = Registry(), Registry()
+            first.observe('api_request_queries', labels, 3)
+            second.observe('api_request_queries', labels, 3)
+            second.observe('api_request_queries', labels, 600)
+            first.flush()
+            second.flush()
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            # each process adds the files of the others to its own histograms
+            first.observe('api_request_queries', labels, 1)
+            entry = first.collect()[('api_request_queries', labels)]
+        self.assertEqual(entry, [0, 1, 0, 2, 0, 0, 0, 0, 0, 0, 1, 607.0])
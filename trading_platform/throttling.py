@@ -0,0 +1,111 @@
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from trading_platform.cache import count, get_counters
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Returns the (capacity, seconds) of a rate such as '1200/min': a bucket of 1200 tokens refilled in 60 seconds.
+    Returns None for no rate.
+    """
+    if rate is None:
+        return None
+    number, period = rate.split('/')
+    return int(number), DURATIONS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits the requests of every client to every endpoint with a token bucket.
+
+    A bucket holds up to 'capacity' tokens and is refilled at capacity / seconds tokens a second, from the rate
+    of the scope of the action in DEFAULT_THROTTLE_RATES (e.g. '1200/min'). A request takes cost tokens and
+    is refused with 429 and a Retry-After header when the bucket runs dry, so a client may burst up to
+    the capacity and then gets the refill rate. The actions of action_scopes have stricter rates of their own,
+    the others share the default scope. A scope without a rate is not throttled.
+
+    A bucket is keyed by the user, or the client address for anonymous requests, and the endpoint (the view
+    and the action), and lives in the default cache, so a check costs a cache read and write and no query.
+    With a per-process cache (the default LocMemCache) every process has its own buckets; use a shared cache
+    backend to limit a client across processes. Concurrent requests of one client may race for the last tokens,
+    which lets a few requests more through but never blocks one that should pass.
+
+    The allowed and throttled requests are counted per scope, see get_throttle_counters().
+    """
+
+    default_scope = 'api'
+    action_scopes = {'export': 'export', 'bulk': 'bulk', 'bulk_upsert': 'bulk', 'move': 'bulk'}
+    cost = 1
+
+    def get_scope(self, view):
+        return self.action_scopes.get(getattr(view, 'action', None), self.default_scope)
+
+    def get_rate(self, scope):
+        return parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'addr:{self.get_ident(request)}'
+        endpoint = getattr(view, 'basename', None) or type(view).__name__
+        return f'api:throttle:{ident}:{endpoint}:{getattr(view, "action", None) or request.method}'
+
+    def take(self, bucket, capacity, seconds):
+        """
+        Takes the cost of a request from the bucket, a (tokens, time) pair or None for a full one.
+        Returns the new bucket and whether the request is allowed, and sets self.wait_seconds if it is not.
+        """
+        # wall-clock time, the bucket may be shared by processes on several hosts
+        now = time.time()
+        tokens = capacity
+        if bucket is not None:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * capacity / seconds)
+        if tokens < self.cost:
+            self.wait_seconds = (self.cost - tokens) * seconds / capacity
+            return (tokens, now), False
+        return (tokens - self.cost, now), True
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        # an untouched bucket is full again after the refill time, so it expires then
+        bucket, allowed = self.take(cache.get(key), *rate)
+        cache.set(key, bucket, rate[1])
+        count(f'throttle:{scope}', 'allowed' if allowed else 'throttled')
+        return allowed
+
+    async def aallow_request(self, request, view):
+        """
+        Async version of allow_request(), for the async views.
+        """
+        scope = self.get_scope(view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        bucket, allowed = self.take(await cache.aget(key), *rate)
+        await cache.aset(key, bucket, rate[1])
+        count(f'throttle:{scope}', 'allowed' if allowed else 'throttled')
+        return allowed
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+def get_throttle_counters():
+    """
+    Returns the allowed and throttled requests per scope of DEFAULT_THROTTLE_RATES as {scope: {event: value}}.
+    """
+    scopes = list(api_settings.DEFAULT_THROTTLE_RATES)
+    counters = get_counters([f'throttle:{scope}' for scope in scopes], events=('allowed', 'throttled'))
+    return {scope: counters[f'throttle:{scope}'] for scope in scopes}
@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from trading_platform.apiviews import ProductViewSet, NetworkNodeViewSet
+from trading_platform.apiviews import DebtMovementViewSet, ProductViewSet, NetworkNodeViewSet, NetworkStatsViewSet
 from trading_platform.apps import TradingPlatformConfig
+from trading_platform.asyncviews import AsyncNetworkNodeView, AsyncProductView
 
 app_name = TradingPlatformConfig.name
 
@@ -10,7 +11,21 @@ router = DefaultRouter()
 
 router.register(r'products', ProductViewSet)
 router.register(r'network-node', NetworkNodeViewSet)
+router.register(r'debt-movements', DebtMovementViewSet)
+router.register(r'stats', NetworkStatsViewSet, basename='stats')
+
+# async read-only versions of the list, retrieve, tree and ancestors actions, for ASGI deployments
+async_urlpatterns = [
+    path('products/', AsyncProductView.as_view(action='list'), name='product-list'),
+    path('products/<int:pk>/', AsyncProductView.as_view(action='retrieve'), name='product-detail'),
+    path('network-node/', AsyncNetworkNodeView.as_view(action='list'), name='networknode-list'),
+    path('network-node/<int:pk>/', AsyncNetworkNodeView.as_view(action='retrieve'), name='networknode-detail'),
+    path('network-node/<int:pk>/tree/', AsyncNetworkNodeView.as_view(action='tree'), name='networknode-tree'),
+    path('network-node/<int:pk>/ancestors/', AsyncNetworkNodeView.as_view(action='ancestors'),
+         name='networknode-ancestors'),
+]
 
 urlpatterns = [
+    path('async/', include((async_urlpatterns, 'async'))),
     path('', include(router.urls)),
 ]
@@ -1,3 +1,18 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from trading_platform.metrics import render_metrics
+
+
+def metrics(request):
+    """
+    Serves the request histograms and the cache and throttle counters in the Prometheus text format,
+    to the bearer of METRICS_TOKEN and to superusers.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token = settings.METRICS_TOKEN
+    if not (token and hmac.compare_digest(authorization, f'Bearer {token}')) and not request.user.is_superuser:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,8 +1,41 @@
-from rest_framework import generics, permissions
+from django.conf import settings
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from user.serializers import UserSerializer
+from user.serializers import TokenSerializer, UserSerializer
+from user.tokens import issue_token, revoke_tokens
 
 
 class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+
+
+class TokenView(generics.GenericAPIView):
+    """
+    Issues a signed API token for the email and password in the body.
+    The token is sent as "Authorization: Bearer <token>" and is valid for 'expires_in' seconds.
+    """
+    serializer_class = TokenSerializer
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            'token': issue_token(serializer.validated_data['user']),
+            'expires_in': settings.API_TOKEN_MAX_AGE,
+        })
+
+
+class RevokeTokensView(APIView):
+    """
+    Revokes all the API tokens of the current user.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        revoke_tokens(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
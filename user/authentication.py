@@ -0,0 +1,52 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+from user.tokens import aget_token_user, get_token_user
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    """
+    Authenticates API clients by the signed tokens of user.tokens, sent as "Authorization: Bearer <token>".
+
+    The tokens are stateless: the signature, the expiry and the token version are checked against
+    the cached user (see user.tokens.UserCache), so a request costs no query while the user is cached.
+    """
+
+    keyword = 'Bearer'
+
+    def get_token(self, request):
+        """
+        Returns the token of the Authorization header, or None if the header is not a Bearer one.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+    def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+        return self.check_user(get_token_user(token), token)
+
+    async def aauthenticate(self, request):
+        """
+        Async version of authenticate(), for the async views.
+        """
+        token = self.get_token(request)
+        if token is None:
+            return None
+        return self.check_user(await aget_token_user(token), token)
+
+    def check_user(self, user, token):
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
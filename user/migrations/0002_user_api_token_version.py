@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='api_token_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented to revoke all API tokens of the user.', verbose_name='API token version'),
+        ),
+    ]
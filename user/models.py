@@ -21,6 +21,9 @@ class CustomUserManager(BaseUserManager):
 class User(AbstractUser):
     username = None
     email = models.EmailField(verbose_name='Email address', unique=True)
+    api_token_version = models.PositiveIntegerField(
+        default=0, verbose_name='API token version', help_text='Incremented to revoke all API tokens of the user.'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from django.contrib.auth import get_user_model
+from django.contrib.auth import authenticate, get_user_model
 
 User = get_user_model()
 
@@ -19,3 +19,21 @@ class UserSerializer(serializers.ModelSerializer):
         """
         user = User.objects.create_user(**validated_data)
         return user
+
+
+class TokenSerializer(serializers.Serializer):
+    """
+    A Serializer for the credentials exchanged for an API token.
+    """
+    email = serializers.EmailField(write_only=True)
+    password = serializers.CharField(write_only=True, trim_whitespace=False)
+
+    def validate(self, attrs):
+        """
+        Checks the credentials and adds the user to the validated data.
+        """
+        user = authenticate(self.context.get('request'), email=attrs['email'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with provided credentials.')
+        attrs['user'] = user
+        return attrs
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user.models import User
+from user.tokens import user_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drops the user from the token user cache, so a change of is_active, is_superuser or the token version
+    applies to the next request of this process.
+    """
+    user_cache.delete(instance.pk)
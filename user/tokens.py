@@ -0,0 +1,127 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+
+from user.models import User
+
+SALT = 'user.api-token'
+
+# The fields a token request needs: the user is built from them without touching the database
+USER_FIELDS = ('id', 'is_active', 'is_superuser', 'is_staff', 'api_token_version')
+
+
+class UserCache:
+    """
+    In-process cache of the USER_FIELDS of the users that authenticate with tokens.
+
+    Entries expire after API_TOKEN_USER_CACHE_TTL seconds and are dropped when the user is saved or deleted
+    in this process (see user.signals), so a change made by another process is seen after the TTL at the latest.
+    At most max_size users are kept.
+    """
+
+    max_size = 10000
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, user_id, values):
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                now = time.monotonic()
+                self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= now}
+                if len(self.entries) >= self.max_size:
+                    self.entries.clear()
+            self.entries[user_id] = (time.monotonic() + settings.API_TOKEN_USER_CACHE_TTL, values)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+def issue_token(user):
+    """
+    Returns a signed API token of the user, valid for API_TOKEN_MAX_AGE seconds or until revoke_tokens().
+    """
+    return signing.dumps([user.pk, user.api_token_version], salt=SALT)
+
+
+def revoke_tokens(user):
+    """
+    Revokes all the API tokens issued to the user so far.
+    """
+    User.objects.filter(pk=user.pk).update(api_token_version=F('api_token_version') + 1)
+    user.refresh_from_db(fields=['api_token_version'])
+    user_cache.delete(user.pk)
+
+
+def read_token(token):
+    """
+    Returns the (user id, token version) of a token, or raises signing.BadSignature,
+    or signing.SignatureExpired, a subclass of it.
+    """
+    try:
+        user_id, version = signing.loads(token, salt=SALT, max_age=settings.API_TOKEN_MAX_AGE)
+    except ValueError:
+        raise signing.BadSignature('Malformed token.')
+    return user_id, version
+
+
+def _build_user(values, version):
+    """
+    Returns the user of the cached values, with the other fields deferred, if the token version is current.
+    """
+    if values is None or values['api_token_version'] != version:
+        return None
+    # from_db() takes the values in the order of the model fields
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db('default', names, [values[name] for name in names])
+
+
+def get_token_user(token):
+    """
+    Returns the active or inactive user of a valid token, or None if the token is invalid, expired or revoked.
+    Costs no query while the user is cached.
+    """
+    try:
+        user_id, version = read_token(token)
+    except signing.BadSignature:
+        return None
+    values = user_cache.get(user_id)
+    if values is None:
+        values = User.objects.filter(pk=user_id).values(*USER_FIELDS).first()
+        if values is not None:
+            user_cache.set(user_id, values)
+    return _build_user(values, version)
+
+
+async def aget_token_user(token):
+    """
+    Async version of get_token_user().
+    """
+    try:
+        user_id, version = read_token(token)
+    except signing.BadSignature:
+        return None
+    values = user_cache.get(user_id)
+    if values is None:
+        values = await User.objects.filter(pk=user_id).values(*USER_FIELDS).afirst()
+        if values is not None:
+            user_cache.set(user_id, values)
+    return _build_user(values, version)
@@ -1,10 +1,12 @@
 from django.urls import path, include
 
-from user.apiviews import CreateUserView
+from user.apiviews import CreateUserView, RevokeTokensView, TokenView
 from user.apps import UserConfig
 
 app_name = UserConfig.name
 
 urlpatterns = [
     path('register/', CreateUserView.as_view(), name='register'),
+    path('token/', TokenView.as_view(), name='token'),
+    path('token/revoke/', RevokeTokensView.as_view(), name='token-revoke'),
 ]